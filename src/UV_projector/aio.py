@@ -0,0 +1,171 @@
+"""
+asyncio front-end for the DLPC1438 controller.
+
+    DMD = await AsyncDLPC1438.create(i2c, spi)
+    await DMD.switch_mode(Mode.EXTERNALPRINT)
+    await DMD.send_pixeldata_to_buffer(pixel_data, 0, 0)
+    await DMD.swap_buffer()
+    await DMD.expose(120)  # cancelling this task stops the exposure
+
+All blocking bus I/O runs on a single dedicated worker thread, so commands are executed in the
+order they were awaited. Waiting for the status pins does not occupy the worker (or sleep): the
+GPIO edge callbacks wake the waiting coroutine through the event loop. Neither does the time a
+mode switch takes, so other commands awaited meanwhile run during the switch.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import logging
+
+from UV_projector.controller import DLPC1438, Mode
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDLPC1438:
+    """
+    Awaitable wrapper around a DLPC1438 instance. Use create() to also run the (slow) startup of
+    the DLPC1438 on the worker thread.
+
+    Cancelling an awaited call that is already running on the worker does not interrupt it (the
+    bus transaction is completed), except for exposures: cancelling expose() or
+    wait_exposure_done() stops the running exposure with stop_exposure().
+    """
+
+    def __init__(self, dmd, executor=None):
+        self.dmd = dmd
+        self._own_executor = executor is None  # a given executor is left running by close()
+        self._executor = executor if executor is not None else \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="dlpc1438")
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """Construct (and start up) a DLPC1438 on the worker thread, with the DLPC1438 arguments."""
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="dlpc1438")
+        dmd = await asyncio.get_running_loop().run_in_executor(executor, functools.partial(DLPC1438, *args, **kwargs))
+        instance = cls(dmd, executor)
+        instance._own_executor = True
+        return instance
+
+    async def _call(self, function, *args, **kwargs):
+        """Run a blocking DLPC1438 call on the worker thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def close(self):
+        """
+        Wait for the queued commands to finish and stop the worker thread. An executor that was
+        passed to the constructor is not shut down.
+        """
+        if self._own_executor:
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        else:
+            await self._call(lambda: None)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # -- bus commands (run in order on the worker) --
+
+    async def configure_external_print(self, LED_PWM, skip_FPGA_video=False, verify=None):
+        return await self._call(self.dmd.configure_external_print, LED_PWM, skip_FPGA_video, verify)
+
+    async def switch_mode(self, new_mode, verify=None):
+        """Switch the operational mode like DLPC1438.switch_mode(), waiting on the event loop."""
+        if await self._call(self.dmd._start_mode_switch, new_mode):
+            await asyncio.sleep(self.dmd.MODE_SWITCH_TIME)
+            await self._call(self.dmd._finish_mode_switch, new_mode, verify)
+        if new_mode == Mode.EXTERNALPRINT:
+            await self.wait_sys_ready()
+
+    async def set_background(self, intensity, both_buffers=False):
+        return await self._call(self.dmd.set_background, intensity, both_buffers)
+
+    async def fill_region(self, intensity, xoffset, yoffset, width, height, cache=True):
+        return await self._call(self.dmd.fill_region, intensity, xoffset, yoffset, width, height, cache)
+
+    async def send_pixeldata_to_buffer(self, pixeldata, xoffset, yoffset):
+        return await self._call(self.dmd.send_pixeldata_to_buffer, pixeldata, xoffset, yoffset)
+
+    async def send_image_to_buffer(self, filename, xoffset, yoffset):
+        return await self._call(self.dmd.send_image_to_buffer, filename, xoffset, yoffset)
+
+    async def send_stack_layer(self, layer):
+        return await self._call(self.dmd.send_stack_layer, layer)
+
+    async def send_regions(self, placements):
+        return await self._call(self.dmd.send_regions, placements)
+
+    async def send_encoded_frame(self, encoded_frame):
+        return await self._call(self.dmd.send_encoded_frame, encoded_frame)
+
+    async def swap_buffer(self, verify=None):
+        return await self._call(self.dmd.swap_buffer, verify)
+
+    async def expose_pattern(self, exposed_frames, dark_frames=5):
+        return await self._call(self.dmd.expose_pattern, exposed_frames, dark_frames)
+
+    async def stop_exposure(self):
+        return await self._call(self.dmd.stop_exposure)
+
+    # -- waiting on the status pins (on the event loop) --
+
+    async def wait_for_pin(self, pin, level, timeout=None):
+        """
+        Wait until pin is at the given level, woken by the GPIO edge callback. Returns the time
+        waited, or raises TimeoutError.
+        """
+        loop = asyncio.get_running_loop()
+        reached = loop.create_future()
+
+        def on_edge(edge_pin, edge_level, timestamp):
+            if edge_level == level:
+                loop.call_soon_threadsafe(lambda: reached.done() or reached.set_result(timestamp))
+
+        start = loop.time()
+        events = self.dmd.events
+        events.add_listener(pin, on_edge)
+        try:
+            # checked after registering the listener, so an edge in between is not missed
+            if self.dmd.gpio.input(pin) != level:
+                try:
+                    await asyncio.wait_for(reached, timeout)
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"GPIO {pin} did not go {'high' if level else 'low'} within {timeout} seconds") from None
+        finally:
+            events.remove_listener(pin, on_edge)
+        return loop.time() - start
+
+    async def wait_sys_ready(self, timeout=None):
+        return await self.wait_for_pin(self.dmd.SYS_RDY, self.dmd.gpio.HIGH,
+                                       self.dmd.SYS_RDY_TIMEOUT if timeout is None else timeout)
+
+    async def wait_spi_ready(self, timeout=1):
+        return await self.wait_for_pin(self.dmd.SPI_RDY, self.dmd.gpio.HIGH, timeout)
+
+    async def wait_exposure_done(self, timeout=None):
+        """
+        Wait for the current exposure to finish (PRINT_ACTIVE going low). If the waiting task is
+        cancelled, the exposure is stopped.
+        """
+        try:
+            return await self.wait_for_pin(self.dmd.PRINT_ACTIVE, self.dmd.gpio.LOW, timeout)
+        except asyncio.CancelledError:
+            logger.info("Exposure wait was cancelled, stopping the exposure")
+            await asyncio.shield(self.stop_exposure())
+            raise
+
+    async def expose(self, exposed_frames, dark_frames=5, timeout=None):
+        """
+        Expose the active buffer and wait for the exposure to finish. Cancelling this coroutine
+        (e.g. when the print is aborted) stops the exposure.
+        """
+        try:
+            await self.expose_pattern(exposed_frames, dark_frames)
+        except asyncio.CancelledError:
+            # the exposure command is still completed by the worker, so stop it right after that
+            await asyncio.shield(self.stop_exposure())
+            raise
+        return await self.wait_exposure_done(timeout)
@@ -0,0 +1,556 @@
+"""
+Benchmarks for the UV_projector package that do not need any hardware attached.
+
+Run from the src directory with:
+
+    python -m UV_projector.bench [encoder|layer-stack|crc|sequencer]
+
+The suite runs the DLPC1438 class itself (against an emulated I2C bus and a null SPI sink) through
+a fixed set of scenarios, and can store the results as JSON to compare two runs, e.g. before and
+after a change:
+
+    python -m UV_projector.bench suite --output before.json
+    python -m UV_projector.bench suite --output after.json
+    python -m UV_projector.bench compare before.json after.json
+"""
+import argparse
+import contextlib
+import gc
+import hashlib
+import itertools
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+from UV_projector import layer_stack, spi_packet
+from UV_projector.controller import DLPC1438, Mode
+from UV_projector.crc import crc16
+from UV_projector.emulator import EmulatedProjector, TimingModel
+from UV_projector.img_convert import image_to_arr
+from UV_projector.sequencer import Sequencer, MODES as SEQUENCER_MODES
+from UV_projector.spi_packet import SPIPacketEncoder, rowcol_data_block
+
+SUITE_VERSION = 3
+DEFAULT_SPI_HZ = 32000000  # for the projected wire time
+
+# metrics checked by the compare mode, with the smallest difference that counts as a change
+# (below it, timer resolution and noise dominate)
+COMPARED_METRICS = {
+    "wall_seconds": 0.0005,
+    "cpu_seconds": 0.0005,
+    "peak_bytes": 65536,
+    "allocated_blocks": 16,
+    "page_faults": 16,
+    "spi_bytes": 0,
+}
+
+
+class NullSPI:
+    """Stand-in for spidev.SpiDev that only counts the bytes it is asked to send."""
+
+    max_speed_hz = 125000000
+
+    def __init__(self):
+        self.bytes_sent = 0
+        self.transfers = 0
+        self.recording = None  # hash object the sent bytes are fed into, while recording
+
+    def writebytes2(self, data):
+        self.bytes_sent += len(data)
+        self.transfers += 1
+        if self.recording is not None:
+            self.recording.update(bytes(data))
+
+
+class _CopyCounter:
+    """
+    Keeps track of the buffers allocated and the bytes copied while packets are generated: arrays
+    materialised by the legacy encoder are reported by calling the counter, packets written into
+    a buffer by write_packet() (see counting_writes()) with written().
+    """
+
+    def __init__(self, buffers=()):
+        self.allocations = 0
+        self.bytes_copied = 0
+        self._buffers = {id(buffer) for buffer in buffers}  # existing buffers, which are not allocations
+
+    def reset(self):
+        self.allocations = 0
+        self.bytes_copied = 0
+
+    def __call__(self, arr):
+        if arr.flags.owndata:
+            self.allocations += 1
+            self.bytes_copied += arr.nbytes
+        return arr
+
+    def written(self, buffer, nbytes):
+        if id(buffer) not in self._buffers:
+            self._buffers.add(id(buffer))
+            self.allocations += 1
+        self.bytes_copied += nbytes
+
+
+@contextlib.contextmanager
+def counting_writes(counter):
+    """Report every packet the SPIPacketEncoder writes (and the buffer it writes it into) to counter."""
+    write_packet = spi_packet.write_packet
+
+    def counted_write_packet(buffer, *args):
+        length = write_packet(buffer, *args)
+        counter.written(buffer if buffer.base is None else buffer.base, length)
+        return length
+
+    spi_packet.write_packet = counted_write_packet
+    try:
+        yield counter
+    finally:
+        spi_packet.write_packet = write_packet
+
+
+def legacy_split_packets(offset_width, offset_height, pixel_data, buffersize, counter):
+    """
+    Generator reproducing the packet generation of the original split_spi_transmission
+    (np.pad, np.split, flatten, np.append and np.insert), reporting every array it materialises
+    to `counter`.
+    """
+    img_width, img_height = pixel_data.shape
+    col_start = math.floor(offset_width / 128)
+    row_start = math.floor(offset_height / 2)
+    pad_width_start = offset_width % 128
+    pad_height_start = offset_height % 2
+    pad_width_end = (128 - (img_width + pad_width_start) % 128) % 128
+    pad_height_end = (2 - pad_height_start + img_height) % 2
+
+    padded_data = counter(np.pad(pixel_data, ((pad_width_start, pad_width_end), (pad_height_start, pad_height_end))))
+    width, height = padded_data.shape
+    col_end = int(col_start + width / 128 - 1)
+
+    num_rows = math.floor(((buffersize - 10) / width) / 2) * 2
+    num_transfers = math.ceil(height / num_rows)
+    split_data = np.split(padded_data, [(i + 1) * num_rows for i in range(num_transfers - 1)], axis=1)
+
+    row_tracker = 0
+    for (transfer_idx, data) in enumerate(split_data):
+        rowcol = list(rowcol_data_block(col_start, col_end, row_start + row_tracker).to_bytes(4, byteorder='little'))
+        if transfer_idx == 0:
+            preamble = [0x04] + rowcol + [0x00] + list((padded_data.size).to_bytes(4, byteorder='little'))
+        else:
+            preamble = [0x04] + rowcol + [0x00]
+        preamble = np.array(preamble, dtype=np.uint8)
+        row_tracker += int(data.shape[1] / 2)
+
+        data = counter(data.flatten("F"))
+        if transfer_idx == (num_transfers - 1):
+            data = counter(np.append(data, np.array([0x00, 0x00, 0x00, 0x00], dtype=np.uint8)))
+
+        yield counter(np.insert(data, 0, preamble))
+
+
+def _measure(send_frame, repeats):
+    """Run send_frame() a number of times, returning (seconds per frame, peak traced bytes)."""
+    send_frame()  # warm up, so one-off allocations (e.g. the packet pool) are not counted
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        send_frame()
+    duration = (time.perf_counter() - start) / repeats
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    return duration, peak
+
+
+def bench_encoder(width=2560, height=1440, offset_width=0, offset_height=0, buffersize=65536, repeats=5):
+    """
+    Compare the legacy split/pad/insert packet generation with the zero-copy SPIPacketEncoder,
+    reporting buffer allocations, bytes copied and peak memory per frame.
+    """
+    pixel_data = np.transpose(np.random.default_rng(0).integers(0, 256, (height, width), dtype=np.uint8))
+    spi = NullSPI()
+
+    counter = _CopyCounter()
+
+    def send_legacy():
+        for packet in legacy_split_packets(offset_width, offset_height, pixel_data, buffersize, counter):
+            spi.writebytes2(packet)
+
+    encoder = SPIPacketEncoder(buffersize)
+
+    def send_encoder():
+        for packet in encoder.packets(offset_width, offset_height, pixel_data):
+            spi.writebytes2(packet)
+
+    legacy_time, legacy_peak = _measure(send_legacy, repeats)
+    encoder_time, encoder_peak = _measure(send_encoder, repeats)
+
+    # count a single frame of both, after the warm up (the packet pool was allocated up front)
+    counter.reset()
+    send_legacy()
+    encoder_counter = _CopyCounter(encoder.pool)
+    with counting_writes(encoder_counter):
+        send_encoder()
+
+    plan = encoder.plan(offset_width, offset_height, pixel_data)
+    print(f"Encoding a {width}x{height} frame at offset ({offset_width},{offset_height}), "
+          f"{plan.num_transfers} SPI transfers of {buffersize} bytes max")
+    print(f"{'':10s}{'time/frame':>14s}{'allocations':>14s}{'bytes copied':>16s}{'peak memory':>16s}")
+    for (name, duration, counted, peak) in (("legacy", legacy_time, counter, legacy_peak),
+                                            ("encoder", encoder_time, encoder_counter, encoder_peak)):
+        print(f"{name:10s}{duration*1000:>11.1f} ms{counted.allocations:>14d}{counted.bytes_copied:>16,d}{peak:>16,d}")
+
+
+def bench_layer_stack(num_layers=10, folder=None):
+    """
+    Compare the per-layer preparation time of PNG decoding with image_to_arr against reading the
+    same layers from a memory-mapped layer stack (both including the packet encoding).
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if folder is None:
+            # synthetic layers: a disc of varying size in the middle of the frame
+            folder = tmpdir
+            x, y = np.ogrid[:1440, :2560]
+            for i in range(num_layers):
+                radius = 200 + 20 * i
+                disc = ((x - 720) ** 2 + (y - 1280) ** 2 < radius ** 2).astype(np.uint8) * 255
+                Image.fromarray(disc).save(os.path.join(folder, f"{i:05d}.png"))
+
+        files = layer_stack.image_folder_files(folder)
+        stack_path = os.path.join(tmpdir, "job.uvls")
+        layer_stack.convert_image_folder(folder, stack_path, exposure_frames=60)
+        stack = layer_stack.LayerStack(stack_path)
+
+        encoder = SPIPacketEncoder()
+        spi = NullSPI()
+
+        start = time.perf_counter()
+        for filename in files:
+            pixel_data = image_to_arr(filename)
+            for packet in encoder.packets(0, 0, pixel_data):
+                spi.writebytes2(packet)
+        png_time = (time.perf_counter() - start) / len(files)
+        png_bytes, spi.bytes_sent = spi.bytes_sent, 0
+
+        start = time.perf_counter()
+        for layer in stack:
+            if not layer.empty:
+                for packet in encoder.packets(layer.xoffset, layer.yoffset, layer.pixel_data):
+                    spi.writebytes2(packet)
+        stack_time = (time.perf_counter() - start) / len(stack)
+
+        print(f"{len(files)} layers, stack file size {os.path.getsize(stack_path):,d} bytes")
+        print(f"{'':14s}{'time/layer':>14s}{'SPI bytes/layer':>18s}")
+        print(f"{'image_to_arr':14s}{png_time*1000:>11.1f} ms{png_bytes / len(files):>18,.0f}")
+        print(f"{'layer stack':14s}{stack_time*1000:>11.1f} ms{spi.bytes_sent / len(stack):>18,.0f}")
+
+
+def bench_crc(width=2560, height=1440, repeats=5):
+    """Cost of computing the CRC16 of a frame while it is encoded into SPI packets."""
+    pixel_data = np.transpose(np.random.default_rng(0).integers(0, 256, (height, width), dtype=np.uint8))
+    spi = NullSPI()
+
+    results = {}
+    for crc in (False, True):
+        encoder = SPIPacketEncoder(crc=crc)
+
+        def send_frame():
+            for packet in encoder.packets(0, 0, pixel_data):
+                spi.writebytes2(packet)
+
+        results[crc], _ = _measure(send_frame, repeats)
+
+    # the CRC on its own, in a separate pass over the (contiguous) frame
+    frame = np.ascontiguousarray(pixel_data.T)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        crc16(frame)
+    separate = (time.perf_counter() - start) / repeats
+
+    print(f"Encoding a {width}x{height} frame ({frame.nbytes / 1e6:.1f} MB of pixel data)")
+    print(f"{'without CRC':24s}{results[False]*1000:>11.1f} ms")
+    print(f"{'with CRC':24s}{results[True]*1000:>11.1f} ms")
+    print(f"{'CRC cost per frame':24s}{(results[True] - results[False])*1000:>11.1f} ms "
+          f"({frame.nbytes / max(results[True] - results[False], 1e-9) / 1e6:.0f} MB/s)")
+    print(f"{'CRC as a separate pass':24s}{separate*1000:>11.1f} ms")
+
+
+def _profile(operation, repeats):
+    """
+    Run operation() a number of times after a warm up run, returning the median and minimum wall
+    time, the median CPU time and the minor page faults per run (memory that had to be mapped in
+    fresh, mostly by large temporary arrays). The peak memory of one more run is traced separately,
+    as tracing slows down allocations. That run also counts the memory blocks it allocated that were
+    still allocated after it (from a tracemalloc snapshot before and after it), e.g. buffers added
+    to a cache or a pool.
+    """
+    operation()
+    gc.collect()
+
+    wall_times = []
+    cpu_times = []
+    page_faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    for _ in range(repeats):
+        (wall, cpu) = (time.perf_counter(), time.process_time())
+        operation()
+        wall_times.append(time.perf_counter() - wall)
+        cpu_times.append(time.process_time() - cpu)
+    page_faults = (resource.getrusage(resource.RUSAGE_SELF).ru_minflt - page_faults) / repeats
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    operation()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    # leave out the snapshots themselves
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<unknown>")]
+    allocated_blocks = sum(max(stat.count_diff, 0)
+                           for stat in after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "traceback"))
+
+    return {
+        "wall_seconds": statistics.median(wall_times),
+        "wall_seconds_min": min(wall_times),
+        "cpu_seconds": statistics.median(cpu_times),
+        "peak_bytes": peak,
+        "allocated_blocks": allocated_blocks,
+        "page_faults": page_faults,
+    }
+
+
+def _suite_scenarios(dmd, folder):
+    """(name, description, operation) of every scenario of the suite."""
+    rng = np.random.default_rng(0)
+    full_frame = np.transpose(rng.integers(0, 256, (1440, 2560), dtype=np.uint8))
+    hd_frame = np.ascontiguousarray(full_frame[:1280, :720])
+    odd_frame = np.ascontiguousarray(full_frame[:1001, :601])
+    block = np.ascontiguousarray(full_frame[:128, :2])
+
+    # a typical layer image: a filled disc with a hole, in the middle of the frame
+    (x, y) = np.ogrid[:1440, :2560]
+    distance = (x - 720) ** 2 + (y - 1280) ** 2
+    layer = ((distance < 600 ** 2) & (distance > 200 ** 2)).astype(np.uint8) * 255
+    png_path = os.path.join(folder, "layer.png")
+    Image.fromarray(layer).save(png_path)
+
+    return [
+        ("full_frame", "2560x1440 frame at (0, 0)", lambda: dmd.send_pixeldata_to_buffer(full_frame, 0, 0)),
+        ("720p", "1280x720 frame at (640, 360)", lambda: dmd.send_pixeldata_to_buffer(hd_frame, 640, 360)),
+        ("odd_offset", "1001x601 frame at (77, 333), padded to the 128x2 blocks",
+         lambda: dmd.send_pixeldata_to_buffer(odd_frame, 77, 333)),
+        ("tiny_block", "single 128x2 block at (1280, 720)", lambda: dmd.send_pixeldata_to_buffer(block, 1280, 720)),
+        ("clear", "set_background(0) (cached fill)", lambda: dmd.set_background(0)),
+        ("clear_uncached", "fill of the full frame without the fill cache",
+         lambda: dmd.fill_region(0, 0, 0, 2560, 1440, cache=False)),
+        ("png_decode", "image_to_arr of a 2560x1440 layer PNG", lambda: image_to_arr(png_path)),
+        ("png_send", "send_image_to_buffer of a 2560x1440 layer PNG", lambda: dmd.send_image_to_buffer(png_path, 0, 0)),
+    ]
+
+
+def bench_suite(repeats=10, spi_hz=DEFAULT_SPI_HZ, scenarios=None, output=None):
+    """
+    Run the scenarios of the suite (all by default) on a DLPC1438 with a null SPI sink and print
+    the wall time, CPU time, peak memory, page faults, SPI bytes and the time those bytes take on
+    the wire at spi_hz, per run. The results are written as JSON to `output` if given.
+    """
+    projector = EmulatedProjector(powered=True)
+    spi = NullSPI()
+    spi.max_speed_hz = spi_hz
+    dmd = DLPC1438(projector.i2c, spi, gpio=projector.gpio, spi_bufsiz=65536, warm_start=True)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for (name, description, operation) in _suite_scenarios(dmd, tmpdir):
+            if scenarios and name not in scenarios:
+                continue
+
+            # record a digest of the SPI output of a single run, so changes in what is sent show up
+            spi.recording = hashlib.blake2b(digest_size=16)
+            (bytes_sent, transfers) = (spi.bytes_sent, spi.transfers)
+            operation()
+            result = {
+                "description": description,
+                "spi_bytes": spi.bytes_sent - bytes_sent,
+                "spi_transfers": spi.transfers - transfers,
+                "spi_digest": spi.recording.hexdigest(),
+            }
+            spi.recording = None
+
+            result.update(_profile(operation, repeats))
+            result["wire_seconds"] = result["spi_bytes"] * 8 / spi_hz
+            results[name] = result
+
+    print(f"{len(results)} scenarios, {repeats} runs each, wire time at {spi_hz / 1e6:.0f} MHz")
+    print(f"{'':16s}{'wall':>11s}{'cpu':>11s}{'wire':>11s}{'peak memory':>14s}{'allocations':>13s}{'page faults':>13s}{'SPI bytes':>13s}")
+    for (name, result) in results.items():
+        print(f"{name:16s}{result['wall_seconds']*1000:>8.2f} ms{result['cpu_seconds']*1000:>8.2f} ms"
+              f"{result['wire_seconds']*1000:>8.2f} ms{result['peak_bytes']:>14,d}"
+              f"{result['allocated_blocks']:>13,d}{result['page_faults']:>13.0f}"
+              f"{result['spi_bytes']:>13,d}")
+
+    if output is not None:
+        report = {
+            "suite_version": SUITE_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "repeats": repeats,
+            "spi_hz": spi_hz,
+            "scenarios": results,
+        }
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {output}")
+    return results
+
+
+def compare_results(baseline_path, current_path, threshold=0.1):
+    """
+    Compare two JSON results of the suite. A metric that got worse by more than `threshold`
+    (relative) and by more than its noise floor (see COMPARED_METRICS) is a regression. Returns
+    the list of regressions as (scenario, metric, baseline value, current value).
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    if baseline.get("suite_version") != current.get("suite_version"):
+        print("Warning: the results are from different versions of the suite")
+    for key in ("machine", "python", "numpy", "spi_hz"):
+        if baseline.get(key) != current.get(key):
+            print(f"Warning: {key} differs ({baseline.get(key)} vs {current.get(key)})")
+
+    regressions = []
+    print(f"{'':16s}{'metric':>14s}{'baseline':>14s}{'current':>14s}{'change':>10s}")
+    for (name, result) in current["scenarios"].items():
+        reference = baseline["scenarios"].get(name)
+        if reference is None:
+            print(f"{name:16s} (new scenario)")
+            continue
+        for (metric, noise_floor) in COMPARED_METRICS.items():
+            (old, new) = (reference[metric], result[metric])
+            change = (new - old) / old if old else (0.0 if new == old else math.inf)
+            flag = ""
+            if new - old > noise_floor and change > threshold:
+                flag = "  REGRESSION"
+                regressions.append((name, metric, old, new))
+            elif old - new > noise_floor and -change > threshold:
+                flag = "  improved"
+            print(f"{name:16s}{metric:>14s}{old:>14.6g}{new:>14.6g}{change:>+9.1%}{flag}")
+        if reference.get("spi_digest") != result.get("spi_digest"):
+            print(f"{name:16s}{'':14s} SPI output differs from the baseline")
+
+    for name in baseline["scenarios"].keys() - current["scenarios"].keys():
+        print(f"{name:16s} (missing from the current results)")
+    print(f"{len(regressions)} regression(s) above {threshold:.0%}")
+    return regressions
+
+
+def bench_sequencer(width=256, height=64, steps=120, frames=1, spi_hz=DEFAULT_SPI_HZ):
+    """
+    Rate at which a small region can be updated, with the Sequencer in both modes on an emulated
+    projector running in real time (with SPI transfers taking as long as they would on the wire).
+    """
+    projector = EmulatedProjector(timing=TimingModel(boot_time=0.01, mode_switch_time=0.01, spi_timing=True))
+    projector.spi.max_speed_hz = spi_hz
+    dmd = DLPC1438(projector.i2c, projector.spi, gpio=projector.gpio, spi_bufsiz=65536)
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    dmd.set_background(0, both_buffers=True)
+
+    # the region moves over the frame, so every step is a new upload
+    rng = np.random.default_rng(0)
+    patterns = [(rng.integers(0, 256, (width, height), dtype=np.uint8),
+                 (128 * step) % (2560 - width), (2 * step) % (1440 - height)) for step in range(steps)]
+
+    print(f"{steps} steps of a {width}x{height} region, {frames} frame(s) each, SPI at {spi_hz / 1e6:.0f} MHz")
+    print(f"{'':12s}{'pattern rate':>14s}{'swap jitter':>14s}{'max error':>12s}{'late':>7s}{'dropped':>9s}")
+    for mode in SEQUENCER_MODES:
+        sequencer = Sequencer(dmd, mode=mode)
+        sequencer.calibrate()
+        sequencer.run([(pattern, frames) for pattern in patterns])
+        summary = sequencer.summary()
+        print(f"{mode:12s}{summary['pattern_rate']:>11.2f} Hz{summary['swap_jitter']*1000:>11.3f} ms"
+              f"{summary['max_swap_error']*1000:>9.3f} ms{summary['late_steps']:>7d}{summary['dropped_frames']:>9d}")
+        if mode == "continuous":
+            # check the rate against what the emulator showed per frame, not only the host timestamps
+            frames_shown = projector.shown_frames()
+            patterns_shown = sum(1 for _ in itertools.groupby(frames_shown))
+            print(f"{'':12s}emulator showed {patterns_shown} of {steps} patterns in {len(frames_shown)} frames")
+    print(f"frame rate of the video signal: {1 / sequencer.frame_period:.2f} Hz")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hardware-free benchmarks for the UV_projector package")
+    subparsers = parser.add_subparsers(dest="benchmark")
+
+    encoder_parser = subparsers.add_parser("encoder", help="legacy vs zero-copy SPI packet encoding")
+    encoder_parser.add_argument("--width", type=int, default=2560)
+    encoder_parser.add_argument("--height", type=int, default=1440)
+    encoder_parser.add_argument("--xoffset", type=int, default=0)
+    encoder_parser.add_argument("--yoffset", type=int, default=0)
+    encoder_parser.add_argument("--repeats", type=int, default=5)
+
+    stack_parser = subparsers.add_parser("layer-stack", help="PNG decoding vs memory-mapped layer stack")
+    stack_parser.add_argument("--layers", type=int, default=10)
+    stack_parser.add_argument("--folder", help="folder of layer images (synthetic layers if omitted)")
+
+    crc_parser = subparsers.add_parser("crc", help="cost of the CRC16 computation per frame")
+    crc_parser.add_argument("--repeats", type=int, default=5)
+
+    suite_parser = subparsers.add_parser("suite", help="scenarios of the DLPC1438 class against a null SPI sink")
+    suite_parser.add_argument("--repeats", type=int, default=10)
+    suite_parser.add_argument("--spi-hz", type=int, default=DEFAULT_SPI_HZ, help="SPI clock for the projected wire time")
+    suite_parser.add_argument("--scenario", action="append", help="only run this scenario (can be repeated)")
+    suite_parser.add_argument("--output", help="write the results to this JSON file")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two JSON results of the suite")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="relative change that counts as a regression (default 0.1)")
+
+    sequencer_parser = subparsers.add_parser("sequencer", help="rate of small-region updates with the Sequencer")
+    sequencer_parser.add_argument("--width", type=int, default=256)
+    sequencer_parser.add_argument("--height", type=int, default=64)
+    sequencer_parser.add_argument("--steps", type=int, default=120)
+    sequencer_parser.add_argument("--frames", type=int, default=1, help="frames per step")
+    sequencer_parser.add_argument("--spi-hz", type=int, default=DEFAULT_SPI_HZ)
+
+    args = parser.parse_args()
+
+    if args.benchmark == "sequencer":
+        bench_sequencer(args.width, args.height, args.steps, args.frames, args.spi_hz)
+    elif args.benchmark == "suite":
+        bench_suite(args.repeats, args.spi_hz, args.scenario, args.output)
+    elif args.benchmark == "compare":
+        if compare_results(args.baseline, args.current, args.threshold):
+            sys.exit(1)
+    elif args.benchmark == "crc":
+        bench_crc(repeats=args.repeats)
+    elif args.benchmark == "layer-stack":
+        bench_layer_stack(args.layers, args.folder)
+    elif args.benchmark == "encoder":
+        bench_encoder(args.width, args.height, args.xoffset, args.yoffset, repeats=args.repeats)
+    else:
+        bench_encoder()
+
+
+if __name__ == "__main__":
+    main()
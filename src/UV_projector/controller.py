@@ -1,11 +1,29 @@
+import logging
 import warnings
-import RPi.GPIO as GPIO
 import time
 import enum
-import math
+import collections
 import numpy as np
 
 from UV_projector.img_convert import image_to_arr
+from UV_projector.spi_packet import SPIPacketEncoder
+from UV_projector.shadow import FramebufferShadow, pad_to_blocks, subtract_rect, union_rect, block_mask, \
+    mask_to_rects, BLOCK_WIDTH, BLOCK_HEIGHT, NUM_COL_BLOCKS, NUM_ROW_BLOCKS
+from UV_projector.gpio_events import PinEvents
+from UV_projector.frame_cache import EncodedFrameCache
+from UV_projector import registers
+from UV_projector.metrics import Metrics
+from UV_projector.spi_ioctl import SPIMessageWriter, read_spidev_bufsiz
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:  # not running on a raspberry pi; a pin backend must be passed to DLPC1438
+    GPIO = None
+
+logger = logging.getLogger(__name__)
+
+# buckets (in MB/s) for the effective SPI throughput histogram
+THROUGHPUT_BUCKETS = (1, 2, 5, 7.5, 10, 12.5, 15, 20, 30, 50)
 
 class Mode(enum.IntEnum):
     STANDBY = 0xFF,
@@ -18,166 +36,414 @@ class DLPC1438:
     pi) and the DLPC1438+FPGA are handled through this class.
     """
 
-    # Pin numbering
+    # Pin numbering (defaults, can be changed per instance with the pins argument)
+    PIN_NAMES = ("PROJ_ON", "SYS_RDY", "HOST_IRQ", "SPI_RDY", "PRINT_ACTIVE")
     PROJ_ON = 5
     SYS_RDY = 6
     HOST_IRQ = 19
     SPI_RDY = 7
     PRINT_ACTIVE = 13
 
-    SPI_BUFFERSIZE = 65536  # note the default config for raspberry pi is 4096
+    SPI_BUFFERSIZE = 65536  # max bytes per SPI transfer. Read from spidev's bufsiz at startup if available
     SPI_BUFFER_INDEX = 0  # FPGA buffer index that user can write to. Swapped after each image change
+    FILL_CACHE_SIZE = 4  # number of encoded constant fills (e.g. background clears) to keep around
 
     addr = 0x1B  # i2c address
 
-    def __init__(self, i2c_bus, spi_bus):
+    # Timeouts (in seconds) when waiting for the status pins of the DLPC1438/FPGA
+    HOST_IRQ_TIMEOUT = 10
+    POWER_DOWN_TIMEOUT = 1  # PROJ_ON low -> HOST_IRQ low, and -> no longer responding on I2C
+    POWER_OFF_TIME = 0.25  # minimum time PROJ_ON is kept low on a cold start, after I2C stopped responding
+    I2C_READY_TIMEOUT = 5  # HOST_IRQ high -> responding on I2C
+    SYS_RDY_TIMEOUT = 5
+    MODE_SWITCH_TIME = 0.4  # time the DLPC1438 needs to switch between modes
+    PRINT_ACTIVE_TIMEOUT = 0.2
+
+    # backoff (in seconds) when polling I2C during startup
+    I2C_POLL_INTERVAL = 0.005
+    I2C_POLL_MAX_INTERVAL = 0.25
+
+    def __init__(self, i2c_bus, spi_bus, dirty_tracking=False, gpio=None, frame_cache_bytes=0, verify_registers=False,
+                 spi_bufsiz=None, spi_transfer_size=None, spi_batching=False, spi_ioctl=None, crc=False,
+                 correction=None, warm_start=False, pins=None):
         """
-        Checks if the DCLP1438 is running and ready for i2c communication, and if not, will 
-        start the DLPC1438 with the PROJ_ON gpio signal.
+        Restarts the DLPC1438 with the PROJ_ON gpio signal, and waits until it is ready for i2c
+        communication.
+
+        With `warm_start`, a DLPC1438 that is already running is reused as it is, without the
+        restart: its mode, active buffer and external print settings are read back into the
+        register shadow, so configuring it again only writes the settings that differ. The time
+        spent in every phase of the startup is kept in `startup_timings`.
+
+        If `dirty_tracking` is True, a host-side shadow copy of both FPGA buffers is kept and
+        image transfers only send the 128x2 pixel blocks that actually changed.
+
+        The `gpio` argument allows using a different pin backend than RPi.GPIO (e.g. SimulatedGPIO),
+        as long as it follows the RPi.GPIO API. `pins` overrides the (BCM) pin numbers of this
+        instance, e.g. {"PROJ_ON": 12, "PRINT_ACTIVE": 16} for a second projector head.
+
+        If `frame_cache_bytes` is larger than 0, the encoded SPI packets of the images that are sent
+        are kept in an LRU cache of (at most) that size, so repeated images are sent without any
+        decoding or encoding work. The cache is not used when dirty tracking is enabled.
+
+        Register writes skip values the DLPC1438 already holds (see registers.py). With
+        `verify_registers` every register write is read back and checked; this can also be
+        enabled per call.
+
+        Counters and latency histograms of the SPI transfers, I2C transactions and exposures are
+        collected in `self.metrics` (see metrics.py).
+
+        The SPI transfers are sized from the spidev buffer size (`spi_bufsiz`), which is read from
+        /sys/module/spidev/parameters/bufsiz if not given. A smaller `spi_transfer_size` can be set.
+        With `spi_batching`, all transfers of an image are submitted in as few SPI_IOC_MESSAGE
+        ioctls as bufsiz allows (see spi_ioctl.py), instead of one writebytes2 call per transfer.
+        In that case transfers default to SPI_BUFFERSIZE bytes, and `spi_ioctl` can replace
+        fcntl.ioctl (e.g. with EmulatedSPI.ioctl).
+
+        With `crc`, a CRC16 is sent with every image (computed while it is encoded, see crc.py),
+        the CRC check of the FPGA is enabled by configure_external_print(), and the CRC status
+        is checked after every upload.
+
+        A `correction` (e.g. an IntensityCorrection, see correction.py) is applied to the pixels of
+        every image while it is encoded; it can be changed later with set_correction().
         """
-        print("Intialising the DLPC1438...")
+        logger.info("Intialising the DLPC1438...")
+
+        self.gpio = GPIO if gpio is None else gpio
+        assert self.gpio is not None, "RPi.GPIO is not available, provide a pin backend with the gpio argument"
+
+        for (name, pin) in (pins or {}).items():
+            assert name in self.PIN_NAMES, f"Unknown pin {name}, must be one of {self.PIN_NAMES}"
+            setattr(self, name, pin)
 
         # Configure the pins
-        GPIO.setup(self.PROJ_ON, GPIO.OUT)  
-        GPIO.setup(self.SYS_RDY, GPIO.IN)  
-        GPIO.setup(self.HOST_IRQ, GPIO.IN)  
-        GPIO.setup(self.SPI_RDY, GPIO.IN)  
-        GPIO.setup(self.PRINT_ACTIVE, GPIO.IN)  
+        # keep PROJ_ON high on a warm start, so a running DLPC1438 is not powered down
+        self.gpio.setup(self.PROJ_ON, self.gpio.OUT, initial=self.gpio.HIGH if warm_start else self.gpio.LOW)
+        self.gpio.setup(self.SYS_RDY, self.gpio.IN)  
+        self.gpio.setup(self.HOST_IRQ, self.gpio.IN)  
+        self.gpio.setup(self.SPI_RDY, self.gpio.IN)  
+        self.gpio.setup(self.PRINT_ACTIVE, self.gpio.IN)  
+
+        # listen for edges on the status pins, so we can wait on them without polling
+        self.events = PinEvents(self.gpio, [self.HOST_IRQ, self.SYS_RDY, self.SPI_RDY, self.PRINT_ACTIVE])
 
         self.i2c = i2c_bus
         self.spi = spi_bus
+        self.registers = registers.RegisterMap(i2c_bus, self.addr, verify_registers)
+
+        self.metrics = Metrics()
+        self.metrics.add_collector(lambda: {"i2c_" + name: value for (name, value) in self.registers.stats().items()})
+        self._last_expose_start = None
+
+        # writebytes2 splits anything larger than bufsiz into separate transfers, which would break
+        # the framing of the FPGA, so the transfers must never be larger than that
+        if spi_bufsiz is None:
+            spi_bufsiz = read_spidev_bufsiz()
+            if spi_bufsiz is None:
+                warnings.warn(f"Could not read the spidev buffer size, assuming {self.SPI_BUFFERSIZE} bytes")
+                spi_bufsiz = self.SPI_BUFFERSIZE
+        self.spi_bufsiz = spi_bufsiz
+        if spi_transfer_size is None:
+            spi_transfer_size = min(spi_bufsiz, self.SPI_BUFFERSIZE) if spi_batching else spi_bufsiz
+        assert spi_transfer_size <= spi_bufsiz, "SPI transfers can not be larger than the spidev buffer size"
+        self.SPI_BUFFERSIZE = spi_transfer_size
+        logger.info("SPI transfers of up to %d bytes (spidev bufsiz: %d)", self.SPI_BUFFERSIZE, self.spi_bufsiz)
+
+        self.crc = crc
+        self.spi_writer = None
+        if spi_batching:
+            self.spi_writer = SPIMessageWriter(self.spi.fileno(), self.spi_bufsiz, ioctl=spi_ioctl)
+            # the queued packets must stay valid until their message is submitted. Smaller packets
+            # (e.g. of dirty blocks) must not queue more transfers than the pool holds either.
+            pool_size = self.spi_writer.transfers_per_message(self.SPI_BUFFERSIZE) + 1
+            self.spi_writer.max_transfers = pool_size - 1
+            self.encoder = SPIPacketEncoder(self.SPI_BUFFERSIZE, pool_size, crc=crc, transform=correction)
+        else:
+            self.encoder = SPIPacketEncoder(self.SPI_BUFFERSIZE, crc=crc, transform=correction)
+
+        # shadow copies of the two FPGA buffers (indexed by SPI_BUFFER_INDEX) for dirty tracking.
+        # Their content is unknown until we write to them.
+        self.shadows = [FramebufferShadow(), FramebufferShadow()] if dirty_tracking else None
+        self.last_update_stats = None
+        self._fill_cache = collections.OrderedDict()
+        self.frame_cache = EncodedFrameCache(frame_cache_bytes) if frame_cache_bytes > 0 else None
+        if self.frame_cache is not None:
+            self.metrics.add_collector(
+                lambda: {"frame_cache_" + name: value for (name, value) in self.frame_cache.stats().items()})
+        self._stack_regions = [None, None]  # region of each buffer holding a (cropped) stack layer or sent regions
+
+        self.warm_started = False
+        self.startup_state = None
+        self.startup_timings = {}  # duration (in seconds) of every phase of the startup
+        self.__startup(warm_start)
+
+    def close(self):
+        """
+        Stop listening for edges on the status pins. The pins are left as they are, so the
+        DLPC1438 keeps running (e.g. for a warm start of the next DLPC1438 object).
+        """
+        self.events.close()
 
+    def __startup(self, warm_start):
+        """
+        Bring the DLPC1438 up: either reuse an already running controller (warm start), or power
+        cycle it with PROJ_ON and wait until it responds on I2C again (cold start). Every wait is
+        driven by the status pins or by polling I2C, with a timeout.
+        """
+        start = time.perf_counter()
+        phase_start = start
+
+        def phase(name):
+            nonlocal phase_start
+            now = time.perf_counter()
+            self.startup_timings[name] = now - phase_start
+            phase_start = now
+
+        if warm_start:
+            try:
+                self.registers.probe()
+            except IOError:
+                logger.info("DLPC1438 does not respond on I2C, doing a cold start")
+            else:
+                phase("probe")
+                self.warm_started = True
+        if not self.warm_started:
+            self.__cold_start(phase)
+
+        # check the current mode and active buffer. On a warm start, the external print settings
+        # are read as well, which fills the register shadow so that configuring the DLPC1438
+        # again only writes the settings that differ.
+        self.startup_state = self.__read_startup_state(self.warm_started)
+        self.SPI_BUFFER_INDEX = self.startup_state["active_buffer"]
+        logger.info("Active buffer index at startup: %d", self.SPI_BUFFER_INDEX)
+        phase("state")
+
+        self.startup_timings["total"] = time.perf_counter() - start
+        self.metrics.set("startup_seconds", self.startup_timings["total"])
+        logger.info("%s start of the DLPC1438 took %.3f seconds (%s)", "Warm" if self.warm_started else "Cold",
+                    self.startup_timings["total"],
+                    ", ".join(f"{name} {duration*1000:.1f}ms" for (name, duration) in self.startup_timings.items() if name != "total"))
+        logger.info("DLPC1438 state at startup: %s", self.startup_state)
+
+    def __cold_start(self, phase):
+        # a full restart of the DLPC1438. TODO: check if this interferes with how the Anhua
+        # board is designed (use warm_start to avoid it)
+        self.gpio.output(self.PROJ_ON, self.gpio.LOW)
+        power_down = time.perf_counter()
+        try:
+            self.events.wait_for(self.HOST_IRQ, self.gpio.LOW, self.POWER_DOWN_TIMEOUT)
+        except TimeoutError:
+            warnings.warn(f"HOST_IRQ did not go low within {self.POWER_DOWN_TIMEOUT} seconds after PROJ_ON went low")
 
-        ## TODO: avoid this line below, which forces a full restart of the DLPC1438
-        # I think it interferes with how the Anhua board is designed...
-        GPIO.output(self.PROJ_ON, GPIO.LOW)    
-        time.sleep(1)
-            
         # there are 2 options (see figure 9.1 of DLPC1438 datasheet):
         # [1] host_IRQ is low, and the DLPC1438 has not started yet
         # [2] host IRQ is low, but the DLCP1438 is already active and running
-
-        try:  # we try to communicate over I2C. This will trow I/O error if DLPC1438 is not active yet
-            i2c_bus.read_byte(self.addr)  # check if i2c is already active. Then we are in [2]
+        # a DLPC1438 that is still powering down keeps answering on I2C for a while, so we can only
+        # tell them apart once it had the time to stop responding
+        if self.__wait_i2c_stopped(power_down):
+            phase("power_down")
+        else:  # case [2], e.g. the board keeps it powered. Do not leave PROJ_ON low while it runs
+            self.gpio.output(self.PROJ_ON, self.gpio.HIGH)
             warnings.warn("DLPC1438 is already powered on when script initialised. No startup action needed.")
-
-            # check the current active buffer
-            self.SPI_BUFFER_INDEX = self.__i2c_read(0xC6,1)[0]
-            print(f"Active buffer index at startup: {self.SPI_BUFFER_INDEX}")
-
+            phase("probe")
             return
-        except IOError:  # DCLP1438 seems to still be turned off (case [1]). Let's start it
-            print("Setting PROJ_ON high to start DLPC1438 startup sequence... ")
+        logger.info("Setting PROJ_ON high to start DLPC1438 startup sequence... ")
 
-            # send the PROJ_ON signal and wait for the HOST_IRQ signal to go high, signalling the DLPC1438
-            # is ready to go
-            GPIO.output(self.PROJ_ON, GPIO.HIGH)
-            ref_time = time.time()
-            while not GPIO.input(self.HOST_IRQ):
-                time.sleep(0.01)
+        # send the PROJ_ON signal and wait for the HOST_IRQ signal to go high, signalling the DLPC1438
+        # is ready to go
+        self.gpio.output(self.PROJ_ON, self.gpio.HIGH)
+        waited = self.events.wait_for(self.HOST_IRQ, self.gpio.HIGH, self.HOST_IRQ_TIMEOUT)
+        logger.info("DLPC1438 is signalling it is ready for use, %.3f seconds after PROJ_ON went high.", waited)
+        phase("boot")
 
-            print(f"DLPC1438 is signalling it is ready for use, {time.time()-ref_time} seconds after PROJ_ON went high.")
+        # now we need to wait for I2C communication to be ready
+        self.wait_i2c_ready()
+        phase("i2c")
 
-            # now we need to wait for I2C communication to be ready
-            time.sleep(1)  # TODO: make this more robust
-
-            # keep looping as long as we cannot find the DLPC1438 on the i2c bus
-            while i2c_bus.read_byte(self.addr) == 0:  
-                time.sleep(1)
-
-            # check the current active buffer
-            self.SPI_BUFFER_INDEX = self.__i2c_read(0xC6,1)[0]
-            print(f"Active buffer index at startup: {self.SPI_BUFFER_INDEX}")
+    def __wait_i2c_stopped(self, power_down):
+        """
+        Poll the DLPC1438 on the I2C bus until it stops responding, and keep PROJ_ON low until at
+        least POWER_OFF_TIME after that. Returns False if it still responds POWER_DOWN_TIMEOUT
+        seconds after PROJ_ON went low (at `power_down`).
+        """
+        while True:
+            try:  # this will throw an I/O error once the DLPC1438 is off
+                self.registers.probe()
+            except IOError:
+                time.sleep(self.POWER_OFF_TIME)
+                return True
+            if time.perf_counter() - power_down > self.POWER_DOWN_TIMEOUT:
+                return False
+            time.sleep(self.I2C_POLL_INTERVAL)
+
+    def wait_i2c_ready(self, timeout=None):
+        """
+        Poll the DLPC1438 on the I2C bus until it responds, with exponential backoff between the
+        attempts. Returns the time waited, or raises TimeoutError after timeout seconds (defaults
+        to I2C_READY_TIMEOUT).
+        """
+        timeout = self.I2C_READY_TIMEOUT if timeout is None else timeout
+        start = time.perf_counter()
+        delay = self.I2C_POLL_INTERVAL
+        while True:
+            try:
+                if self.registers.probe() != 0:
+                    return time.perf_counter() - start
+            except IOError:
+                pass
+            if time.perf_counter() - start + delay > timeout:
+                raise TimeoutError(f"The DLPC1438 did not respond on I2C within {timeout} seconds")
+            time.sleep(delay)
+            delay = min(delay * 2, self.I2C_POLL_MAX_INTERVAL)
+
+    def __read_startup_state(self, settings):
+        """Mode and active buffer of the DLPC1438, and its external print settings if `settings` is True."""
+        mode = self.registers.read(registers.OPERATING_MODE)[0]
+        state = {
+            "mode": Mode(mode) if mode in list(Mode) else mode,
+            "active_buffer": self.registers.read(registers.BUFFER_INDEX)[0],
+        }
+        if settings:
+            for register in registers.CONFIG_REGISTERS:
+                self.registers.read(register)
+            led_current = self.registers.read(registers.LED_CURRENT)
+            state["led_pwm"] = led_current[0] + (led_current[1] << 8)
+            state["parallel_video"] = bool(self.registers.read(registers.PARALLEL_VIDEO)[0] & 0x01)
+        return state
 
-            return
-        
     def __i2c_read(self, register, length):
         """Read I2C information from DCLP1438 at given register, expecting a certain number of bytes
         of data.
         
-        This function exists primarily to keep a code more readable."""
-        return self.i2c.read_i2c_block_data(self.addr,register,length)
+        This function exists primarily to keep a code more readable. It is only used for commands
+        that are not in the register map; these are not shadowed."""
+        return self.registers.raw_read(register, length)
     
     def __i2c_write(self, register, data):
         """Write I2C information from DCLP1438 at given register, sending a list of bytes specified
         in 'data'.
         
-        This function exists primarily to keep a code more readable."""
-        return self.i2c.write_i2c_block_data(self.addr,register,data)
+        This function exists primarily to keep a code more readable. It is only used for commands
+        that are not in the register map; these are never skipped."""
+        return self.registers.raw_write(register, data)
 
-    def switch_mode(self, new_mode):
+    def switch_mode(self, new_mode, verify=None):
         """
         Switch between DLPC1438 operational modes.
 
-        Note that the input of the function must be an Enum of the Mode class.
+        Note that the input of the function must be an Enum of the Mode class. Switching to the
+        mode the DLPC1438 is already in is skipped. The mode is only read back to check the switch
+        was successful if `verify` is True (or verify_registers was set).
+        """
+        if self._start_mode_switch(new_mode):
+            time.sleep(self.MODE_SWITCH_TIME)  # need some time to switch between modes
+            self._finish_mode_switch(new_mode, verify)
+
+        # if we switched to EXTERNAL_PRINT mode, we will want to wait for 
+        # SYS_READY to go high before doing anything else.
+        if new_mode == Mode.EXTERNALPRINT:
+            self.wait_sys_ready()
+
+    def _start_mode_switch(self, new_mode):
+        """
+        First part of switch_mode(): send the new mode. Returns False if the DLPC1438 is already in
+        that mode, otherwise the switch has to be completed with _finish_mode_switch() after
+        MODE_SWITCH_TIME.
         """
         # check that the new mode is actually a valid enum entry 
-        if isinstance(new_mode, Mode):  
-            print(f"> Switching DLPC1438 mode to {new_mode.name}\t (currently in {self.__i2c_read(0x06,1)[0]})")
+        if not isinstance(new_mode, Mode):
+            raise Exception("Invalid DLPC1438 mode provided. Use the Enum 'Mode', rather than the hex value.")
 
-            self.__i2c_write(0x05, [new_mode])  # send the new mode setting
+        logger.info("Switching DLPC1438 mode to %s", new_mode.name)
 
-            time.sleep(0.4)  # need some time to switch between modes
+        # send the new mode setting (verified once the switch is done)
+        if self.registers.write(registers.OPERATING_MODE, [new_mode], verify=False):
+            return True
+        logger.info("DLPC1438 is already in %s mode", new_mode.name)
+        return False
 
-            # check that the mode switch was successful
-            queried_mode = self.__i2c_read(0x06,1)[0]
-            assert queried_mode == new_mode.value, f"Was unable to switch the DLPC 1438 to MODE:{new_mode}"
+    def _finish_mode_switch(self, new_mode, verify=None):
+        """Second part of switch_mode(), once the DLPC1438 had MODE_SWITCH_TIME to switch."""
+        # we can't be sure the FPGA buffers survive a mode switch
+        if self.shadows is not None:
+            for shadow in self.shadows:
+                shadow.invalidate()
 
-            # if we switched to EXTERNAL_PRINT mode, we will want to wait for 
-            # SYS_READY to go high before doing anything else.
-            if queried_mode == Mode.EXTERNALPRINT:
-                self.__await_SYS_RDY()
+        # the external print settings are likely reset in standby
+        if new_mode == Mode.STANDBY:
+            self.registers.invalidate(registers.CONFIG_REGISTERS)
 
-        else:
-            raise Exception("Invalid DLPC1438 mode provided. Use the Enum 'Mode', rather than the hex value.")
+        # check that the mode switch was successful
+        if self.registers.verify if verify is None else verify:
+            queried_mode = self.registers.read(registers.OPERATING_MODE, refresh=True)[0]
+            assert queried_mode == new_mode.value, f"Was unable to switch the DLPC 1438 to MODE:{new_mode}"
     
-    def configure_external_print(self, LED_PWM, skip_FPGA_video=False): 
+    def configure_external_print(self, LED_PWM, skip_FPGA_video=False, verify=None): 
         """
         Apply various settings applicable to the EXTERNAL_PRINT mode of the DLPC1438.
 
         This function will configure multiple registers. Note that switching to STANDBY mode will
         likely reset some of these values, so it is suggested to call this just before switching
-        to EXTERNAL_PRINT mode.
+        to EXTERNAL_PRINT mode. Registers that already hold the requested value are not written
+        again, and are only read back if `verify` is True (or verify_registers was set).
         """
 
-        print(f"\nConfiguring the DLPC1438 for external print mode with LED PWM at {LED_PWM/1023*100}%")
+        logger.info("Configuring the DLPC1438 for external print mode with LED PWM at %.1f%%", LED_PWM/1023*100)
 
         assert isinstance(LED_PWM, int), "LED_PWM must be a 10-bit integer"
         assert 0 <= LED_PWM < 1024, "LED_PWM must be 10-bit (i.e. in range [0, 1023])"
 
         # Write FPGA control (0xCA)
-        # no CRC error injection, no CRC error calc, no FGPA reset, no FPGA reset unlock
-        self.__i2c_write(0xCA, [0b00000000])  
-        print(f"FPGA settings: {bin(self.__i2c_read(0xCB,1)[0])}")
+        # no CRC error injection, CRC error calc only if enabled, no FGPA reset, no FPGA reset unlock
+        transactions = self.registers.transactions
+        self.registers.write(registers.FPGA_CONTROL, [registers.FPGA_CRC_ENABLE if self.crc else 0b00000000], verify)
         
         # write external print confugration (0xA8)
         # we choose a linear transfer function (byte 1) and select led 1 (byte 2)
-        self.__i2c_write(0xA8, [0x00, 0b00000001])  
-        print(f"External print settings: {self.__i2c_read(0xA9,2)}")
+        self.registers.write(registers.EXTERNAL_PRINT_CONFIG, [0x00, 0b00000001], verify)
 
         # Write LED PWM current (0x54)
         # Set PWM value for LED 3/1
-        print(LED_PWM.to_bytes(2, byteorder = 'big'))
         PWM_data = list(LED_PWM.to_bytes(2, byteorder = 'little')) + [0x00, 0x00, 0x00, 0x00]
-        self.__i2c_write(0x54, PWM_data)  
-        print(f"LED settings: {[hex(val) for val in self.__i2c_read(0x55,6)]}") 
+        self.registers.write(registers.LED_CURRENT, PWM_data, verify)
+        logger.debug("LED settings: %s", PWM_data)
 
         # Write parallel video (0xC3)
         # Enable the FPGA parallel video interface.
         if not skip_FPGA_video:
-            self.__i2c_write(0xC3, [0x01])  
-            print(f"prallel video settings: {bin(self.__i2c_read(0xC4,1)[0])}")
+            self.registers.write(registers.PARALLEL_VIDEO, [0x01], verify)
 
         # Write actuator orientation (0xC8)  # TODO: figure out if this one is really needed
         # see DLPC1438 programming guide for interpetation of these bytes. For now just using values of Elegoo board.
-        self.__i2c_write(0xC8, [0x03, 0x16, 0x11, 0x06, 0x01])  
-        print(f"Actuator orientation settings: {[hex(val) for val in self.__i2c_read(0xC9,5)]}")
+        self.registers.write(registers.ACTUATOR_ORIENTATION, [0x03, 0x16, 0x11, 0x06, 0x01], verify)
+
+        logger.debug("External print configuration took %d I2C transactions", self.registers.transactions - transactions)
+
+
+    def wait_sys_ready(self, timeout=None):
+        """
+        Wait for SYS_RDY to go high, returning as soon as it does. Returns the time waited.
+
+        Raises TimeoutError if SYS_RDY is not high within timeout seconds (defaults to
+        SYS_RDY_TIMEOUT).
+        """
+        if not self.gpio.input(self.SYS_RDY):
+            logger.debug("waiting for SYS_RDY")
+        return self.events.wait_for(self.SYS_RDY, self.gpio.HIGH, self.SYS_RDY_TIMEOUT if timeout is None else timeout)
+
+    def wait_spi_ready(self, timeout=1):
+        """Wait for the FPGA to signal it is ready to receive SPI data. Returns the time waited."""
+        return self.events.wait_for(self.SPI_RDY, self.gpio.HIGH, timeout)
 
+    def wait_exposure_done(self, timeout=None):
+        """
+        Wait for the current exposure to finish (PRINT_ACTIVE going low), returning as soon as
+        it does. Returns the time waited.
 
-    def  __await_SYS_RDY(self):
-        while not GPIO.input(self.SYS_RDY):
-            time.sleep(0.3)
-            print("waiting for SYS_RDY")
+        Note that this waits indefinitely by default; a timeout (in seconds) can be given after
+        which a TimeoutError is raised. The measured latency is recorded in self.events.latencies.
+        """
+        return self.events.wait_for(self.PRINT_ACTIVE, self.gpio.LOW, timeout)
 
 
     def expose_pattern(self, exposed_frames, dark_frames=5):
@@ -194,16 +460,24 @@ class DLPC1438:
         after swapping the buffer before calling this function you could set this number to 0
         to increase frame throughput.
         """
-        assert GPIO.input(self.SYS_RDY), "SYS_RDY signal is not high yet, cannot expose frames yet."
+        assert self.gpio.input(self.SYS_RDY), "SYS_RDY signal is not high yet, cannot expose frames yet."
         assert isinstance(dark_frames, int), "dark_frames must be a 16-bit integer"
         assert 0 <= dark_frames < 65536, "dark_frames must be 16-bit (i.e. in range [0, 65535])"
 
+        # dead time since the previous exposure ended (the falling edge of PRINT_ACTIVE)
+        expose_start = time.perf_counter()
+        change = self.events.last_change(self.PRINT_ACTIVE)
+        if self._last_expose_start is not None and change is not None and not change[1] and change[0] >= self._last_expose_start:
+            self.metrics.observe("exposure_gap_seconds", expose_start - change[0])
+        self._last_expose_start = expose_start
+        self.metrics.inc("exposures_total")
+
         if exposed_frames > 0:
             assert isinstance(exposed_frames, int), "exposed_frames must be a 16-bit integer"
             assert 0 <= exposed_frames < 65536, "exposed_frames must be 16-bit (i.e. in range [0, 65535])"
 
             # start exposure of current buffer for the duration specifed in exposure time
-            print(f"> Starting UV exposure (for {exposed_frames} frames / {exposed_frames/60:.2f}sec)!")
+            logger.info("Starting UV exposure (for %d frames / %.2fsec)!", exposed_frames, exposed_frames/60)
             frame_data = [0x00] + \
                 list(dark_frames.to_bytes(2, byteorder = 'little')) + \
                 list(exposed_frames.to_bytes(2, byteorder = 'little'))
@@ -212,7 +486,7 @@ class DLPC1438:
 
         elif exposed_frames == -1:
             # start exposure of current buffer for infinite duration with 5 dark frames to let video data stabilise)
-            print("> Starting UV exposure (Infinite Duration)!")
+            logger.info("Starting UV exposure (Infinite Duration)!")
             self.__i2c_write(0xC1, [0x00]
                               + list(dark_frames.to_bytes(2, byteorder = 'little'))
                               + [0xFF, 0xFF])  
@@ -221,8 +495,14 @@ class DLPC1438:
         else:
             raise Exception("Invalid exposure time value provided. Value must be positive or -1.")
 
-        time.sleep(0.02) # TODO: optimise delay time; now this is just quick empirical test
-        if not GPIO.input(self.PRINT_ACTIVE): warnings.warn("PRINT ACTIVE did not go high after starting exposure. Something might be wrong.") 
+        try:
+            self.events.wait_for(self.PRINT_ACTIVE, self.gpio.HIGH, self.PRINT_ACTIVE_TIMEOUT)
+        except TimeoutError:
+            warnings.warn("PRINT ACTIVE did not go high after starting exposure. Something might be wrong.") 
+
+    def exposure_active(self):
+        """Return True while the DLPC1438 is exposing (i.e. PRINT_ACTIVE is high)."""
+        return bool(self.gpio.input(self.PRINT_ACTIVE))
 
     def stop_exposure(self):
         """
@@ -237,22 +517,13 @@ class DLPC1438:
         it to standby mode, but that is not always the desired method.
         """
 
-        print("Stopping UV exposure immediately!")
+        logger.info("Stopping UV exposure immediately!")
         self.__i2c_write(0xC1, [0x01, 0x00, 0x00, 0x00, 0x00])  
 
-        time.sleep(0.1) # TODO: optimise delay time; now this is just quick empirical test
-        if GPIO.input(self.PRINT_ACTIVE): warnings.warn("PRINT ACTIVE is still high after sending STOP uv expose command. Something might be wrong") 
-
-    def __rowcol_data_block(self, col_start, col_end, row_start):
-        """
-        Format 4 byte data block containing column start/end and row start information for
-        SPI transmission format of DLPC1438.
-        """
-        # the final 4 bits need to be 1 for reasons not explained, but let's just follow
-        # the programmer's guide of DLPC1438
-        rowcol_data_block_raw = col_start + (col_end << 5) + (row_start << 10) + (0b1111 << 28)
-        rowcol_data_block = list(rowcol_data_block_raw.to_bytes(4, byteorder = 'little'))
-        return  rowcol_data_block
+        try:
+            self.events.wait_for(self.PRINT_ACTIVE, self.gpio.LOW, self.PRINT_ACTIVE_TIMEOUT)
+        except TimeoutError:
+            warnings.warn("PRINT ACTIVE is still high after sending STOP uv expose command. Something might be wrong") 
 
     def single_spi_transmission(col_start, col_end, row_start, pixel_data):
         """
@@ -262,7 +533,7 @@ class DLPC1438:
         """
 
         length = pixel_data.size
-        print(f"number of bytes to include in SPI: {length}")
+        logger.debug("number of bytes to include in SPI: %d", length)
         width = (col_end-col_start+1)*128
 
         assert length % width == 0, "Number of pixels in data does not describe a rectangle defined by column and row index"
@@ -273,7 +544,7 @@ class DLPC1438:
 
         height = int(length/width)
 
-        print(f"Generating SPI data for image subframe of {width}x{height} pixels, starting at ({col_start*128},{row_start*2})")     
+        logger.debug("Generating SPI data for image subframe of %dx%d pixels, starting at (%d,%d)", width, height, col_start*128, row_start*2)     
 
         rowcol_data_block_raw = col_start + (col_end << 5) + (row_start << 10) + (0b1111 << 28)
         rowcol_data_block = list(rowcol_data_block_raw.to_bytes(4, byteorder = 'little'))
@@ -292,97 +563,193 @@ class DLPC1438:
         Offset width specifies the offset of the image along width in pixels from (top) left of frame.
         Offset height is the same, but for the vertical offset in pixels from top (left) of frame.
         
-        Data is sent to the currently inactive buffer.
+        Data is sent to the currently inactive buffer. The SPI packets are written straight into the
+        preallocated buffers of the packet encoder, so no copies of the full frame are made.
         """
 
-        img_width = pixel_data.shape[0]
-        img_height = pixel_data.shape[1]
-        
-        assert img_width <= 2560, "Max image width is 2560 pixels"
-        assert img_height <= 1440, "Max image height is 1440 pixels"
-
-        # The SPI data format requires "start/end col" and "start_row"
-        col_start = math.floor(offset_width/128)  # per 128
-        row_start = math.floor(offset_height/2)  # per 2
-
-        # if the offset is not a perfect multiple of 128 or 2, we will 0 pad the "start/front" pixel data
-        pad_width_start = offset_width % 128
-        pad_height_start = offset_height % 2
-
-        # we also need to pad the "end/back" of the data because we can only specify end_col in steps
-        # of 128.
-        pad_width_end =  (128 - (img_width +  pad_width_start) % 128)  % 128  # maybe there is a more efficient way to compute this
-        pad_height_end = (2 - pad_height_start + img_height) % 2
+        plan = self.encoder.plan(offset_width, offset_height, pixel_data)
 
-        print(f"Start col: {col_start} (leftpad:{pad_width_start}, rightpad:{pad_width_end})")
-        print(f"Start row: {row_start} (leftpad:{pad_height_start}, rightpad:{pad_height_end})")
-
-        # 0-pad the data 
-        padded_data = np.pad(pixel_data, ((pad_width_start,pad_width_end), (pad_height_start,pad_height_end)))
-
-        print(f"Original dims {pixel_data.shape}, padded dims: {padded_data.shape}")
-
-        width = padded_data.shape[0]
-        height = padded_data.shape[1]
-
-        assert width % 128 == 0, "Padded data does not fit neatly in SPI transmission"
-        assert height % 2 == 0, "Padded data does not fit neatly in SPI transmission"
-        # we also need to check if the padded image is still within bounds as someone could input
-        # a 2560x1440 image and shift it by e.g. 500,500 pixels, which obviously would not work 
-        assert width <= 2560, "Image width after shifting exceeds the max width of 2560 pixels"
-        assert height <= 1440, "Image height after shifting exceeds the max width of 1440 pixels"
-
-        col_end = int(col_start + width/128 - 1)  # note: the width is start_col up to *and including* end_col
-
-        print(f"End col: {col_end}")
-
-        # now we need to figure out how many rows of data we can transfer in a single SPI transfer
-        # based on the image width and our SPI buffer size. We need 10 bytes (or less) for other parts 
-        # of SPI command besides pixel data.
-
-        eff_buffersize = self.SPI_BUFFERSIZE - 10
-        
-        num_rows = math.floor( ((eff_buffersize) / width) /2 ) * 2  # should be even number
-
-        assert num_rows*width < (self.SPI_BUFFERSIZE - 10)  
-
-        num_transfers = math.ceil(height / num_rows)
-        print(f"The source image of dims {padded_data.shape} will be split into {num_transfers} transfers of (max) size {width}x{num_rows}")
-
-        #  split the data into chunks. Note that the last chunk is probably smaller than the other ones
-        split_data = np.split(padded_data, [(i+1)*num_rows for i in range(num_transfers-1)], axis=1)
-
-        row_tracker = 0
+        logger.debug("Start col: %d (leftpad:%d, rightpad:%d), start row: %d (leftpad:%d, rightpad:%d), end col: %d",
+                     plan.col_start, plan.pad_width_start, plan.pad_width_end,
+                     plan.row_start, plan.pad_height_start, plan.pad_height_end, plan.col_end)
+        logger.debug("The source image of dims %s will be split into %d transfers of (max) size %dx%d",
+                     pixel_data.shape, plan.num_transfers, plan.width, plan.num_rows)
 
         # Send the data over SPI in multiple tranmissions
-        SPI_start = time.time()
-        for (transfer_idx, data) in enumerate(split_data):
-            print(f"- transfer {transfer_idx} has shape: {data.shape}")
+        if self.shadows is not None:
+            self.__send_dirty_blocks(plan, pixel_data)
+        elif self.frame_cache is not None:
+            self.__send_through_cache(offset_width, offset_height, pixel_data)
+        else:
+            self.__write_packets(self.encoder.packets(offset_width, offset_height, pixel_data, plan))
 
-            if transfer_idx == 0:
-                print(f"the number of bytes we intedn to send: {padded_data.size}")
-                preamble = [0x04] + self.__rowcol_data_block(col_start, col_end, row_start) + [0x00] + list((padded_data.size).to_bytes(4, byteorder = 'little'))
-                preamble = np.array(preamble, dtype=np.uint8)
+    def __write_packets(self, packets, encoded=False):
+        """
+        Send a sequence of SPI packets (one transfer each) and record the transfer in the metrics.
 
+        The time spent waiting for the next packet is counted as encoding time, unless the packets
+        were `encoded` ahead of time. Returns the number of bytes sent.
+        """
+        bytes_sent = 0
+        transfers = 0
+        syscalls = 0
+        encode_time = 0.0
+        spi_time = 0.0
+
+        packets = iter(packets)
+        while True:
+            start = time.perf_counter()
+            packet = next(packets, None)
+            encoded_at = time.perf_counter()
+            encode_time += encoded_at - start
+            if packet is None:
+                break
+
+            if self.spi_writer is not None:
+                # queued, and only sent once the message is full
+                submitted = self.spi_writer.add(packet)
             else:
-                # note that following trasnfers do not contain the "length" of the transfer in preambe
-                preamble = [0x04] + self.__rowcol_data_block(col_start, col_end, row_start + row_tracker) + [0x00]
-                preamble = np.array(preamble, dtype=np.uint8)
-                
-            row_tracker += int(data.shape[1] / 2)  # divided by 2 because the row_start is in steps of 2 (see SPI format)
+                # Note that writebytes2 splits transfers larger than /sys/module/spidev/parameters/bufsiz
+                self.spi.writebytes2(packet)  # send transmission over spi
+                submitted = True
+            chunk_time = time.perf_counter() - encoded_at
+            if submitted:
+                self.metrics.observe("spi_chunk_seconds", chunk_time)
+                syscalls += 1
+            spi_time += chunk_time
+            bytes_sent += len(packet)
+            transfers += 1
+
+        if self.spi_writer is not None and transfers > 0:
+            start = time.perf_counter()
+            self.spi_writer.flush()
+            chunk_time = time.perf_counter() - start
+            self.metrics.observe("spi_chunk_seconds", chunk_time)
+            spi_time += chunk_time
+            syscalls += 1
+
+        self.metrics.inc("frames_sent_total")
+        self.metrics.inc("spi_transfers_total", transfers)
+        self.metrics.inc("spi_syscalls_total", syscalls)
+        self.metrics.inc("spi_bytes_total", bytes_sent)
+        self.metrics.observe("spi_frame_seconds", spi_time)
+        if not encoded:
+            self.metrics.observe("encode_seconds", encode_time)
+        if spi_time > 0:
+            throughput = bytes_sent / spi_time / 1e6
+            self.metrics.observe("spi_throughput_mbps", throughput, THROUGHPUT_BUCKETS)
+            self.metrics.set("spi_throughput_mbps_last", throughput)
+            # fraction of the configured SPI clock that is actually used to move data
+            self.metrics.set("spi_clock_utilisation", throughput * 8e6 / self.spi.max_speed_hz)
+
+        logger.debug("SPI transfer of %d bytes in %d transfers (%d system calls) took %.4f seconds "
+                     "(encoding %.4f seconds). At %dHz clock.",
+                     bytes_sent, transfers, syscalls, spi_time, encode_time, self.spi.max_speed_hz)
+
+        if self.crc and transfers > 0:
+            self.check_crc_status()
+        return bytes_sent
+
+    def check_crc_status(self):
+        """
+        Read the FPGA status and raise an exception if it reports a CRC error for the image data
+        sent since the previous check. After an error, the content of the inactive buffer is
+        considered unknown.
+        """
+        status = self.__i2c_read(registers.FPGA_STATUS, 2)
+        if status[0] & registers.FPGA_STATUS_CRC_ERROR:
+            self.metrics.inc("crc_errors_total")
+            buffer_index = int(self.SPI_BUFFER_INDEX)
+            if self.shadows is not None:
+                self.shadows[buffer_index].invalidate()
+            # the next stack layer clears the whole buffer
+            self._stack_regions[buffer_index] = (0, NUM_COL_BLOCKS, 0, NUM_ROW_BLOCKS)
+            raise Exception("The FPGA reported a CRC error for the image data sent over SPI")
+
+    def __encode_frame(self, offset_width, offset_height, pixel_data):
+        """Encode a frame into SPI packets ahead of sending it, recording the encoding time."""
+        start = time.perf_counter()
+        encoded_frame = self.encoder.encode_frame(offset_width, offset_height, pixel_data)
+        self.metrics.observe("encode_seconds", time.perf_counter() - start)
+        return encoded_frame
+
+    def __send_through_cache(self, offset_width, offset_height, pixel_data, digest=None):
+        """
+        Send the image from the frame cache if it was encoded before, or encode it and add it to
+        the cache. pixel_data may be None if the digest is given and known to be in the cache.
+        """
+        if digest is None:
+            digest = self.frame_cache.content_digest(pixel_data)
+        key = self.frame_cache.key(digest, offset_width, offset_height, self.SPI_BUFFERSIZE)
+
+        encoded_frame = self.frame_cache.get(key)
+        if encoded_frame is None:
+            encoded_frame = self.__encode_frame(offset_width, offset_height, pixel_data)
+            self.frame_cache.put(key, encoded_frame)
+        else:
+            logger.debug("Sending image from frame cache")
 
-            data = data.flatten("F")
+        self.__write_packets(encoded_frame.packets(), encoded=True)
 
-            # Add 4 CRC bytes if this is the final transmission
-            if transfer_idx == (num_transfers-1):
-                # Note that CRC bytes are still needed even if you do not use CRC calculation.
-                # Note also that the TI programmer's guide is wrong on this matter (it says it should be 2 bytes)
-                data = np.append(data, np.array([0x00,0x00,0x00,0x00], dtype=np.uint8)) 
+    def __send_dirty_blocks(self, plan, pixel_data):
+        """
+        Send only the 128x2 blocks of the (padded) image that differ from the shadow copy of the
+        buffer we are writing to, and update the shadow copy afterwards.
 
-            # Note that xfer3 has a max number of bytes it can transfer set in /sys/module/spidev/parameters/bufsiz
-            self.spi.writebytes2(np.insert(data, 0, preamble))  # send transmission over spi
+        The changed blocks are grouped into rectangles, which are each sent as a separate
+        transfer sequence.
+        """
+        shadow = self.shadows[int(self.SPI_BUFFER_INDEX)]
+        target = pad_to_blocks(plan, pixel_data)
+        rects = shadow.dirty_rects(plan, target)
+
+        transform = None
+        if self.encoder.transform is not None:
+            image = np.zeros(target.shape, dtype=bool)
+            image[plan.pad_width_start:plan.pad_width_start + plan.img_width,
+                  plan.pad_height_start:plan.pad_height_start + plan.img_height] = True
+            transform = self.__padding_transform(image, plan.col_start * BLOCK_WIDTH, plan.row_start * BLOCK_HEIGHT)
+
+        def packets():
+            for (col_start, col_end, row_start, row_end) in rects:
+                x_start = (col_start - plan.col_start) * BLOCK_WIDTH
+                x_end = (col_end - plan.col_start) * BLOCK_WIDTH
+                y_start = (row_start - plan.row_start) * BLOCK_HEIGHT
+                y_end = (row_end - plan.row_start) * BLOCK_HEIGHT
+                block_data = target[x_start:x_end, y_start:y_end]
+
+                yield from self.encoder.packets(col_start * BLOCK_WIDTH, row_start * BLOCK_HEIGHT, block_data,
+                                                transform=transform)
+
+        bytes_sent = self.__write_packets(packets())
+
+        shadow.update(plan, target)
+
+        bytes_full = plan.total_size()
+        self.last_update_stats = {
+            "rects": len(rects),
+            "bytes_sent": bytes_sent,
+            "bytes_full": bytes_full,
+            "bytes_saved": bytes_full - bytes_sent,
+        }
+        self.metrics.inc("spi_bytes_saved_total", bytes_full - bytes_sent)
+        logger.debug("Dirty update: sent %d of %d bytes in %d rectangles (%d bytes saved)",
+                     bytes_sent, bytes_full, len(rects), bytes_full - bytes_sent)
+
+    def __padding_transform(self, image, x0, y0):
+        """
+        The transform of the encoder for data that is already padded to the 128x2 blocks: `image`
+        is a (width, height) mask of the pixels (of the region at x0, y0) that are not padding.
+        The padding is set back to 0 after the transform, like the padding added by the encoder.
+        """
+        transform = self.encoder.transform
 
-        print(f"SPI transfer took, {time.time()-SPI_start} seconds. At {self.spi.max_speed_hz}Hz clock.")
+        def padded_transform(rows, x, y):
+            transform(rows, x, y)
+            (height, width) = rows.shape
+            rows[~image[x - x0:x - x0 + width, y - y0:y - y0 + height].T] = 0
+
+        return padded_transform
 
     def set_background(self, intensity, both_buffers=False):
         '''
@@ -399,21 +766,54 @@ class DLPC1438:
         assert isinstance(intensity, int), "background intensity value must be an 8-bit integer"
         assert 0 <= intensity < 256, "Intensity must be [0, 255]"
 
-        print(f"> Setting all pixels in current SPI buffer to intensity:{intensity}")
- 
-        # yes, np.transpose(np.ones(y,x)) transfers faster than np.onex(x,y)
-        # I agree it feels a bit silly
-        pxldata = np.transpose((np.ones((1440, 2560))*int(intensity)).astype(np.uint8))
-        print(f"background image dimensions: {pxldata.shape}")
+        logger.debug("Setting all pixels in current SPI buffer to intensity:%d", intensity)
 
-        self.split_spi_transmission(0, 0, pxldata)  
+        self.fill_region(intensity, 0, 0, 2560, 1440)
 
         # if you want to set the intensity to both buffers
         if both_buffers:
             self.swap_buffer()
-            self.set_background(intensity, False)
+            self.fill_region(intensity, 0, 0, 2560, 1440)
+
+    def fill_region(self, intensity, xoffset, yoffset, width, height, cache=True):
+        '''
+        Set a rectangle of pixels in the inactive buffer to a constant intensity.
+
+        The SPI packets for a constant intensity are generated without creating an image in
+        memory, and are cached (for the FILL_CACHE_SIZE most recently used fills), so repeatedly
+        clearing the buffer is only an SPI transfer. Use cache=False for one-off fills. Note that,
+        like any other transfer, the rectangle is 0-padded to the 128x2 pixel blocks of the SPI format.
+        '''
+        assert isinstance(intensity, int), "fill intensity value must be an 8-bit integer"
+        assert 0 <= intensity < 256, "Intensity must be [0, 255]"
+        assert width > 0 and height > 0, "fill region must have a positive width and height"
+
+        # a broadcast view of a single value, so there is no full frame array to create or copy
+        pxldata = np.broadcast_to(np.uint8(intensity), (width, height))
+
+        key = (intensity, xoffset, yoffset, width, height)
+        encoded_frame = self._fill_cache.get(key)
+        if encoded_frame is None and cache:
+            encoded_frame = self.__encode_frame(xoffset, yoffset, pxldata)
+
+            self._fill_cache[key] = encoded_frame
+            if len(self._fill_cache) > self.FILL_CACHE_SIZE:
+                self._fill_cache.popitem(last=False)
+        elif encoded_frame is not None:
+            self._fill_cache.move_to_end(key)
+
+        if encoded_frame is not None:
+            plan = encoded_frame.plan
+            self.__write_packets(encoded_frame.packets(), encoded=True)
+        else:
+            plan = self.encoder.plan(xoffset, yoffset, pxldata)
+            self.__write_packets(self.encoder.packets(xoffset, yoffset, pxldata, plan))
+
+        if self.shadows is not None:
+            self.shadows[int(self.SPI_BUFFER_INDEX)].fill_region(plan, intensity)
+        if plan.width == 2560 and plan.height == 1440:
+            self._stack_regions[int(self.SPI_BUFFER_INDEX)] = None
 
-    
     def send_pixeldata_to_buffer(self, pixeldata, xoffset, yoffset):  
         '''
         Send a 2D array of pixeldata to the inactive buffer at the specified pixel offset
@@ -429,7 +829,7 @@ class DLPC1438:
         assert pixeldata.ndim == 2, "pixeldata must be a 2-dimensional array"
         assert pixeldata.dtype == np.uint8, "pixeldata array must be a uint8 (datatype) array"
 
-        print("> Sending array data over SPI... (SPLIT TECHNIQUE)")
+        logger.debug("Sending array data over SPI... (SPLIT TECHNIQUE)")
 
         self.split_spi_transmission(xoffset, yoffset, pixeldata)
 
@@ -445,12 +845,160 @@ class DLPC1438:
         a buffer swap and expose command to actually be used.
         '''
 
-        print("> Sending Image Data over SPI... (SPLIT TECHNIQUE)")
+        logger.debug("Sending image %s over SPI... (SPLIT TECHNIQUE)", filename)
+
+        if self.frame_cache is not None and self.shadows is None:
+            # images that were sent before at this offset don't need to be decoded again
+            digest = self.frame_cache.file_digest(filename)
+            key = self.frame_cache.key(digest, xoffset, yoffset, self.SPI_BUFFERSIZE)
+            pxldata = None
+            if digest is None or key not in self.frame_cache:
+                pxldata = image_to_arr(filename)
+                digest = self.frame_cache.content_digest(pxldata)
+
+            self.__send_through_cache(xoffset, yoffset, pxldata, digest)
+            self.frame_cache.remember_file(filename, digest)  # once its frame is in the cache
+            return
+
         pxldata = image_to_arr(filename)
 
         self.split_spi_transmission(xoffset, yoffset, pxldata)
     
-    def swap_buffer(self):
+    def send_stack_layer(self, layer):
+        '''
+        Send a layer of a LayerStack (see layer_stack.py) to the inactive buffer.
+
+        Stack layers are stored cropped to the bounding box of their nonzero pixels and are sent
+        straight from the memory-mapped file. Any part of the previous stack layer in this buffer
+        that falls outside the new layer is cleared first, as is anything sent with send_regions()
+        since. This assumes the buffers received nothing else since they were last cleared with
+        set_background().
+        '''
+        buffer_index = int(self.SPI_BUFFER_INDEX)
+        region = None if layer.empty else layer.region()
+
+        previous = self._stack_regions[buffer_index]
+        if previous is not None:
+            for (col_start, col_end, row_start, row_end) in subtract_rect(previous, region):
+                self.fill_region(0, col_start * BLOCK_WIDTH, row_start * BLOCK_HEIGHT,
+                                 (col_end - col_start) * BLOCK_WIDTH, (row_end - row_start) * BLOCK_HEIGHT, cache=False)
+
+        if region is not None:
+            self.split_spi_transmission(layer.xoffset, layer.yoffset, layer.pixel_data)
+        self._stack_regions[buffer_index] = region
+
+    def send_regions(self, placements):
+        '''
+        Send a batch of (pixeldata, xoffset, yoffset) placements to the inactive buffer in a single
+        transfer sequence, e.g. the tiles returned by rasterize_gerber().
+
+        The placements are composited (later ones on top of earlier ones) and the 128x2 blocks they
+        cover are sent as a minimal set of non-overlapping rectangles, so regions that share SPI
+        columns or blocks are not sent more than once. As with separate transfers, the remaining
+        pixels of these blocks are set to 0. With dirty tracking, only the blocks that changed are
+        sent.
+
+        Returns (and keeps in last_update_stats) the bytes sent, and the bytes that sending every
+        placement separately would have taken.
+        '''
+        assert len(placements) > 0, "no placements to send"
+        plans = []
+        for (pixeldata, xoffset, yoffset) in placements:
+            assert pixeldata.ndim == 2, "pixeldata must be a 2-dimensional array"
+            assert pixeldata.dtype == np.uint8, "pixeldata array must be a uint8 (datatype) array"
+            plans.append(self.encoder.plan(xoffset, yoffset, pixeldata))
+
+        # composite into a canvas covering the block aligned bounding box of all placements
+        col_start = min(plan.col_start for plan in plans)
+        col_end = max(plan.col_end + 1 for plan in plans)
+        row_start = min(plan.row_start for plan in plans)
+        row_end = max(plan.row_start + plan.height // BLOCK_HEIGHT for plan in plans)
+        (x0, y0) = (col_start * BLOCK_WIDTH, row_start * BLOCK_HEIGHT)
+        canvas = np.zeros(((col_end - col_start) * BLOCK_WIDTH, (row_end - row_start) * BLOCK_HEIGHT), dtype=np.uint8)
+        covered = np.zeros((col_end - col_start, row_end - row_start), dtype=bool)
+        image = np.zeros(canvas.shape, dtype=bool) if self.encoder.transform is not None else None
+        for ((pixeldata, xoffset, yoffset), plan) in zip(placements, plans):
+            canvas[xoffset - x0:xoffset - x0 + pixeldata.shape[0], yoffset - y0:yoffset - y0 + pixeldata.shape[1]] = pixeldata
+            if image is not None:
+                image[xoffset - x0:xoffset - x0 + pixeldata.shape[0], yoffset - y0:yoffset - y0 + pixeldata.shape[1]] = True
+            covered[plan.col_start - col_start:plan.col_end + 1 - col_start,
+                    plan.row_start - row_start:plan.row_start + plan.height // BLOCK_HEIGHT - row_start] = True
+
+        shadow = None
+        if self.shadows is not None:
+            shadow = self.shadows[int(self.SPI_BUFFER_INDEX)]
+            current = shadow.pixels[x0:x0 + canvas.shape[0], y0:y0 + canvas.shape[1]]
+            covered &= block_mask(current != canvas) | ~shadow.valid[col_start:col_end, row_start:row_end]
+
+        rects = [(x_start * BLOCK_WIDTH, x_end * BLOCK_WIDTH, y_start * BLOCK_HEIGHT, y_end * BLOCK_HEIGHT)
+                 for (x_start, x_end, y_start, y_end) in mask_to_rects(covered)]
+
+        transform = self.__padding_transform(image, x0, y0) if image is not None else None
+
+        def packets():
+            for (x_start, x_end, y_start, y_end) in rects:
+                yield from self.encoder.packets(x0 + x_start, y0 + y_start, canvas[x_start:x_end, y_start:y_end],
+                                                transform=transform)
+
+        bytes_sent = self.__write_packets(packets()) if rects else 0
+
+        if shadow is not None:
+            for (x_start, x_end, y_start, y_end) in rects:
+                block_data = canvas[x_start:x_end, y_start:y_end]
+                shadow.update(self.encoder.plan(x0 + x_start, y0 + y_start, block_data), block_data)
+        # the next stack layer in this buffer has to clear these blocks as well
+        buffer_index = int(self.SPI_BUFFER_INDEX)
+        self._stack_regions[buffer_index] = union_rect(self._stack_regions[buffer_index],
+                                                       (col_start, col_end, row_start, row_end))
+
+        # plain ints, the sizes are numpy integers for numpy offsets (e.g. of rasterized tiles) and
+        # the stats are sent as JSON by the daemon
+        (bytes_sent, bytes_separate) = (int(bytes_sent), int(sum(plan.total_size() for plan in plans)))
+        self.last_update_stats = {
+            "placements": len(placements),
+            "rects": len(rects),
+            "bytes_sent": bytes_sent,
+            "bytes_separate": bytes_separate,
+            "bytes_saved": bytes_separate - bytes_sent,
+        }
+        self.metrics.inc("spi_bytes_saved_total", bytes_separate - bytes_sent)
+        logger.debug("Batch of %d placements: sent %d bytes in %d rectangles, instead of %d bytes separately",
+                     len(placements), bytes_sent, len(rects), bytes_separate)
+        return self.last_update_stats
+
+    def send_encoded_frame(self, encoded_frame):
+        '''
+        Send a frame that was already encoded into SPI packets (see SPIPacketEncoder.encode_frame)
+        to the inactive buffer.
+
+        This allows the (relatively slow) encoding to happen ahead of time, e.g. on another
+        thread while the previous image is exposing, so only the SPI transfer remains.
+        '''
+        self.__write_packets(encoded_frame.packets(), encoded=True)
+
+        # the pixel data is not kept with the encoded frame, so we no longer know what this region holds
+        if self.shadows is not None:
+            plan = encoded_frame.plan
+            self.shadows[int(self.SPI_BUFFER_INDEX)].invalidate_region(
+                plan.col_start, plan.col_end + 1, plan.row_start, plan.row_start + plan.height // BLOCK_HEIGHT)
+
+    def set_correction(self, correction):
+        '''
+        Change the intensity correction applied to the images that are sent (None to disable it).
+
+        The cached encoded frames were corrected with the previous correction, so they are dropped,
+        and the buffer shadows no longer describe what the buffers show, so they are invalidated.
+        Frames that were encoded beforehand (EncodedFrame) keep the previous correction.
+        '''
+        self.encoder.transform = correction
+        self._fill_cache.clear()
+        if self.frame_cache is not None:
+            self.frame_cache.clear()
+        if self.shadows is not None:
+            for shadow in self.shadows:
+                shadow.invalidate()
+
+    def swap_buffer(self, verify=None):
         '''
         Swap the inactive buffer (where SPI data goes to) and the active buffer (displayed on DMD).
 
@@ -460,14 +1008,15 @@ class DLPC1438:
         buffer. 
         
         Displaying new data will always involve writing to the inactive buffer and
-        then swapping buffers to make the inactive buffer the active buffer.
+        then swapping buffers to make the inactive buffer the active buffer. The new buffer index
+        is only read back if `verify` is True (or verify_registers was set).
         '''
 
         # swap the image buffer to make our SENT SPI data available to FPGA and have
         # the other buffer available for SPI writing
         self.SPI_BUFFER_INDEX = not self.SPI_BUFFER_INDEX
-        self.__i2c_write(0xC5, [self.SPI_BUFFER_INDEX])  
-        print(f"Swapped buffer. The active buffer index is now: {self.__i2c_read(0xC6,1)[0]}")
+        self.registers.write(registers.BUFFER_INDEX, [self.SPI_BUFFER_INDEX], verify)
+        logger.debug("Swapped buffer. The active buffer index is now: %d", self.SPI_BUFFER_INDEX)
 
     def test_FPGA(self):
         """
@@ -477,15 +1026,15 @@ class DLPC1438:
         you want to run these commands and see the test pattern.
         """
         FPGA_version = self.__i2c_read(0x64,4)
-        print(f"FPGA version: {[bin(val) for val in FPGA_version]}")
+        logger.info("FPGA version: %s", [bin(val) for val in FPGA_version])
 
         FPGA_status = self.__i2c_read(0x6F,2)
-        print(f"FPGA status: {[bin(val) for val in FPGA_status]}")
+        logger.info("FPGA status: %s", [bin(val) for val in FPGA_status])
 
 
-        print(f"prallel video settings: {bin(self.__i2c_read(0xC4,1)[0])}")
+        logger.info("prallel video settings: %s", bin(self.registers.read(registers.PARALLEL_VIDEO, refresh=True)[0]))
 
         self.__i2c_write(0x67, [0b00000011, 0x0B]) 
-        print(f"FPGA testpattern settings: {[hex(val) for val in self.__i2c_read(0x68,2)]}")
+        logger.info("FPGA testpattern settings: %s", [hex(val) for val in self.__i2c_read(0x68,2)])
 
-        if not GPIO.input(self.SPI_RDY): warnings.warn("FPGA not ready to receive SPI data")
\ No newline at end of file
+        if not self.gpio.input(self.SPI_RDY): warnings.warn("FPGA not ready to receive SPI data")
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""
+Intensity correction of the pixels sent to the projector: thresholding, a 256 entry lookup table
+(e.g. to linearise the resin response) and a per-pixel flat-field gain map (to even out the
+illumination of the projector).
+
+The correction is applied by the packet encoder, to the rows of every SPI transfer while they are
+encoded (see write_packet), so it only touches the pixels that are actually sent and does not
+need any full-frame temporaries:
+
+    correction = IntensityCorrection(lut=gamma_lut(2.2), gain=flat_field_gain(measured))
+    correction.save("calibration.npz")
+
+    DMD = DLPC1438(i2c, spi, correction=IntensityCorrection.load("calibration.npz"))
+"""
+import numpy as np
+
+from UV_projector.shadow import FRAME_WIDTH, FRAME_HEIGHT
+
+GAIN_SHIFT = 8  # gains are stored as fixed point numbers with 8 fractional bits
+
+
+def gamma_lut(gamma):
+    """Lookup table mapping intensity i to 255 * (i / 255) ** gamma."""
+    return np.round(255 * (np.arange(256) / 255) ** gamma).astype(np.uint8)
+
+
+def flat_field_gain(measured, target=None):
+    """
+    Gain map that evens out a measured (2560, 1440) flat-field intensity (e.g. a photo of a full
+    white exposure, registered to the projector pixels), by attenuating every pixel to the
+    target intensity (by default the dimmest measured intensity).
+    """
+    measured = np.asarray(measured, dtype=np.float64)
+    assert measured.shape == (FRAME_WIDTH, FRAME_HEIGHT), "The flat-field measurement must be a (2560, 1440) array"
+    assert (measured > 0).all(), "The flat-field measurement must be positive everywhere"
+    if target is None:
+        target = measured.min()
+    return target / measured
+
+
+class IntensityCorrection:
+    """
+    A fused pixel correction: value = gain[x, y] * lut[threshold(value)].
+
+    - threshold: if given, pixels are first binarised to 0 (below the threshold) or 255,
+    - lut: 256 entry lookup table (identity if None),
+    - gain: (2560, 1440) per-pixel gain map at the native resolution of the projector (None for
+      no flat-field correction). Results are clipped to 255.
+
+    The threshold and LUT are combined into a single lookup table, and the gain map is stored in
+    SPI (row by row) order as fixed point numbers, so a transfer is corrected with a single table
+    lookup and one multiply-shift.
+    """
+
+    def __init__(self, lut=None, gain=None, threshold=None):
+        self.threshold = threshold
+        self.lut = np.arange(256, dtype=np.uint8) if lut is None else np.asarray(lut, dtype=np.uint8)
+        assert self.lut.shape == (256,), "The lookup table must have 256 entries"
+
+        self.table = self.lut
+        if threshold is not None:
+            assert 0 <= threshold <= 255, "threshold must be in range [0, 255]"
+            self.table = np.where(np.arange(256) >= threshold, self.lut[255], self.lut[0]).astype(np.uint8)
+
+        self.gain = None
+        self.gain_rows = None
+        if gain is not None:
+            gain = np.asarray(gain, dtype=np.float64)
+            assert gain.shape == (FRAME_WIDTH, FRAME_HEIGHT), "The gain map must be a (2560, 1440) array"
+            assert (gain >= 0).all() and (gain < 256).all(), "gains must be in range [0, 256)"
+            self.gain = gain
+            # (height, width) layout, so the gains of a transfer are a slice of whole rows
+            self.gain_rows = np.ascontiguousarray(np.round(gain.T * (1 << GAIN_SHIFT))).astype(np.uint16)
+
+    def __call__(self, rows, x, y):
+        """Correct the (num_rows, width) pixels of a transfer in place; (x, y) is their frame position."""
+        rows[...] = self.table[rows]
+        if self.gain_rows is not None:
+            height, width = rows.shape
+            # gains above 1 can take the product past 16 bits
+            corrected = np.multiply(rows, self.gain_rows[y:y + height, x:x + width], dtype=np.uint32)
+            corrected >>= GAIN_SHIFT
+            np.minimum(corrected, 255, out=corrected)
+            rows[...] = corrected
+
+    def apply(self, pixel_data, xoffset=0, yoffset=0):
+        """Return a corrected copy of a (width, height) image at the given frame offset (e.g. for previews)."""
+        rows = np.array(pixel_data.T, dtype=np.uint8)
+        self(rows, xoffset, yoffset)
+        return rows.T
+
+    def save(self, path):
+        """Store the calibration in a .npz file."""
+        arrays = {"lut": self.lut}
+        if self.gain is not None:
+            arrays["gain"] = self.gain
+        if self.threshold is not None:
+            arrays["threshold"] = np.array(self.threshold)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(lut=data["lut"], gain=data["gain"] if "gain" in data else None,
+                       threshold=int(data["threshold"]) if "threshold" in data else None)
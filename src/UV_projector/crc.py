@@ -0,0 +1,45 @@
+"""
+CRC16 of the pixel data of SPI image transfers.
+
+The CRC is CRC-16/CCITT (polynomial 0x1021, initial value 0xFFFF, not reflected, no final XOR;
+also known as CRC-16/CCITT-FALSE, check value 0x29B1), computed over the pixel bytes of all
+transfers of an image (the preambles are not included). It is sent little endian in the first 2
+of the 4 CRC bytes at the end of the final transfer, the other 2 bytes are 0.
+
+Note that the programmer's guide of the DLPC1438 does not spell out the variant, the seed or the
+byte order; the above is an assumption, which is what binascii.crc_hqx(data, 0xFFFF) computes.
+If it is wrong, every image is reported as a CRC error by the FPGA (see
+DLPC1438.check_crc_status), so it shows up on the first image sent with CRC enabled.
+
+The CRC is updated as every transfer is encoded, while its pixel bytes are still in the cache, so
+there is no second pass over the frame. binascii.crc_hqx is a table-driven implementation of
+exactly this CRC in C, which turned out faster than a vectorised (lane parallel) NumPy version.
+Run `python -m UV_projector.bench crc` for the cost per frame.
+"""
+import binascii
+import struct
+
+CRC_INIT = 0xFFFF
+
+
+def crc16(data, crc=CRC_INIT):
+    """CRC-16/CCITT of a bytes-like object, continuing from a previous crc value."""
+    return binascii.crc_hqx(data, crc)
+
+
+def crc_bytes(crc):
+    """The 4 CRC bytes sent at the end of an image for a given CRC value."""
+    return struct.pack("<HH", crc, 0)
+
+
+class RunningCRC:
+    """CRC16 that is updated transfer by transfer while an image is encoded."""
+
+    def __init__(self):
+        self.value = CRC_INIT
+
+    def update(self, data):
+        self.value = binascii.crc_hqx(data, self.value)
+
+    def to_bytes(self):
+        return crc_bytes(self.value)
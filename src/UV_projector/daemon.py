@@ -0,0 +1,445 @@
+"""
+Long-running projector daemon: one DLPC1438 kept warm and configured, shared by several client
+tools through a job queue on a Unix domain socket.
+
+    python -m UV_projector.daemon /tmp/uv_projector.sock --led-pwm 1000
+
+Jobs are run one at a time, in the order they were submitted, by the PrintEngine. The projector
+is initialised (with a warm start, see DLPC1438) and configured for external print once, and keeps
+dirty tracking enabled, so the setup cost of a job is only what differs from the previous one.
+
+Protocol: every message is a single line of JSON. A request may be followed by a binary payload
+of "payload_bytes" bytes (used for pixel data). Requests have a "command":
+
+- {"command": "submit", "job": {...}}: queue a print job (see Job for its fields). The daemon
+  replies with a "queued" event, followed by the "started", "layer" (one per exposed layer) and
+  finally a "done", "cancelled" or "error" event of the job, unless "wait" is false.
+- {"command": "cancel", "job": <id>}: cancel a queued or running job.
+- {"command": "status"}: the running and queued jobs, and the metrics of the controller.
+- {"command": "ping"}
+
+Replies are lines of JSON with an "event" field. Use DaemonClient to talk to the daemon:
+
+    with DaemonClient("/tmp/uv_projector.sock") as client:
+        for event in client.submit({"source": "archive", "path": "job.sl1"}):
+            print(event)
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import numpy as np
+
+from UV_projector.controller import DLPC1438, Mode
+from UV_projector.layer_stack import LayerStack
+from UV_projector.print_archive import PrintArchive
+from UV_projector.print_job import PrintEngine
+from UV_projector.shadow import FRAME_WIDTH, FRAME_HEIGHT
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("archive", "stack", "images", "pixels")
+FINAL_EVENTS = ("done", "cancelled", "error")
+
+
+def send_message(sock, message, payload=None):
+    """Send a JSON line (and a binary payload, whose size is added to the message)."""
+    if payload is not None:
+        message = dict(message, payload_bytes=len(payload))
+    sock.sendall(json.dumps(message).encode() + b"\n")
+    if payload is not None:
+        sock.sendall(payload)
+
+
+def read_message(stream):
+    """Read a JSON line and its payload (or None) from a binary file object. Returns (None, None) at EOF."""
+    line = stream.readline()
+    if not line:
+        return (None, None)
+    message = json.loads(line)
+    payload = None
+    if message.get("payload_bytes"):
+        payload = stream.read(message["payload_bytes"])
+        if len(payload) != message["payload_bytes"]:
+            raise EOFError("Connection closed while reading the payload")
+    return (message, payload)
+
+
+class Job:
+    """
+    A print job in the queue of the daemon. The job specification is a dict with a "source":
+
+    - "archive": a zipped SL1 style archive at "path" (optional "start", "stop" and "rotate"),
+    - "stack": a layer stack file at "path" (see layer_stack.py),
+    - "images": a list of image "files", each exposed for "exposure_frames",
+    - "pixels": a payload of uint8 pixel data of "shape" [layers, width, height], each exposed
+      for "exposure_frames" (a number, or a list with one number per layer),
+
+    and the optional PrintEngine settings "xoffset", "yoffset", "dark_frames" and "pre_encode".
+    With "clear" (the default), both buffers are cleared before the first layer.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, spec, payload=None):
+        assert spec.get("source") in SOURCES, f"the source of a job must be one of {SOURCES}"
+        self.id = next(self._ids)
+        self.spec = spec
+        self.payload = payload
+        self.state = "queued"
+        self.events = None  # events for the client that submitted the job, while it is listening
+        self.engine = None
+        self.cancelled = False
+
+        if spec["source"] == "pixels":
+            shape = tuple(spec["shape"])
+            assert len(shape) == 3, "the shape of pixel data must be [layers, width, height]"
+            assert payload is not None and len(payload) == int(np.prod(shape)), "the payload does not match the shape"
+
+    def listen(self):
+        """Queue the events of the job in self.events from now on, until stop_listening()."""
+        self.events = queue.Queue()
+
+    def stop_listening(self):
+        """Drop the events from now on, e.g. once the client stopped reading them."""
+        self.events = None
+
+    def emit(self, event, **fields):
+        events = self.events
+        if events is not None:
+            events.put(dict(fields, event=event, job=self.id))
+
+    def describe(self):
+        return {"job": self.id, "state": self.state, "source": self.spec["source"], "path": self.spec.get("path")}
+
+    def layers(self):
+        """The layers of the job, as taken by PrintEngine.run()."""
+        spec = self.spec
+        source = spec["source"]
+        if source == "archive":
+            with PrintArchive(spec["path"], rotate=spec.get("rotate", False)) as archive:
+                yield from archive.layers(spec.get("start", 0), spec.get("stop"))
+        elif source == "stack":
+            yield from LayerStack(spec["path"])
+        elif source == "images":
+            for filename in spec["files"]:
+                yield (filename, spec["exposure_frames"])
+        else:
+            pixel_data = np.frombuffer(self.payload, dtype=np.uint8).reshape(spec["shape"])
+            exposure_frames = spec["exposure_frames"]
+            if isinstance(exposure_frames, int):
+                exposure_frames = [exposure_frames] * len(pixel_data)
+            assert len(exposure_frames) == len(pixel_data), "need exposure_frames for every layer"
+            yield from zip(pixel_data, exposure_frames)
+
+
+class ProjectorDaemon:
+    """
+    Runs the jobs submitted on a Unix domain socket on a single DLPC1438, one at a time.
+
+    The projector is configured for external print with `led_pwm` on start(). Jobs are run on a
+    dedicated thread, every client connection is served by its own thread.
+    """
+
+    def __init__(self, dmd, socket_path, led_pwm=1000):
+        self.dmd = dmd
+        self.socket_path = socket_path
+        self.led_pwm = led_pwm
+
+        self.jobs = queue.Queue()
+        self.queued = []  # jobs that are waiting, in order
+        self.current = None
+        self._lock = threading.Lock()
+        self._server = None
+        self._worker = None
+
+    def start(self):
+        """Configure the projector and start listening for jobs (returns right away)."""
+        start = time.perf_counter()
+        self.dmd.configure_external_print(LED_PWM=self.led_pwm)
+        self.dmd.switch_mode(Mode.EXTERNALPRINT)
+        self.clear_buffers()
+        logger.info("Projector ready for jobs after %.3f seconds", time.perf_counter() - start)
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # left over from a previous run
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon._serve(self.request, self.rfile)
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="daemon-server", daemon=True).start()
+
+        self._worker = threading.Thread(target=self._run_jobs, name="daemon-jobs", daemon=True)
+        self._worker.start()
+        logger.info("Listening for jobs on %s", self.socket_path)
+
+    def stop(self):
+        """Stop accepting jobs, cancel the running job and wait for it to end, then close the DLPC1438."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            os.unlink(self.socket_path)
+        with self._lock:
+            for job in list(self.queued) + [self.current]:
+                if job is not None:
+                    self._cancel(job)
+        self.jobs.put(None)
+        if self._worker is not None:
+            self._worker.join()
+        self.dmd.close()
+
+    def serve_forever(self):
+        self.start()
+        try:
+            self._worker.join()
+        except KeyboardInterrupt:
+            logger.info("Stopping the daemon")
+            self.stop()
+
+    def clear_buffers(self):
+        """
+        Set both buffers to 0. With dirty tracking, only the blocks that are not known to be 0
+        already are sent, so this is (almost) free after a job that left little behind.
+        """
+        if self.dmd.shadows is None:
+            self.dmd.set_background(0, both_buffers=True)
+            return
+        blank = np.broadcast_to(np.uint8(0), (FRAME_WIDTH, FRAME_HEIGHT))
+        for _ in range(2):
+            self.dmd.send_pixeldata_to_buffer(blank, 0, 0)
+            self.dmd.swap_buffer()
+
+    # -- jobs --
+
+    def submit(self, job):
+        with self._lock:
+            self.queued.append(job)
+            position = len(self.queued) + (self.current is not None)
+        job.emit("queued", position=position)
+        self.jobs.put(job)
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a job by id; returns False if it is not queued or running."""
+        with self._lock:
+            for job in list(self.queued) + [self.current]:
+                if job is not None and job.id == job_id:
+                    self._cancel(job)
+                    return True
+        return False
+
+    def _cancel(self, job):
+        job.cancelled = True
+        if job in self.queued:  # never started
+            self.queued.remove(job)
+            job.state = "cancelled"
+            job.emit("cancelled", layers=0)
+        elif job.engine is not None:
+            job.engine.cancel()
+
+    def status(self):
+        with self._lock:
+            return {
+                "running": None if self.current is None else self.current.describe(),
+                "queued": [job.describe() for job in self.queued],
+                "metrics": self.dmd.metrics.as_dict(),
+            }
+
+    def _run_jobs(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.cancelled:  # cancelled while queued
+                    continue
+                self.queued.remove(job)
+                self.current = job
+                job.state = "running"
+            try:
+                self._run_job(job)
+            except Exception as error:
+                logger.exception("Job %d failed", job.id)
+                job.state = "error"
+                job.emit("error", message=str(error))
+            finally:
+                with self._lock:
+                    self.current = None
+
+    def _run_job(self, job):
+        spec = job.spec
+        start = time.perf_counter()
+        if spec.get("clear", True):
+            self.clear_buffers()
+        setup = time.perf_counter() - start
+        job.emit("started", setup_seconds=setup)
+
+        def progress(timing):
+            job.emit("layer", index=timing.index, timing=timing.as_dict())
+
+        engine = PrintEngine(self.dmd, spec.get("xoffset", 0), spec.get("yoffset", 0), spec.get("dark_frames", 5),
+                             pre_encode=spec.get("pre_encode", True), progress=progress)
+        with self._lock:
+            job.engine = engine
+            if job.cancelled:
+                engine.cancel()
+        timings = engine.run(job.layers())
+
+        job.state = "cancelled" if engine.cancelled else "done"
+        job.emit(job.state, layers=len(timings), seconds=time.perf_counter() - start, setup_seconds=setup)
+        logger.info("Job %d %s: %d layers in %.2f seconds (setup %.1fms)", job.id, job.state, len(timings),
+                    time.perf_counter() - start, setup * 1000)
+
+    # -- client connections --
+
+    def _serve(self, sock, stream):
+        while True:
+            try:
+                (request, payload) = read_message(stream)
+            except (EOFError, ValueError) as error:
+                send_message(sock, {"event": "error", "message": f"Invalid request: {error}"})
+                return
+            if request is None:
+                return
+
+            command = request.get("command")
+            try:
+                if command == "submit":
+                    job = Job(request.get("job", {}), payload)
+                    job.listen()  # before it is queued, so the "queued" event is not missed
+                    self.submit(job)
+                    self._stream_events(sock, job, request.get("wait", True))
+                elif command == "cancel":
+                    send_message(sock, {"event": "cancel", "job": request.get("job"), "found": self.cancel(request.get("job"))})
+                elif command == "status":
+                    send_message(sock, dict(self.status(), event="status"))
+                elif command == "ping":
+                    send_message(sock, {"event": "pong"})
+                else:
+                    send_message(sock, {"event": "error", "message": f"Unknown command {command!r}"})
+            except (AssertionError, KeyError, TypeError) as error:
+                send_message(sock, {"event": "error", "message": f"Invalid request: {error}"})
+            except OSError:  # the client went away, the job keeps running
+                return
+
+    @staticmethod
+    def _stream_events(sock, job, wait):
+        """
+        Send the events of a job to the client, until the job ended or (without `wait`) after the
+        first one. The events after that are dropped instead of queued.
+        """
+        events = job.events
+        try:
+            while True:
+                event = events.get()
+                send_message(sock, event)
+                if not wait or event["event"] in FINAL_EVENTS:
+                    return
+        finally:
+            job.stop_listening()
+
+
+class DaemonClient:
+    """Client for a ProjectorDaemon on a Unix domain socket."""
+
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self._stream = self.sock.makefile("rb")
+
+    def close(self):
+        self._stream.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, message, payload=None):
+        send_message(self.sock, message, payload)
+        (reply, _) = read_message(self._stream)
+        if reply is None:
+            raise EOFError("The daemon closed the connection")
+        return reply
+
+    def submit(self, job, pixel_data=None, wait=True):
+        """
+        Submit a job (see Job), with a [layers, width, height] uint8 array for a "pixels" job. Yields
+        the events of the job until it has finished (or only the "queued" event if not `wait`).
+        """
+        payload = None
+        if pixel_data is not None:
+            pixel_data = np.ascontiguousarray(pixel_data, dtype=np.uint8)
+            if pixel_data.ndim == 2:
+                pixel_data = pixel_data[np.newaxis]
+            job = dict(job, source="pixels", shape=list(pixel_data.shape))
+            payload = pixel_data.data.cast("B")
+        send_message(self.sock, {"command": "submit", "job": job, "wait": wait}, payload)
+
+        while True:
+            (event, _) = read_message(self._stream)
+            if event is None:
+                raise EOFError("The daemon closed the connection")
+            yield event
+            if not wait or event["event"] in FINAL_EVENTS or event.get("job") is None:
+                return
+
+    def run(self, job, pixel_data=None):
+        """Submit a job and wait for it to finish. Returns the final event."""
+        for event in self.submit(job, pixel_data):
+            pass
+        return event
+
+    def cancel(self, job_id):
+        return self._request({"command": "cancel", "job": job_id})["found"]
+
+    def status(self):
+        return self._request({"command": "status"})
+
+    def ping(self):
+        return self._request({"command": "ping"})["event"] == "pong"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the projector daemon, accepting print jobs on a Unix socket")
+    parser.add_argument("socket", help="path of the Unix domain socket to listen on")
+    parser.add_argument("--led-pwm", type=int, default=1000)
+    parser.add_argument("--spi-speed", type=int, default=125000000)
+    parser.add_argument("--emulate", action="store_true", help="use the emulated projector instead of the hardware")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+    if args.emulate:
+        from UV_projector.emulator import EmulatedProjector
+        projector = EmulatedProjector()
+        dmd = DLPC1438(projector.i2c, projector.spi, gpio=projector.gpio, dirty_tracking=True)
+    else:
+        import RPi.GPIO as GPIO
+        import smbus
+        import spidev
+
+        GPIO.setmode(GPIO.BCM)
+        spi = spidev.SpiDev()
+        spi.open(0, 0)
+        spi.max_speed_hz = args.spi_speed
+        spi.mode = 3
+        dmd = DLPC1438(smbus.SMBus(1), spi, dirty_tracking=True, warm_start=True)
+
+    ProjectorDaemon(dmd, args.socket, args.led_pwm).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+In-process emulation of the DLPC1438 + FPGA of the projector.
+
+Allows the DLPC1438 class to run without a raspberry pi or projector attached, e.g. for
+benchmarking and for checking that the data arriving in the FPGA buffers is correct:
+
+    projector = EmulatedProjector()
+    DMD = DLPC1438(projector.i2c, projector.spi, gpio=projector.gpio)
+"""
+import math
+import struct
+import threading
+import time
+import numpy as np
+
+from UV_projector.gpio_events import SimulatedGPIO
+from UV_projector.spi_packet import PREAMBLE_SIZE, CONTINUATION_PREAMBLE_SIZE, CRC_SIZE
+from UV_projector.spi_ioctl import decode_message
+from UV_projector.crc import CRC_INIT, crc16, crc_bytes
+
+FRAME_WIDTH = 2560
+FRAME_HEIGHT = 1440
+
+# I2C write command -> matching read command of the registers that simply store what is written
+READBACK_REGISTERS = {
+    0x54: 0x55,  # LED PWM
+    0xA8: 0xA9,  # external print configuration
+    0xC3: 0xC4,  # parallel video
+    0xC8: 0xC9,  # actuator orientation
+    0xCA: 0xCB,  # FPGA control
+    0x67: 0x68,  # FPGA test pattern
+}
+
+
+class TimingModel:
+    """
+    Timing behaviour of the emulated projector. All durations are in seconds and are multiplied
+    by time_scale, so the emulator can run faster (or slower) than the real hardware.
+    """
+
+    def __init__(self, boot_time=0.5, mode_switch_time=0.1, frame_rate=60, spi_bitrate_limit=None,
+                 spi_timing=False, time_scale=1.0):
+        self.boot_time = boot_time  # PROJ_ON high -> HOST_IRQ high and I2C available
+        self.mode_switch_time = mode_switch_time  # switch to EXTERNALPRINT -> SYS_RDY high
+        self.frame_rate = frame_rate  # frame clock of the parallel video signal
+        self.spi_bitrate_limit = spi_bitrate_limit  # max SPI clock the FPGA accepts (None: no limit)
+        self.spi_timing = spi_timing  # if True, SPI transfers take as long as they would on the wire
+        self.time_scale = time_scale
+
+    def scaled(self, duration):
+        return duration * self.time_scale
+
+
+class EmulatedI2C:
+    """Emulates the I2C register map of the DLPC1438 (as used by the DLPC1438 class), smbus API."""
+
+    def __init__(self, projector, addr=0x1B):
+        self.projector = projector
+        self.addr = addr
+        self.registers = {}
+        self.transactions = 0
+        self.log = []  # (command, data) of every write
+
+    def reset(self):
+        self.registers = {
+            0x06: [0xFF],  # STANDBY
+            0xC6: [0x00],  # active buffer
+            0x64: [0x01, 0x00, 0x00, 0x00],  # FPGA version
+            0x6F: [0x00, 0x00],  # FPGA status
+        }
+
+    def _check_address(self, addr):
+        if addr != self.addr or not self.projector.i2c_ready:
+            raise IOError(121, "Remote I/O error")
+        self.transactions += 1
+
+    def read_byte(self, addr):
+        self._check_address(addr)
+        return 0xFF
+
+    def read_i2c_block_data(self, addr, command, length):
+        self._check_address(addr)
+        data = list(self.registers.get(command, []))
+        if command == 0x6F:  # the CRC error flag is cleared by reading the status
+            self.registers[0x6F] = [self.registers[0x6F][0] & ~0x01] + self.registers[0x6F][1:]
+        return (data + [0x00] * length)[:length]
+
+    def write_i2c_block_data(self, addr, command, data):
+        self._check_address(addr)
+        data = [int(value) for value in data]
+        self.log.append((command, data))
+
+        if command in READBACK_REGISTERS:
+            self.registers[READBACK_REGISTERS[command]] = data
+        elif command == 0x05:
+            self.projector._switch_mode(data[0])
+        elif command == 0xC5:
+            self.projector._select_buffer(data[0] & 0x01)
+        elif command == 0xC1:
+            self.projector._exposure_command(data)
+        else:
+            self.registers[command] = data
+
+
+class EmulatedSPI:
+    """
+    Emulates the SPI interface of the FPGA (spidev API).
+
+    Every writebytes2() call is handled as a single transfer (chip select active for the whole
+    call). The 0x04 preamble, row/col data block, length and CRC framing is checked, and the pixel
+    data is written into the inactive framebuffer of the projector.
+
+    Batched SPI_IOC_MESSAGE ioctls (see spi_ioctl.py) are accepted through ioctl(), which can be
+    passed to DLPC1438 as spi_ioctl.
+    """
+
+    def __init__(self, projector, bufsiz=65536):
+        self.projector = projector
+        self.bufsiz = bufsiz
+        self.max_speed_hz = 125000000
+        self.mode = 3
+
+        self.bytes_received = 0
+        self.transfers = 0
+        self.messages = 0  # number of system calls that would have been made
+        self.images_received = 0
+        self.wire_time = 0.0  # time the transfers would take on the wire at max_speed_hz
+
+        self.crc_errors = 0
+        self._remaining = 0  # number of pixel bytes still expected for the current image
+        self._crc = CRC_INIT
+        self._next_row = None
+
+    def open(self, bus, device):
+        pass
+
+    def close(self):
+        pass
+
+    def fileno(self):
+        return -1
+
+    def ioctl(self, fd, request, transfers):
+        """Handle an SPI_IOC_MESSAGE ioctl, like the spidev driver."""
+        message = decode_message(request, transfers)
+        total = sum(len(data) for (data, _) in message)
+        assert total <= self.bufsiz, f"SPI message of {total} bytes exceeds spidev bufsiz of {self.bufsiz}"
+        for (index, (data, cs_change)) in enumerate(message):
+            # chip select must be released after every transfer, so each one is framed separately
+            assert cs_change or index == len(message) - 1, "chip select is not released between transfers"
+            self.writebytes2(data)
+        self.messages += 1 - len(message)  # writebytes2 counted every transfer as a system call
+
+    def writebytes2(self, data):
+        if isinstance(data, (list, tuple)):
+            data = np.array(data, dtype=np.uint8)
+        elif not isinstance(data, np.ndarray):
+            data = np.frombuffer(data, dtype=np.uint8)
+        length = data.size
+        assert length <= self.bufsiz, f"SPI transfer of {length} bytes exceeds spidev bufsiz of {self.bufsiz}"
+
+        wire_time = length * 8 / self.max_speed_hz
+        self.wire_time += wire_time
+        self.bytes_received += length
+        self.transfers += 1
+        self.messages += 1
+
+        self._parse_transfer(data)
+
+        timing = self.projector.timing
+        if timing.spi_bitrate_limit is not None:
+            assert self.max_speed_hz <= timing.spi_bitrate_limit, "SPI clock exceeds the limit of the FPGA"
+        if timing.spi_timing:
+            time.sleep(timing.scaled(wire_time))
+
+    def _parse_transfer(self, data):
+        assert data[0] == 0x04, f"SPI transfer should start with command 0x04, got {hex(data[0])}"
+        rowcol = struct.unpack_from("<I", data, 1)[0]
+        assert rowcol >> 28 == 0b1111, "the final 4 bits of the row/col data block should be 1"
+        assert data[5] == 0x00, "expected dummy byte after the row/col data block"
+
+        col_start = rowcol & 0x1F
+        col_end = (rowcol >> 5) & 0x1F
+        row_start = (rowcol >> 10) & 0x3FF
+        assert col_start <= col_end < FRAME_WIDTH // 128, f"invalid columns {col_start}-{col_end}"
+        width = (col_end - col_start + 1) * 128
+
+        if self._remaining == 0:  # first transfer of an image, which includes the total length
+            header = PREAMBLE_SIZE
+            self._remaining = struct.unpack_from("<I", data, 6)[0]
+            self._crc = CRC_INIT
+            assert self._remaining % (2 * width) == 0, "length does not describe a whole number of row pairs"
+        else:
+            header = CONTINUATION_PREAMBLE_SIZE
+            assert row_start == self._next_row, f"expected transfer to continue at row {self._next_row}, got {row_start}"
+
+        pixel_bytes = min(data.size - header, self._remaining)
+        assert pixel_bytes % width == 0, "transfer does not contain a whole number of pixel rows"
+        num_rows = pixel_bytes // width
+        assert row_start * 2 + num_rows <= FRAME_HEIGHT, "transfer extends beyond the bottom of the frame"
+
+        rows = data[header:header + pixel_bytes].reshape(num_rows, width)
+        framebuffer = self.projector.framebuffers[1 - self.projector.active_buffer]
+        framebuffer[col_start * 128:col_start * 128 + width, row_start * 2:row_start * 2 + num_rows] = rows.T
+
+        fpga_control = self.projector.i2c.registers.get(0xCB, [0x00])[0]
+        if fpga_control & 0b10:  # CRC calculation enabled
+            self._crc = crc16(np.ascontiguousarray(rows), self._crc)
+
+        self._remaining -= pixel_bytes
+        self._next_row = row_start + num_rows // 2
+        trailing = data.size - header - pixel_bytes
+        if self._remaining == 0:
+            assert trailing == CRC_SIZE, f"final transfer should end with {CRC_SIZE} CRC bytes, got {trailing}"
+            self.images_received += 1
+            self.projector.buffer_log.append((time.perf_counter(), "write", 1 - self.projector.active_buffer))
+
+            # a CRC mismatch (or an injected CRC error) sets the CRC error flag of the FPGA status
+            crc_valid = bytes(data[header + pixel_bytes:]) == crc_bytes(self._crc) and not fpga_control & 0b01
+            if fpga_control & 0b10 and not crc_valid:
+                self.crc_errors += 1
+                status = self.projector.i2c.registers[0x6F]
+                self.projector.i2c.registers[0x6F] = [status[0] | 0x01] + status[1:]
+        else:
+            assert trailing == 0, "only the final transfer of an image may contain CRC bytes"
+
+
+class EmulatedProjector:
+    """
+    The DLPC1438 + FPGA of the projector: I2C register map, SPI sink with both framebuffers and
+    the PROJ_ON/HOST_IRQ/SYS_RDY/SPI_RDY/PRINT_ACTIVE pins, driven by a TimingModel.
+    """
+
+    # Pin numbering (same as the DLPC1438 class defaults)
+    PROJ_ON = 5
+    SYS_RDY = 6
+    HOST_IRQ = 19
+    SPI_RDY = 7
+    PRINT_ACTIVE = 13
+
+    def __init__(self, timing=None, powered=False, pins=None, bufsiz=65536):
+        self.timing = TimingModel() if timing is None else timing
+        for (name, pin) in (pins or {}).items():
+            setattr(self, name, pin)
+
+        self.gpio = SimulatedGPIO()
+        self.i2c = EmulatedI2C(self)
+        self.spi = EmulatedSPI(self, bufsiz)
+
+        # framebuffers in the same (width, height) layout as the pixel data sent by the controller
+        self.framebuffers = [np.zeros((FRAME_WIDTH, FRAME_HEIGHT), dtype=np.uint8) for _ in range(2)]
+        self.active_buffer = 0
+        self.i2c_ready = False
+        self.exposures = []  # (timestamp, active buffer, dark frames, exposed frames) of every exposure
+        self.buffer_log = []  # (timestamp, "swap" or "write", buffer) of every buffer swap and image written
+        self._exposure_frames = []  # (start of the first exposed frame, end) of every exposure, see shown_frames()
+
+        self._lock = threading.Lock()
+        self._timers = []
+        self._exposure_id = 0
+        self._clock_start = time.perf_counter()
+
+        self.i2c.reset()
+        self.gpio.add_output_listener(self._on_output)
+        if powered:
+            self.gpio.levels[self.PROJ_ON] = self.gpio.HIGH
+            self._boot_done()
+
+    @property
+    def frame_period(self):
+        return self.timing.scaled(1 / self.timing.frame_rate)
+
+    def displayed_image(self):
+        """Pixel data of the framebuffer shown on the DMD (a swap only takes effect at the next frame)."""
+        (buffer, _) = self._shown_buffer(self._next_frame_boundary() - self.frame_period)
+        return self.framebuffers[buffer]
+
+    def inactive_image(self):
+        """Pixel data of the inactive framebuffer (the one SPI data is written to)."""
+        return self.framebuffers[1 - self.active_buffer]
+
+    def _schedule(self, delay, callback):
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        with self._lock:
+            self._timers = [t for t in self._timers if t.is_alive()] + [timer]
+        timer.start()
+
+    def _cancel_timers(self):
+        with self._lock:
+            for timer in self._timers:
+                timer.cancel()
+            self._timers = []
+
+    def _on_output(self, pin, level):
+        if pin != self.PROJ_ON:
+            return
+        if level:
+            if not self.i2c_ready:
+                self._schedule(self.timing.scaled(self.timing.boot_time), self._boot_done)
+        else:  # power down the DLPC1438
+            self._cancel_timers()
+            self._end_frames()
+            self.i2c_ready = False
+            self.i2c.reset()
+            self._select_buffer(0)
+            for pin in (self.HOST_IRQ, self.SYS_RDY, self.SPI_RDY, self.PRINT_ACTIVE):
+                self.gpio.set_input(pin, self.gpio.LOW)
+
+    def _select_buffer(self, buffer):
+        # SPI data goes to the other buffer right away, the DMD only changes over at the next frame
+        self.active_buffer = buffer
+        self.i2c.registers[0xC6] = [buffer]
+        self.buffer_log.append((time.perf_counter(), "swap", buffer))
+
+    def _shown_buffer(self, frame_start, frame_end=None):
+        """
+        (buffer, images written into it) of the frame from frame_start to frame_end. The images
+        include the ones written while the frame was shown, which would tear on the DMD.
+        """
+        if frame_end is None:
+            frame_end = frame_start
+        buffer = 0
+        writes = [0, 0]
+        for (timestamp, event, index) in self.buffer_log:
+            if timestamp >= frame_end:
+                break
+            if event == "write":
+                writes[index] += 1
+            elif timestamp < frame_start:
+                buffer = index
+        return (buffer, writes[buffer])
+
+    def shown_frames(self, exposure=-1):
+        """
+        What was shown in every exposed frame of an exposure (the last one by default), as a list
+        of (buffer, images written into that buffer). Swaps are latched at the frame clock: a frame
+        shows the buffer that was selected before it started. A buffer that is written while it is
+        shown has a different image count than in the frames before.
+        """
+        (first, end) = self._exposure_frames[exposure]
+        if end is None:  # still running
+            end = time.perf_counter()
+        period = self.frame_period
+        count = max(math.ceil((end - first) / period - 1e-6), 0)
+        return [self._shown_buffer(first + frame * period, first + (frame + 1) * period) for frame in range(count)]
+
+    def _boot_done(self):
+        self.i2c_ready = True
+        self._clock_start = time.perf_counter()
+        self.gpio.set_input(self.HOST_IRQ, self.gpio.HIGH)
+
+    def _switch_mode(self, mode):
+        self.i2c.registers[0x06] = [mode]
+        if mode == 0x06:  # EXTERNALPRINT
+            def ready():
+                self.gpio.set_input(self.SYS_RDY, self.gpio.HIGH)
+                self.gpio.set_input(self.SPI_RDY, self.gpio.HIGH)
+            self._schedule(self.timing.scaled(self.timing.mode_switch_time), ready)
+        else:
+            self._stop_exposure()
+            self.gpio.set_input(self.SYS_RDY, self.gpio.LOW)
+            self.gpio.set_input(self.SPI_RDY, self.gpio.LOW)
+
+    def _next_frame_boundary(self):
+        """Time (perf_counter) of the next tick of the frame clock."""
+        elapsed = time.perf_counter() - self._clock_start
+        return self._clock_start + (int(elapsed / self.frame_period) + 1) * self.frame_period
+
+    def _exposure_command(self, data):
+        if data[0] == 0x01:  # stop exposure
+            self._stop_exposure()
+            return
+
+        dark_frames = data[1] + (data[2] << 8)
+        exposed_frames = data[3] + (data[4] << 8)
+        with self._lock:
+            self._exposure_id += 1
+            exposure_id = self._exposure_id
+        self.exposures.append((time.perf_counter(), self.active_buffer, dark_frames, exposed_frames))
+        self._end_frames()
+        first = self._next_frame_boundary() + dark_frames * self.frame_period
+        self.gpio.set_input(self.PRINT_ACTIVE, self.gpio.HIGH)
+
+        if exposed_frames != 0xFFFF:  # 0xFFFF means: expose until stopped
+            end = first + exposed_frames * self.frame_period
+            self._exposure_frames.append((first, end))
+            self._schedule(max(end - time.perf_counter(), 0), lambda: self._end_exposure(exposure_id))
+        else:
+            self._exposure_frames.append((first, None))
+
+    def _end_exposure(self, exposure_id):
+        # ignore the timer of an exposure that was stopped or replaced in the meantime
+        if exposure_id == self._exposure_id:
+            self.gpio.set_input(self.PRINT_ACTIVE, self.gpio.LOW)
+
+    def _stop_exposure(self):
+        with self._lock:
+            self._exposure_id += 1
+        self._end_frames()
+        self.gpio.set_input(self.PRINT_ACTIVE, self.gpio.LOW)
+
+    def _end_frames(self):
+        # an exposure that is stopped (or replaced) ends with the frame it was stopped in
+        now = time.perf_counter()
+        if self._exposure_frames:
+            (first, end) = self._exposure_frames[-1]
+            if end is None or end > now:
+                self._exposure_frames[-1] = (first, max(now, first))
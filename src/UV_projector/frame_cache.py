@@ -0,0 +1,122 @@
+import collections
+import hashlib
+import os
+import numpy as np
+
+
+class EncodedFrameCache:
+    """
+    Memory-bounded LRU cache of EncodedFrames (the final SPI packet streams of images).
+
+    Frames are keyed by a hash of their pixel content together with the offset and SPI buffer
+    size, as those determine the padding and the way the image is split over transfers. When the
+    total size of the cached frames exceeds max_bytes, the least recently used frames are evicted.
+
+    Image files can additionally be looked up by path (and modification time), so a repeated
+    image does not even need to be decoded to find its cached frame. A file is only remembered
+    while frames of its content are cached, and is forgotten when the last of them is evicted.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._frames = collections.OrderedDict()
+        self._file_digests = {}  # (path, mtime, size) -> (digest, shape) of the decoded image
+        self._digest_files = collections.defaultdict(set)  # (digest, shape) -> file keys with that content
+        self._digest_frames = collections.Counter()  # (digest, shape) -> number of cached frames
+
+    @staticmethod
+    def content_digest(pixel_data):
+        """Hash of the pixel content of a (width, height) uint8 array, together with its shape."""
+        # pixel data is usually a transposed view of an image, so hash in that (contiguous) order
+        data = np.ascontiguousarray(pixel_data.T)
+        return (hashlib.blake2b(data, digest_size=16).digest(), pixel_data.shape)
+
+    @staticmethod
+    def file_key(filename):
+        status = os.stat(filename)
+        return (os.path.abspath(filename), status.st_mtime_ns, status.st_size)
+
+    def key(self, digest, offset_width, offset_height, buffersize):
+        return (digest, offset_width, offset_height, buffersize)
+
+    def file_digest(self, filename):
+        """Content digest of an image file that was cached before, or None if unknown."""
+        return self._file_digests.get(self.file_key(filename))
+
+    def remember_file(self, filename, digest):
+        """Remember the content digest of an image file, if frames of that content are cached."""
+        if self._digest_frames[digest] == 0:
+            return
+        file_key = self.file_key(filename)
+        previous = self._file_digests.get(file_key)
+        if previous is not None:
+            self._digest_files[previous].discard(file_key)
+        self._file_digests[file_key] = digest
+        self._digest_files[digest].add(file_key)
+
+    def _forget(self, key):
+        # the file lookups of a content go together with its last frame
+        digest = key[0]
+        self._digest_frames[digest] -= 1
+        if self._digest_frames[digest] == 0:
+            del self._digest_frames[digest]
+            for file_key in self._digest_files.pop(digest, ()):
+                del self._file_digests[file_key]
+
+    def get(self, key):
+        """Return the cached EncodedFrame for key (marking it as recently used), or None."""
+        frame = self._frames.get(key)
+        if frame is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._frames.move_to_end(key)
+        return frame
+
+    def put(self, key, frame):
+        """Add a frame to the cache, evicting the least recently used frames if needed."""
+        if frame.nbytes > self.max_bytes:
+            return  # would not fit even in an empty cache
+
+        if key in self._frames:
+            self.nbytes -= self._frames.pop(key).nbytes
+        else:
+            self._digest_frames[key[0]] += 1
+        self._frames[key] = frame
+        self.nbytes += frame.nbytes
+
+        while self.nbytes > self.max_bytes:
+            (evicted_key, evicted) = self._frames.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+            self._forget(evicted_key)
+
+    def clear(self):
+        self._frames.clear()
+        self._file_digests.clear()
+        self._digest_files.clear()
+        self._digest_frames.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {
+            "frames": len(self._frames),
+            "files": len(self._file_digests),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __contains__(self, key):
+        return key in self._frames
+
+    def __len__(self):
+        return len(self._frames)
@@ -0,0 +1,340 @@
+"""
+Rasteriser for a practical subset of Gerber (RS-274X) files and plain polygons, writing straight
+into projector-native tiles.
+
+Instead of rendering the full board into a bitmap, shapes are filled with vectorised scanline
+code in horizontal bands, and only the 128x2 pixel aligned tiles that contain copper are
+returned. Each tile is a (pixel_data, xoffset, yoffset) tuple, with pixel_data in the
+(width, height) uint8 layout used by send_pixeldata_to_buffer:
+
+    DMD.set_background(0)
+    for (pixel_data, xoffset, yoffset) in rasterize_gerber("board-F_Cu.gbr"):
+        DMD.send_pixeldata_to_buffer(pixel_data, xoffset, yoffset)
+
+Supported: format/unit statements (FS with leading zero omission, MO), circle, rectangle, obround
+and polygon apertures, flashes (D03), tracks (D01) with linear and multi-quadrant circular
+interpolation (G01/G02/G03/G75), regions (G36/G37) and dark/clear polarity (LP). Aperture macros
+and step-and-repeat are not supported.
+"""
+import math
+import re
+import numpy as np
+
+from UV_projector.shadow import FRAME_WIDTH, FRAME_HEIGHT, BLOCK_WIDTH, block_mask, mask_to_rects
+
+BAND_ROWS = 64  # number of pixel rows rasterised at once (must be even)
+
+
+def circle_polygon(cx, cy, radius, pixel_size=1.0):
+    """Polygon approximating a circle, with enough segments for a smooth edge at the pixel size."""
+    segments = int(min(256, max(12, 2 * math.pi * radius / pixel_size / 2)))
+    angles = np.linspace(0, 2 * math.pi, segments, endpoint=False)
+    return np.column_stack((cx + radius * np.cos(angles), cy + radius * np.sin(angles)))
+
+
+def convex_hull(points):
+    """Convex hull (counter clockwise) of an (N, 2) array of points, with the monotone chain algorithm."""
+    def cross(a, b):  # z of the cross product (np.cross of 2D vectors is deprecated)
+        return a[0] * b[1] - a[1] * b[0]
+
+    points = np.unique(points, axis=0)  # also sorts by x, then y
+    if len(points) < 3:
+        return points
+
+    def half_hull(ordered):
+        hull = []
+        for point in ordered:
+            while len(hull) >= 2 and cross(hull[-1] - hull[-2], point - hull[-2]) <= 0:
+                hull.pop()
+            hull.append(point)
+        return hull[:-1]
+
+    return np.array(half_hull(points) + half_hull(points[::-1]))
+
+
+def rasterize_polygons(polygons, polarities=None, intensity=255, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    """
+    Fill polygons (each an (N, 2) array of x, y pixel coordinates, y pointing down) and return the
+    128x2 aligned tiles containing filled pixels as (pixel_data, xoffset, yoffset) tuples.
+
+    Polygons are filled with the even-odd rule and combined in order: a polygon with dark
+    polarity (True, the default) adds to the image, one with clear polarity (False) removes.
+    """
+    if polarities is None:
+        polarities = [True] * len(polygons)
+
+    # collect all non-horizontal edges, tagged with their polygon and polarity group (a run of
+    # consecutive polygons with the same polarity)
+    edges, polygon_ids, group_ids, group_polarity = [], [], [], []
+    for (polygon_id, (polygon, dark)) in enumerate(zip(polygons, polarities)):
+        if not group_polarity or group_polarity[-1] != dark:
+            group_polarity.append(dark)
+        polygon = np.asarray(polygon, dtype=np.float64)
+        polygon_edges = np.hstack((polygon, np.roll(polygon, -1, axis=0)))
+        polygon_edges = polygon_edges[polygon_edges[:, 1] != polygon_edges[:, 3]]
+        edges.append(polygon_edges)
+        polygon_ids.append(np.full(len(polygon_edges), polygon_id))
+        group_ids.append(np.full(len(polygon_edges), len(group_polarity) - 1))
+
+    if not edges:
+        return []
+    edges = np.vstack(edges)
+    polygon_ids = np.concatenate(polygon_ids)
+    group_ids = np.concatenate(group_ids)
+    edge_ymin = np.minimum(edges[:, 1], edges[:, 3])
+    edge_ymax = np.maximum(edges[:, 1], edges[:, 3])
+
+    tiles = []
+    band = np.zeros((BAND_ROWS, width), dtype=bool)
+    for band_start in range(0, height, BAND_ROWS):
+        band_rows = min(BAND_ROWS, height - band_start)
+        row_centers = np.arange(band_start, band_start + band_rows) + 0.5
+
+        selected = np.flatnonzero((edge_ymax > row_centers[0]) & (edge_ymin <= row_centers[-1]))
+        if selected.size == 0:
+            continue
+
+        # intersections of the scanlines (through the pixel centers) with the edges
+        x0, y0, x1, y1 = edges[selected].T
+        crossing = ((row_centers[:, None] >= edge_ymin[selected]) & (row_centers[:, None] < edge_ymax[selected]))
+        rows, edge_idx = np.nonzero(crossing)
+        if rows.size == 0:
+            continue
+        x = x0[edge_idx] + (row_centers[rows] - y0[edge_idx]) * (x1[edge_idx] - x0[edge_idx]) / (y1[edge_idx] - y0[edge_idx])
+
+        # every polygon crosses a scanline an even number of times; after sorting the crossings per
+        # (row, polygon) by x, consecutive pairs are the filled spans
+        order = np.lexsort((x, polygon_ids[selected][edge_idx], rows))
+        x, rows, groups = x[order], rows[order], group_ids[selected][edge_idx][order]
+        span_rows, span_groups = rows[0::2], groups[0::2]
+        span_starts = np.clip(np.ceil(x[0::2] - 0.5), 0, width).astype(np.intp)
+        span_ends = np.clip(np.ceil(x[1::2] - 0.5), 0, width).astype(np.intp)
+        keep = span_ends > span_starts
+        if not keep.any():
+            continue
+        span_rows, span_groups, span_starts, span_ends = span_rows[keep], span_groups[keep], span_starts[keep], span_ends[keep]
+
+        # only work on the columns (in whole 128 pixel blocks) that are touched in this band
+        col_lo = span_starts.min() // BLOCK_WIDTH * BLOCK_WIDTH
+        col_hi = min(width, -(-span_ends.max() // BLOCK_WIDTH) * BLOCK_WIDTH)
+        region = band[:band_rows, col_lo:col_hi]
+        region[:] = False
+
+        for group in np.unique(span_groups):
+            in_group = span_groups == group
+            coverage = np.zeros((band_rows, col_hi - col_lo + 1), dtype=np.int32)
+            np.add.at(coverage, (span_rows[in_group], span_starts[in_group] - col_lo), 1)
+            np.add.at(coverage, (span_rows[in_group], span_ends[in_group] - col_lo), -1)
+            filled = np.cumsum(coverage, axis=1)[:, :-1] > 0
+            if group_polarity[group]:
+                region |= filled
+            else:
+                region &= ~filled
+
+        # cut the filled 128x2 blocks of this band into rectangular tiles
+        for (col_start, col_end, row_start, row_end) in mask_to_rects(block_mask(region.T)):
+            tile = region[row_start * 2:row_end * 2, col_start * BLOCK_WIDTH:col_end * BLOCK_WIDTH]
+            pixel_data = (tile * np.uint8(intensity)).T  # (width, height) view, like image_to_arr
+            tiles.append((pixel_data, int(col_lo) + col_start * BLOCK_WIDTH, band_start + row_start * 2))
+
+    return tiles
+
+
+class GerberReader:
+    """
+    Parser for the supported subset of RS-274X, producing the shapes as polygons in millimetres
+    (Gerber coordinates, y pointing up), each with a polarity.
+    """
+
+    def __init__(self):
+        self.polygons = []
+        self.polarities = []
+
+        self.apertures = {}
+        self.aperture = None
+        self.integer_digits, self.decimal_digits = 2, 6
+        self.scale = 1.0  # to millimetres
+        self.dark = True
+        self.interpolation = "G01"
+        self.position = (0.0, 0.0)
+        self.in_region = False
+        self.contour = []
+        self.resolution = 0.01  # max segment deviation (mm) when flattening arcs and circles
+
+    def parse(self, text):
+        for match in re.finditer(r"%([^%]*)%|([^%*]*)\*", text):
+            if match.group(1) is not None:
+                for statement in match.group(1).split("*"):
+                    statement = statement.strip()
+                    if statement:
+                        self._extended(statement)
+            else:
+                statement = "".join(match.group(2).split())
+                if statement:
+                    self._statement(statement)
+        return self
+
+    def _coordinate(self, value):
+        return int(value) / 10 ** self.decimal_digits * self.scale
+
+    def _extended(self, statement):
+        if statement.startswith("FS"):
+            format_spec = re.match(r"FS([LT])([AI])X(\d)(\d)Y(\d)(\d)", statement)
+            assert format_spec, f"Unsupported format statement: {statement}"
+            assert format_spec.group(1) == "L" and format_spec.group(2) == "A", \
+                "Only leading zero omission and absolute coordinates are supported"
+            self.integer_digits, self.decimal_digits = int(format_spec.group(3)), int(format_spec.group(4))
+        elif statement.startswith("MO"):
+            self.scale = 25.4 if statement == "MOIN" else 1.0
+        elif statement.startswith("LP"):
+            self.dark = statement == "LPD"
+        elif statement.startswith("AD"):
+            aperture = re.match(r"ADD(\d+)([A-Za-z_]\w*),?(.*)", statement)
+            assert aperture, f"Invalid aperture definition: {statement}"
+            template = aperture.group(2)
+            params = [float(value) * self.scale for value in aperture.group(3).split("X") if value]
+            assert template in ("C", "R", "O", "P"), f"Aperture macros are not supported ({template})"
+            if template == "P":
+                params[1:] = [p / self.scale for p in params[1:]]  # vertices and rotation are not lengths
+            self.apertures[int(aperture.group(1))] = (template, params)
+        elif statement.startswith("AM") or statement.startswith("SR"):
+            raise Exception(f"Unsupported Gerber statement: %{statement[:2]}")
+        # other extended statements (attributes, image polarity/name, ...) don't change the image
+
+    def _statement(self, statement):
+        if statement.startswith("G04") or statement.startswith("M0"):
+            return
+
+        for code in re.findall(r"G0*(\d+)", statement):
+            code = int(code)
+            if code in (1, 2, 3):
+                self.interpolation = f"G0{code}"
+            elif code == 36:
+                self.in_region, self.contour = True, []
+            elif code == 37:
+                self._close_contour()
+                self.in_region = False
+            elif code == 70:
+                self.scale = 25.4
+            elif code == 71:
+                self.scale = 1.0
+            elif code == 74:
+                raise Exception("Single quadrant arc mode (G74) is not supported")
+        statement = re.sub(r"G0*\d+", "", statement)
+
+        operation = re.match(r"^(?:X([+-]?\d+))?(?:Y([+-]?\d+))?(?:I([+-]?\d+))?(?:J([+-]?\d+))?(?:D0*(\d+))?$", statement)
+        if not statement or operation is None:
+            return
+        x, y, i, j, d_code = operation.groups()
+
+        if d_code is not None and int(d_code) >= 10:  # aperture selection
+            self.aperture = self.apertures[int(d_code)]
+            return
+
+        target = (self._coordinate(x) if x is not None else self.position[0],
+                  self._coordinate(y) if y is not None else self.position[1])
+        offset = (self._coordinate(i) if i is not None else 0.0, self._coordinate(j) if j is not None else 0.0)
+
+        if d_code == "1" or (d_code is None and (x is not None or y is not None)):
+            self._interpolate(target, offset)
+        elif d_code == "2":
+            if self.in_region:
+                self._close_contour()
+        elif d_code == "3":
+            self._add(self._aperture_polygon(target))
+        self.position = target
+
+    def _path(self, start, end, offset):
+        """Points along the path from start to end (excluding start) for the current interpolation mode."""
+        if self.interpolation == "G01":
+            return [end]
+
+        center = (start[0] + offset[0], start[1] + offset[1])
+        radius = math.hypot(start[0] - center[0], start[1] - center[1])
+        angle_start = math.atan2(start[1] - center[1], start[0] - center[0])
+        angle_end = math.atan2(end[1] - center[1], end[0] - center[0])
+        sweep = angle_end - angle_start
+        if self.interpolation == "G02":  # clockwise
+            sweep = sweep - 2 * math.pi if sweep >= 0 else sweep
+        else:
+            sweep = sweep + 2 * math.pi if sweep <= 0 else sweep
+
+        max_step = 2 * math.acos(max(-1.0, 1 - self.resolution / radius)) if radius > self.resolution else math.pi / 4
+        steps = max(2, int(math.ceil(abs(sweep) / max(max_step, 1e-3))))
+        angles = angle_start + sweep * np.arange(1, steps + 1) / steps
+        points = [(center[0] + radius * math.cos(a), center[1] + radius * math.sin(a)) for a in angles]
+        points[-1] = end
+        return points
+
+    def _interpolate(self, target, offset):
+        points = self._path(self.position, target, offset)
+        if self.in_region:
+            if not self.contour:
+                self.contour.append(self.position)
+            self.contour.extend(points)
+            return
+
+        start = self.position
+        for point in points:
+            # a track is the convex hull of the aperture at the start and at the end of the segment
+            self._add(convex_hull(np.vstack((self._aperture_polygon(start), self._aperture_polygon(point)))))
+            start = point
+
+    def _aperture_polygon(self, position):
+        assert self.aperture is not None, "No aperture selected before drawing"
+        template, params = self.aperture
+        x, y = position
+
+        if template == "C":
+            return circle_polygon(x, y, params[0] / 2, self.resolution * 4)
+        if template == "R":
+            w, h = params[0] / 2, params[1] / 2
+            return np.array([(x - w, y - h), (x + w, y - h), (x + w, y + h), (x - w, y + h)])
+        if template == "O":
+            w, h = params[0], params[1]
+            radius = min(w, h) / 2
+            if w >= h:
+                ends = [(x - w / 2 + radius, y), (x + w / 2 - radius, y)]
+            else:
+                ends = [(x, y - h / 2 + radius), (x, y + h / 2 - radius)]
+            return convex_hull(np.vstack([circle_polygon(ex, ey, radius, self.resolution * 4) for (ex, ey) in ends]))
+        # regular polygon: outer diameter, number of vertices, optional rotation in degrees
+        vertices = int(params[1])
+        rotation = math.radians(params[2]) if len(params) > 2 else 0.0
+        angles = rotation + np.arange(vertices) * 2 * math.pi / vertices
+        return np.column_stack((x + params[0] / 2 * np.cos(angles), y + params[0] / 2 * np.sin(angles)))
+
+    def _close_contour(self):
+        if len(self.contour) >= 3:
+            self._add(np.array(self.contour))
+        self.contour = []
+
+    def _add(self, polygon):
+        self.polygons.append(np.asarray(polygon, dtype=np.float64))
+        self.polarities.append(self.dark)
+
+
+def rasterize_gerber(path, pixel_size=0.05, xoffset=0, yoffset=0, intensity=255, mirror=False):
+    """
+    Rasterise a Gerber file at the given pixel size (mm, 0.05 is the native pixel size of the
+    projector) into 128x2 aligned tiles. The top left of the board's bounding box is placed at
+    pixel (xoffset, yoffset). Use mirror=True to flip the image horizontally (e.g. bottom layers).
+    """
+    with open(path) as gerber_file:
+        reader = GerberReader().parse(gerber_file.read())
+    if not reader.polygons:
+        return []
+
+    all_points = np.vstack(reader.polygons)
+    x_min, y_min = all_points.min(axis=0)
+    x_max, y_max = all_points.max(axis=0)
+    assert (x_max - x_min) / pixel_size + xoffset <= FRAME_WIDTH, "Board is too wide for the projector frame"
+    assert (y_max - y_min) / pixel_size + yoffset <= FRAME_HEIGHT, "Board is too tall for the projector frame"
+
+    polygons = []
+    for polygon in reader.polygons:
+        x = (x_max - polygon[:, 0] if mirror else polygon[:, 0] - x_min) / pixel_size + xoffset
+        y = (y_max - polygon[:, 1]) / pixel_size + yoffset  # Gerber y points up, image y down
+        polygons.append(np.column_stack((x, y)))
+
+    return rasterize_polygons(polygons, reader.polarities, intensity)
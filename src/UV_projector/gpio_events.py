@@ -0,0 +1,160 @@
+import threading
+import time
+
+
+class PinEvents:
+    """
+    Edge-event based waiting on the status pins of the DLPC1438/FPGA.
+
+    Works with any module that follows the RPi.GPIO API (input, add_event_detect,
+    remove_event_detect), so the pin backend can be swapped for e.g. SimulatedGPIO. Instead of
+    polling a pin and sleeping in between, a wait returns as soon as the edge callback fires.
+    """
+
+    def __init__(self, gpio, pins):
+        self.gpio = gpio
+        self.pins = list(pins)
+
+        self._condition = threading.Condition()
+        self._last_change = {pin: None for pin in self.pins}  # (timestamp, level) of the latest edge
+        self._listeners = {pin: [] for pin in self.pins}
+
+        # latency of the most recent wait per pin: total time waited, and the time between the
+        # edge callback firing and the waiting thread returning
+        self.latencies = {}
+
+        for pin in self.pins:
+            gpio.add_event_detect(pin, gpio.BOTH, callback=self._on_edge)
+
+    def _on_edge(self, pin):
+        timestamp = time.perf_counter()
+        level = self.gpio.input(pin)
+
+        with self._condition:
+            self._last_change[pin] = (timestamp, level)
+            self._condition.notify_all()
+
+        for listener in list(self._listeners[pin]):
+            listener(pin, level, timestamp)
+
+    def add_listener(self, pin, callback):
+        """Call callback(pin, level, timestamp) from the GPIO event thread on every edge of pin."""
+        self._listeners[pin].append(callback)
+
+    def remove_listener(self, pin, callback):
+        self._listeners[pin].remove(callback)
+
+    def last_change(self, pin):
+        """Return (timestamp, level) of the last edge seen on pin, or None if there was none yet."""
+        return self._last_change[pin]
+
+    def wait_for(self, pin, level, timeout=None):
+        """
+        Block until pin is at the given level (returns immediately if it already is).
+
+        Returns the time waited in seconds, or raises TimeoutError if the pin did not reach the
+        level within timeout seconds (wait indefinitely if timeout is None).
+        """
+        start = time.perf_counter()
+        with self._condition:
+            reached = self._condition.wait_for(lambda: self.gpio.input(pin) == level, timeout)
+        end = time.perf_counter()
+
+        if not reached:
+            raise TimeoutError(f"GPIO {pin} did not go {'high' if level else 'low'} within {timeout} seconds")
+
+        change = self._last_change[pin]
+        wake_latency = end - change[0] if change is not None and change[0] >= start else 0.0
+        self.latencies[pin] = {"waited": end - start, "wake_latency": wake_latency}
+
+        return end - start
+
+    def close(self):
+        """Stop listening for edges on the pins."""
+        for pin in self.pins:
+            self.gpio.remove_event_detect(pin)
+
+
+class SimulatedGPIO:
+    """
+    Minimal in-process stand-in for the RPi.GPIO module.
+
+    Input levels are driven with set_input(), which fires the registered edge callbacks just like
+    the RPi.GPIO event thread would. Output levels written by the controller can be inspected
+    with get_output(), or observed by registering an output listener.
+    """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.levels = {}
+        self.directions = {}
+        self._callbacks = {}
+        self._output_listeners = []
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, enabled):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        self.directions[pin] = direction
+        self.levels.setdefault(pin, self.LOW if initial is None else initial)
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def output(self, pin, level):
+        level = self.HIGH if level else self.LOW
+        self.levels[pin] = level
+        for listener in list(self._output_listeners):
+            listener(pin, level)
+
+    def get_output(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def add_output_listener(self, callback):
+        """Call callback(pin, level) whenever the controller writes an output pin."""
+        self._output_listeners.append(callback)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        if pin in self._callbacks:
+            raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+        self._callbacks[pin] = (edge, [] if callback is None else [callback])
+
+    def add_event_callback(self, pin, callback):
+        self._callbacks[pin][1].append(callback)
+
+    def remove_event_detect(self, pin):
+        self._callbacks.pop(pin, None)
+
+    def set_input(self, pin, level):
+        """Drive an input pin, firing the edge callbacks if the level changed."""
+        level = self.HIGH if level else self.LOW
+        with self._lock:
+            previous = self.levels.get(pin, self.LOW)
+            self.levels[pin] = level
+        if previous == level or pin not in self._callbacks:
+            return
+
+        edge, callbacks = self._callbacks[pin]
+        if edge == self.BOTH or (edge == self.RISING) == bool(level):
+            for callback in list(callbacks):
+                callback(pin)
+
+    def cleanup(self, pins=None):
+        for pin in (list(self._callbacks) if pins is None else pins):
+            self.remove_event_detect(pin)
@@ -0,0 +1,147 @@
+"""
+Greyscale lithography: dose maps compiled into sequences of binary exposures.
+
+The 8-bit intensity of the DMD is not linear enough to set a dose directly, so a dose map is
+decomposed into binary planes (all pixels at full intensity or off), each exposed for a number of
+frames with expose_pattern(). The dose of a pixel is the total number of frames it is on.
+
+- "bitplane": plane k holds bit k of the dose and is exposed 2**k frames (one plane per bit),
+- "threshold": one plane per distinct dose level, holding the pixels with at least that dose and
+  exposed for the difference to the previous level. Planes only lose pixels from one to the
+  next, so few blocks change between them, but there are more of them.
+
+The planes are run by the PrintEngine without pre-encoding, so with dirty tracking enabled on the
+controller only the 128x2 blocks that differ from what the inactive buffer holds (the plane before
+the previous one) are uploaded, while the previous plane is exposing:
+
+    DMD = DLPC1438(i2c, spi, dirty_tracking=True)
+    sequence = GreyscaleSequence(dose_to_frames(dose_map, max_frames=240))
+    print(sequence.estimate(DMD.spi.max_speed_hz, DMD.SPI_BUFFERSIZE))
+    sequence.run(DMD, xoffset, yoffset)
+"""
+import logging
+import numpy as np
+
+from UV_projector.print_job import PrintEngine, FRAME_RATE
+from UV_projector.shadow import block_mask, mask_to_rects, pad_to_blocks, BLOCK_WIDTH, BLOCK_HEIGHT
+from UV_projector.spi_packet import TransferPlan
+
+logger = logging.getLogger(__name__)
+
+MAX_EXPOSURE_FRAMES = 65534  # exposure_frames of a single exposure is a 16-bit value (65535 is reserved)
+MODES = ("bitplane", "threshold")
+
+
+def dose_to_frames(dose, max_frames, max_dose=None):
+    """Quantise a (width, height) dose map (any unit) to exposure frames, with max_dose (default: the maximum) at max_frames."""
+    dose = np.asarray(dose, dtype=np.float64)
+    if max_dose is None:
+        max_dose = dose.max()
+    assert max_dose > 0, "the dose map is empty"
+    return np.round(np.clip(dose / max_dose, 0, 1) * max_frames).astype(np.uint32)
+
+
+class GreyscaleSequence:
+    """
+    Binary exposure sequence for a (width, height) map of per-pixel exposure frames (see
+    dose_to_frames), with the planes shown at `intensity`.
+    """
+
+    def __init__(self, frames, mode="bitplane", intensity=255):
+        assert mode in MODES, f"mode must be one of {MODES}"
+        self.frames = np.asarray(frames)
+        assert self.frames.ndim == 2 and np.issubdtype(self.frames.dtype, np.integer) and (self.frames >= 0).all(), \
+            "frames must be a 2D array of non-negative integers"
+        self.mode = mode
+        self.intensity = intensity
+
+        # (level, exposure_frames) of every plane; a plane holds the pixels with that bit set
+        # (bitplane) or with at least that many frames (threshold)
+        if mode == "bitplane":
+            used_bits = np.bitwise_or.reduce(self.frames, axis=None)
+            self.levels = [(bit, 1 << bit) for bit in reversed(range(int(used_bits).bit_length())) if used_bits >> bit & 1]
+        else:
+            thresholds = np.unique(self.frames)
+            thresholds = thresholds[thresholds > 0].tolist()
+            self.levels = list(zip(thresholds, np.diff([0] + thresholds).tolist()))
+
+    def plane(self, level):
+        """Binary (width, height) pixel data of the plane of a level."""
+        if self.mode == "bitplane":
+            on = (self.frames >> level) & 1
+        else:
+            on = self.frames >= level
+        return on.astype(np.uint8) * np.uint8(self.intensity)
+
+    def layers(self):
+        """(pixel_data, exposure_frames) of every exposure, as taken by the PrintEngine."""
+        for (level, exposure_frames) in self.levels:
+            pixel_data = self.plane(level)
+            # longer exposures are repeated (with an unchanged plane, so nothing is uploaded)
+            while exposure_frames > 0:
+                frames = min(exposure_frames, MAX_EXPOSURE_FRAMES)
+                yield (pixel_data, frames)
+                exposure_frames -= frames
+
+    @property
+    def total_frames(self):
+        return sum(exposure_frames for (_, exposure_frames) in self.levels)
+
+    def estimate(self, spi_hz, buffersize=65536, xoffset=0, yoffset=0, dark_frames=5, frame_rate=FRAME_RATE):
+        """
+        Estimate the time the sequence takes, from the exposure frames and the SPI bytes of the
+        changed blocks that are uploaded for each plane. Uploads overlap with the exposure of the
+        previous plane, so only the part of an upload that takes longer adds to the job time. The
+        first two uploads are assumed to send the full region (the buffers are not known yet), and
+        I2C commands are not included.
+        """
+        plan = TransferPlan(xoffset, yoffset, self.frames.shape[0], self.frames.shape[1], buffersize)
+        buffers = [None, None]  # padded plane held by each FPGA buffer
+
+        exposures = 0
+        upload_bytes = []
+        total = 0.0
+        previous_exposure = 0.0
+        for (index, (pixel_data, exposure_frames)) in enumerate(self.layers()):
+            target = pad_to_blocks(plan, pixel_data)
+            current = buffers[index % 2]
+            if current is None:
+                changed = np.ones((plan.width // BLOCK_WIDTH, plan.height // BLOCK_HEIGHT), dtype=bool)
+            else:
+                changed = block_mask(current != target)
+            buffers[index % 2] = target
+
+            size = sum(TransferPlan((plan.col_start + col_start) * BLOCK_WIDTH, (plan.row_start + row_start) * BLOCK_HEIGHT,
+                                    (col_end - col_start) * BLOCK_WIDTH, (row_end - row_start) * BLOCK_HEIGHT,
+                                    buffersize).total_size()
+                       for (col_start, col_end, row_start, row_end) in mask_to_rects(changed))
+            upload_bytes.append(size)
+
+            upload = size * 8 / spi_hz
+            total += max(upload - previous_exposure, 0.0)
+            previous_exposure = (dark_frames + exposure_frames) / frame_rate
+            total += previous_exposure
+            exposures += 1
+
+        return {
+            "mode": self.mode,
+            "planes": len(self.levels),
+            "exposures": exposures,
+            "exposure_frames": self.total_frames,
+            "upload_bytes": sum(upload_bytes),
+            "full_frame_bytes": exposures * plan.total_size(),
+            "seconds": total,
+        }
+
+    def run(self, dmd, xoffset=0, yoffset=0, dark_frames=5):
+        """Expose the sequence on the projector (see PrintEngine) and return the LayerTimings."""
+        if dmd.shadows is None:
+            logger.warning("Dirty tracking is disabled on the controller, every plane is uploaded in full")
+
+        estimate = self.estimate(dmd.spi.max_speed_hz, dmd.SPI_BUFFERSIZE, xoffset, yoffset, dark_frames)
+        logger.info("Greyscale sequence: %d %s planes, %d exposure frames, %d of %d bytes uploaded, estimated %.2f seconds",
+                    estimate["planes"], self.mode, estimate["exposure_frames"], estimate["upload_bytes"],
+                    estimate["full_frame_bytes"], estimate["seconds"])
+
+        engine = PrintEngine(dmd, xoffset, yoffset, dark_frames=dark_frames, pre_encode=False)
+        return engine.run(self.layers())
@@ -1,11 +1,14 @@
+import logging
 from PIL import Image
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
 
 def image_to_arr(path):
     # TODO: run checks on image bit depth and so on
 
-    print("-- Converting image to bytes --")
+    logger.debug("Converting image %s to bytes", path)
     im_frame = Image.open(path)
     pixeldata = np.transpose(np.array(im_frame))
 
@@ -0,0 +1,191 @@
+"""
+Compact on-disk format for pre-rasterised layer stacks, for jobs that are printed more than once.
+
+Layout of a stack file (all values little endian):
+
+    header   32 bytes   magic b"UVLSTACK", version (u16), num_layers (u32), frame width and height (u16)
+    index    32 bytes per layer: data offset (u64), data size (u32), col_start, col_end, row_start,
+             num_rows, exposure_frames, dark_frames (u16 each)
+    data     raw uint8 pixel planes
+
+Every layer is cropped to the 128x2 block aligned bounding box of its nonzero pixels and stored
+row by row, which is the order in which the pixels are sent over SPI. Layers can then be
+memory-mapped and sent without any decoding or full-frame allocation.
+
+Convert a folder of images with:
+
+    python -m UV_projector.layer_stack <image folder> <output file> --exposure-frames 120
+"""
+import argparse
+import os
+import struct
+import numpy as np
+
+from UV_projector.img_convert import image_to_arr
+from UV_projector.shadow import FRAME_WIDTH, FRAME_HEIGHT, BLOCK_WIDTH, BLOCK_HEIGHT
+
+MAGIC = b"UVLSTACK"
+VERSION = 1
+HEADER = struct.Struct("<8sHIHH14x")
+INDEX_ENTRY = struct.Struct("<QIHHHHHH8x")
+DATA_ALIGNMENT = 64
+
+
+def nonzero_block_bbox(pixel_data):
+    """
+    Return the (col_start, col_end, row_start, row_end) bounding box (in 128x2 blocks, end
+    exclusive) of the nonzero pixels of a full-frame (width, height) array, or None if it is empty.
+    """
+    columns = np.flatnonzero(pixel_data.any(axis=1))
+    if columns.size == 0:
+        return None
+    rows = np.flatnonzero(pixel_data[columns[0]:columns[-1] + 1].any(axis=0))
+
+    return (columns[0] // BLOCK_WIDTH, columns[-1] // BLOCK_WIDTH + 1,
+            rows[0] // BLOCK_HEIGHT, rows[-1] // BLOCK_HEIGHT + 1)
+
+
+class StackLayer:
+    """A single (memory-mapped) layer of a LayerStack."""
+
+    def __init__(self, index, col_start, col_end, row_start, rows, exposure_frames, dark_frames):
+        self.index = index
+        self.col_start = col_start
+        self.col_end = col_end  # exclusive
+        self.row_start = row_start
+        self.rows = rows  # (num_rows, width) array, in the order the pixels are sent over SPI
+        self.exposure_frames = exposure_frames
+        self.dark_frames = dark_frames
+
+    @property
+    def empty(self):
+        return self.rows.shape[0] == 0
+
+    @property
+    def xoffset(self):
+        return self.col_start * BLOCK_WIDTH
+
+    @property
+    def yoffset(self):
+        return self.row_start * BLOCK_HEIGHT
+
+    @property
+    def pixel_data(self):
+        """The layer as a (width, height) array view, the layout used by send_pixeldata_to_buffer."""
+        return self.rows.T
+
+    def region(self):
+        """(col_start, col_end, row_start, row_end) of the layer in blocks (end exclusive)."""
+        return (self.col_start, self.col_end, self.row_start, self.row_start + self.rows.shape[0] // BLOCK_HEIGHT)
+
+
+class LayerStack:
+    """Read-only, memory-mapped access to a layer stack file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+
+        magic, version, num_layers, width, height = HEADER.unpack_from(self.data, 0)
+        assert magic == MAGIC, f"{path} is not a layer stack file"
+        assert version == VERSION, f"Unsupported layer stack version {version}"
+        assert (width, height) == (FRAME_WIDTH, FRAME_HEIGHT), "Layer stack was made for a different resolution"
+
+        self.index = [INDEX_ENTRY.unpack_from(self.data, HEADER.size + i * INDEX_ENTRY.size) for i in range(num_layers)]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        offset, size, col_start, col_end, row_start, num_rows, exposure_frames, dark_frames = self.index[index]
+        width = (col_end - col_start) * BLOCK_WIDTH
+        rows = self.data[offset:offset + size].reshape(num_rows, width) if size else np.zeros((0, BLOCK_WIDTH), dtype=np.uint8)
+        return StackLayer(index, col_start, col_end, row_start, rows, exposure_frames, dark_frames)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def write_layer_stack(path, layers, num_layers=None, dark_frames=5):
+    """
+    Write a layer stack file from an iterable of (pixel_data, exposure_frames) tuples, where
+    pixel_data is a full-frame (2560, 1440) uint8 array (the layout of send_pixeldata_to_buffer).
+
+    If num_layers is given, the layers are converted one at a time, so the full job never needs
+    to be in memory.
+    """
+    if num_layers is None:
+        layers = list(layers)
+        num_layers = len(layers)
+
+    with open(path, "wb") as output:
+        # the index is written once all layers (and so their offsets) are known
+        position = HEADER.size + num_layers * INDEX_ENTRY.size
+        output.write(bytes(position))
+
+        index = []
+        for (pixel_data, exposure_frames) in layers:
+            assert pixel_data.shape == (FRAME_WIDTH, FRAME_HEIGHT), "Layers must be full-frame (2560, 1440) arrays"
+            assert pixel_data.dtype == np.uint8, "Layers must be uint8 arrays"
+            assert len(index) < num_layers, "More layers than num_layers were provided"
+
+            bbox = nonzero_block_bbox(pixel_data)
+            if bbox is None:
+                index.append((0, 0, 0, 0, 0, 0, exposure_frames, dark_frames))
+                continue
+
+            col_start, col_end, row_start, row_end = bbox
+            padding = -position % DATA_ALIGNMENT
+            output.write(bytes(padding))
+            position += padding
+
+            rows = np.ascontiguousarray(pixel_data[col_start * BLOCK_WIDTH:col_end * BLOCK_WIDTH,
+                                                   row_start * BLOCK_HEIGHT:row_end * BLOCK_HEIGHT].T)
+            output.write(rows.tobytes())
+            index.append((position, rows.size, col_start, col_end, row_start, rows.shape[0], exposure_frames, dark_frames))
+            position += rows.size
+
+        assert len(index) == num_layers, f"Expected {num_layers} layers, got {len(index)}"
+
+        output.seek(0)
+        output.write(HEADER.pack(MAGIC, VERSION, num_layers, FRAME_WIDTH, FRAME_HEIGHT))
+        for entry in index:
+            output.write(INDEX_ENTRY.pack(*entry))
+
+
+def image_folder_files(folder):
+    """Sorted paths of the layer images in a folder."""
+    names = sorted(name for name in os.listdir(folder) if name.lower().endswith((".png", ".bmp", ".tif", ".tiff")))
+    return [os.path.join(folder, name) for name in names]
+
+
+def image_file_layers(files, exposure_frames):
+    """Yield (pixel_data, exposure_frames) for every image, placed at the top left of the frame."""
+    for filename in files:
+        pixel_data = image_to_arr(filename)
+        canvas = np.zeros((FRAME_WIDTH, FRAME_HEIGHT), dtype=np.uint8)
+        canvas[:pixel_data.shape[0], :pixel_data.shape[1]] = pixel_data
+        yield canvas, exposure_frames
+
+
+def convert_image_folder(folder, path, exposure_frames, dark_frames=5):
+    """Convert a folder of layer images (placed at the top left of the frame) into a layer stack file."""
+    files = image_folder_files(folder)
+    write_layer_stack(path, image_file_layers(files, exposure_frames), len(files), dark_frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a folder of layer images into a layer stack file")
+    parser.add_argument("folder")
+    parser.add_argument("output")
+    parser.add_argument("--exposure-frames", type=int, required=True)
+    parser.add_argument("--dark-frames", type=int, default=5)
+    args = parser.parse_args()
+
+    convert_image_folder(args.folder, args.output, args.exposure_frames, args.dark_frames)
+    print(f"Wrote {len(LayerStack(args.output))} layers to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Lightweight counters and latency histograms, exportable as a dict or in the Prometheus text format.
+
+    metrics = DMD.metrics
+    print(metrics.as_dict()["spi_chunk_seconds"]["mean"])
+    open("/var/lib/node_exporter/uv_projector.prom", "w").write(metrics.prometheus())
+"""
+import bisect
+import threading
+
+# latency buckets (upper bounds, in seconds) from 100us to 10s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, like a Prometheus histogram, also tracking the min and max."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is the +Inf bucket
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """
+    A set of named counters, gauges and histograms.
+
+    Collectors are functions returning a dict of extra gauge values; they are called on export,
+    so values that are already counted elsewhere (e.g. I2C transactions) don't need to be copied
+    on every update.
+    """
+
+    def __init__(self, prefix="uv_projector"):
+        self.prefix = prefix
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        self._lock = threading.Lock()  # the print engine and async wrappers update from other threads
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def _gauges(self):
+        gauges = dict(self.gauges)
+        for collector in self.collectors:
+            gauges.update(collector())
+        return gauges
+
+    def as_dict(self):
+        with self._lock:
+            result = dict(self.counters)
+            result.update(self._gauges())
+            result.update({name: histogram.as_dict() for (name, histogram) in self.histograms.items()})
+        return result
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for (name, value) in sorted(self.counters.items()):
+                lines += [f"# TYPE {self.prefix}_{name} counter", f"{self.prefix}_{name} {value}"]
+            for (name, value) in sorted(self._gauges().items()):
+                if value is not None:
+                    lines += [f"# TYPE {self.prefix}_{name} gauge", f"{self.prefix}_{name} {value}"]
+            for (name, histogram) in sorted(self.histograms.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for (bound, count) in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,251 @@
+"""
+Coordinated control of several projector heads, each a DLPC1438 with its own I2C bus, SPI bus
+and pins (see the pins argument of DLPC1438):
+
+    heads = [DLPC1438(smbus.SMBus(1), spi0, warm_start=True),
+             DLPC1438(smbus.SMBus(3), spi1, warm_start=True, pins={"PROJ_ON": 12, "SYS_RDY": 16, ...})]
+    with MultiHead(heads) as multihead:
+        timings = multihead.run(layers)  # every layer: ([pattern of head 0, pattern of head 1], exposure_frames)
+
+Every layer is encoded on a process pool (a layer ahead, so encoding overlaps with the uploads
+and exposures), uploaded to all heads in parallel with one thread per head, and exposed on all
+heads at the same time: the buffers are swapped first, and the exposure commands are released
+together from a barrier. The skew between the heads is measured from the rising edges of their
+PRINT_ACTIVE pins.
+"""
+import concurrent.futures
+import itertools
+import logging
+import threading
+import time
+import numpy as np
+
+from UV_projector.metrics import Metrics
+from UV_projector.spi_packet import encode_frame
+
+logger = logging.getLogger(__name__)
+
+SKEW_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02)
+
+_worker_transforms = None  # transform of every head, in the encode worker processes
+
+
+def _init_worker(transforms):
+    global _worker_transforms
+    _worker_transforms = transforms
+
+
+def _encode_for_head(head, xoffset, yoffset, pixel_data, buffersize, crc):
+    """encode_frame() in a worker process, with the transform the worker was initialised with."""
+    return encode_frame(xoffset, yoffset, pixel_data, buffersize, crc, _worker_transforms[head])
+
+
+class HeadsTiming:
+    """Timing information (in seconds) of a single layer exposed on all heads."""
+
+    def __init__(self, index, exposure_frames):
+        self.index = index
+        self.exposure_frames = exposure_frames
+        self.encode = 0.0  # waiting for the encoded frames of the layer
+        self.upload = 0.0  # uploading to all heads (in parallel)
+        self.upload_heads = []  # upload time of every head
+        self.wait = 0.0  # waiting for the previous exposure to finish on all heads after the upload
+        self.skew = None  # time between the first and the last head starting to expose
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        skew = "-" if self.skew is None else f"{self.skew*1e6:.0f}us"
+        return (f"layer {self.index}: encode wait {self.encode*1000:.1f}ms, upload {self.upload*1000:.1f}ms "
+                f"(slowest head {max(self.upload_heads, default=0)*1000:.1f}ms), skew {skew}")
+
+
+class MultiHead:
+    """
+    Runs layers on several DLPC1438 heads at once.
+
+    Encoding uses a pool of `processes` worker processes (default: one per CPU). The transforms
+    of the encoders (e.g. the correction tables) are sent to the workers once when they start,
+    only the pixel data is sent with every layer. With processes=0, layers are encoded on threads
+    instead, which avoids copying the pixel data between processes and is faster for small
+    patterns.
+    """
+
+    def __init__(self, heads, processes=None):
+        assert len(heads) > 0, "need at least one head"
+        self.heads = list(heads)
+        self.metrics = Metrics(prefix="uv_projector_multihead")
+
+        # one thread per head, so every bus is driven by its own thread
+        self._head_pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.heads), thread_name_prefix="head")
+        self._worker_transforms = None
+        if processes == 0:
+            self._encode_pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.heads), thread_name_prefix="encode")
+        else:
+            self._worker_transforms = [head.encoder.transform for head in self.heads]
+            self._encode_pool = concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                                                       initargs=(self._worker_transforms,))
+
+    def close(self):
+        """Shut down the thread and process pools, and close every head."""
+        self._head_pool.shutdown()
+        self._encode_pool.shutdown()
+        for head in self.heads:
+            head.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _on_heads(self, function, *args):
+        """Call function(head, *args) on every head in parallel, and return the results in head order."""
+        futures = [self._head_pool.submit(function, head, *args) for head in self.heads]
+        return [future.result() for future in futures]
+
+    # -- single steps --
+
+    def encode(self, patterns):
+        """
+        Start encoding a pattern for every head, either a (pixel_data, xoffset, yoffset) tuple or
+        just the pixel data (placed at 0, 0). Returns a future of the EncodedFrame of every head.
+        """
+        assert len(patterns) == len(self.heads), f"need a pattern for each of the {len(self.heads)} heads"
+        futures = []
+        for (index, (head, pattern)) in enumerate(zip(self.heads, patterns)):
+            if isinstance(pattern, np.ndarray):
+                pattern = (pattern, 0, 0)
+            (pixel_data, xoffset, yoffset) = pattern
+            encoder = head.encoder
+            if self._worker_transforms is not None and encoder.transform is self._worker_transforms[index]:
+                futures.append(self._encode_pool.submit(_encode_for_head, index, xoffset, yoffset, pixel_data,
+                                                        encoder.buffersize, encoder.crc))
+            else:  # threads, or the transform was changed after the workers started (see set_correction)
+                futures.append(self._encode_pool.submit(encode_frame, xoffset, yoffset, pixel_data,
+                                                        encoder.buffersize, encoder.crc, encoder.transform))
+        return futures
+
+    def upload(self, frames):
+        """Send an EncodedFrame to the inactive buffer of every head in parallel. Returns the time per head."""
+        def send(head, frame):
+            start = time.perf_counter()
+            head.send_encoded_frame(frame)
+            return time.perf_counter() - start
+
+        futures = [self._head_pool.submit(send, head, frame) for (head, frame) in zip(self.heads, frames)]
+        return [future.result() for future in futures]
+
+    def wait_exposures_done(self, timeout=None):
+        """Wait until no head is exposing anymore."""
+        self._on_heads(lambda head: head.wait_exposure_done(timeout))
+
+    def stop_exposures(self):
+        """Stop the exposure on every head."""
+        self._on_heads(lambda head: head.stop_exposure())
+
+    def expose(self, exposed_frames, dark_frames=5):
+        """
+        Swap the buffers of all heads, then start the exposure on all of them at once. Returns the
+        skew (in seconds) between the first and the last head that started exposing.
+
+        If any head fails, the exposure is stopped on all heads before the error is raised.
+        """
+        barrier = threading.Barrier(len(self.heads))
+
+        def trigger(head):
+            try:
+                head.swap_buffer()
+            except Exception:
+                barrier.abort()  # don't leave the other heads waiting
+                raise
+            barrier.wait()
+            start = time.perf_counter()
+            head.expose_pattern(exposed_frames, dark_frames)
+
+            # expose_pattern waits for PRINT_ACTIVE to go high, so its edge is known by now
+            change = head.events.last_change(head.PRINT_ACTIVE)
+            if change is not None and change[1] and change[0] >= start:
+                return change[0]
+            return start
+
+        try:
+            starts = self._on_heads(trigger)
+        except BaseException:
+            logger.error("Starting the exposure failed, stopping the exposure on all heads")
+            self.stop_exposures()
+            raise
+        skew = max(starts) - min(starts)
+        self.metrics.observe("expose_skew_seconds", skew, SKEW_BUCKETS)
+        return skew
+
+    # -- print jobs --
+
+    def run(self, layers, dark_frames=5, exposure_timeout=None):
+        """
+        Print all layers and return a list with a HeadsTiming for every layer. Every layer is a
+        (patterns, exposure_frames) tuple, with a pattern per head (see encode()).
+
+        While layer N is exposing, layer N+1 is uploaded to the inactive buffers and layer N+2 is
+        encoded. Blocks until the final exposure has finished on all heads.
+
+        On an error (e.g. a failed upload or an exposure that times out), the exposure is stopped on
+        all heads before the error is raised.
+        """
+        timings = []
+        layers = zip(itertools.count(), layers)
+
+        def prepare():
+            layer = next(layers, None)
+            if layer is None:
+                return None
+            (index, (patterns, exposure_frames)) = layer
+            return (index, exposure_frames, self.encode(patterns))
+
+        upcoming = prepare()
+        exposing = False  # an exposure may have been started, and must be stopped on an error
+        job_start = time.perf_counter()
+        try:
+            while upcoming is not None:
+                (index, exposure_frames, futures) = upcoming
+                timing = HeadsTiming(index, exposure_frames)
+
+                start = time.perf_counter()
+                frames = [future.result() for future in futures]
+                timing.encode = time.perf_counter() - start
+                upcoming = prepare()
+
+                start = time.perf_counter()
+                timing.upload_heads = self.upload(frames)
+                timing.upload = time.perf_counter() - start
+                self.metrics.observe("upload_seconds", timing.upload)
+
+                if exposing:
+                    start = time.perf_counter()
+                    self.wait_exposures_done(exposure_timeout)
+                    timing.wait = time.perf_counter() - start
+
+                exposing = True
+                timing.skew = self.expose(exposure_frames, dark_frames)
+
+                timings.append(timing)
+                logger.info("%s", timing)
+
+            if exposing:
+                self.wait_exposures_done(exposure_timeout)
+        except BaseException:
+            logger.error("Multi-head job failed after %d layers, stopping the exposure on all heads", len(timings))
+            if upcoming is not None:
+                for future in upcoming[2]:
+                    future.cancel()
+            if exposing:
+                self.stop_exposures()
+            raise
+
+        logger.info("Multi-head job of %d layers on %d heads took %.2f seconds", len(timings), len(self.heads),
+                    time.perf_counter() - job_start)
+        skews = [timing.skew for timing in timings]
+        if skews:
+            logger.info("Exposure skew between heads: mean %.0fus, max %.0fus", np.mean(skews) * 1e6, np.max(skews) * 1e6)
+        return timings
@@ -0,0 +1,136 @@
+import collections
+import concurrent.futures
+import io
+import re
+import threading
+import zipfile
+import numpy as np
+
+from UV_projector.img_convert import image_to_arr
+from UV_projector.print_job import FRAME_RATE
+
+
+def parse_config(text):
+    """Parse the 'key = value' lines of an SL1 config.ini into a dict (values kept as strings)."""
+    config = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(("#", ";", "[")) or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        config[key.strip()] = value.strip()
+    return config
+
+
+def layer_sort_key(name):
+    """Sort key of layer image names, numerically by their layer number (job2.png before job10.png)."""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+class PrintArchive:
+    """
+    Reader for sliced print jobs stored as a zip archive of per-layer PNG images plus a config
+    file, like the Prusa SL1 format.
+
+    Layers are read straight from the archive (without extracting it) and decoded ahead of time
+    on a thread pool. At most `prefetch` decoded layers are kept in memory, so even jobs with
+    thousands of layers only ever hold a few frames.
+
+        with PrintArchive("job.sl1") as job:
+            PrintEngine(DMD).run(job.layers())
+    """
+
+    CONFIG_NAME = "config.ini"
+
+    def __init__(self, path, prefetch=3, workers=2, rotate=False):
+        assert prefetch >= 1, "prefetch must be at least 1 layer"
+
+        self.path = path
+        self.prefetch = prefetch
+        self.workers = workers
+        self.rotate = rotate  # rotate portrait layer images (e.g. 1440x2560) to the projector orientation
+
+        self.zip = zipfile.ZipFile(path)
+        self._zip_lock = threading.Lock()
+
+        names = self.zip.namelist()
+        self.config = parse_config(self.zip.read(self.CONFIG_NAME).decode()) if self.CONFIG_NAME in names else {}
+
+        # layer images are named <jobDir><index>.png in the root of the archive, the index is not
+        # necessarily zero-padded
+        job_dir = self.config.get("jobDir", "")
+        self.layer_names = sorted((name for name in names
+                                   if name.lower().endswith(".png") and "/" not in name and name.startswith(job_dir)),
+                                  key=layer_sort_key)
+        assert self.layer_names, f"No layer images found in {path}"
+
+        self.exp_time = float(self.config.get("expTime", 0))
+        self.exp_time_first = float(self.config.get("expTimeFirst", self.exp_time))
+        self.num_fade = int(self.config.get("numFade", 0))
+        self.layer_height = float(self.config.get("layerHeight", 0))
+
+    def __len__(self):
+        return len(self.layer_names)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.zip.close()
+
+    def exposure_time(self, index):
+        """
+        Exposure time (in seconds) of a layer. The first numFade layers fade linearly from
+        expTimeFirst to expTime.
+        """
+        if index < self.num_fade:
+            return self.exp_time_first + (self.exp_time - self.exp_time_first) * index / self.num_fade
+        return self.exp_time
+
+    def exposure_frames(self, index):
+        """Exposure time of a layer in (~60Hz) frames, as used by expose_pattern()."""
+        return max(1, round(self.exposure_time(index) * FRAME_RATE))
+
+    def read_layer(self, index):
+        """Decode a single layer into a (width, height) uint8 array."""
+        with self._zip_lock:  # reading from the archive is serialised, decoding is not
+            data = self.zip.read(self.layer_names[index])
+
+        pixel_data = image_to_arr(io.BytesIO(data))
+        if pixel_data.ndim != 2:
+            raise Exception(f"Layer {self.layer_names[index]} is not a grayscale image")
+        if pixel_data.dtype != np.uint8:
+            pixel_data = pixel_data.astype(np.uint8)
+        if self.rotate and pixel_data.shape[1] > pixel_data.shape[0]:
+            pixel_data = np.rot90(pixel_data)
+        return pixel_data
+
+    def layers(self, start=0, stop=None):
+        """
+        Yield (pixel_data, exposure_frames) for every layer, decoding the next layers on the
+        thread pool while the current one is being used.
+        """
+        indices = iter(range(start, len(self) if stop is None else stop))
+        pending = collections.deque()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            def submit_next():
+                index = next(indices, None)
+                if index is not None:
+                    pending.append((index, pool.submit(self.read_layer, index)))
+
+            for _ in range(self.prefetch):
+                submit_next()
+
+            try:
+                while pending:
+                    index, future = pending.popleft()
+                    pixel_data = future.result()
+                    submit_next()
+                    yield pixel_data, self.exposure_frames(index)
+            finally:
+                for (_, future) in pending:
+                    future.cancel()
@@ -0,0 +1,275 @@
+import logging
+import queue
+import threading
+import time
+import numpy as np
+
+from UV_projector.img_convert import image_to_arr
+from UV_projector.layer_stack import StackLayer
+
+logger = logging.getLogger(__name__)
+
+FRAME_RATE = 60  # approximate frame rate of the parallel video signal of the FPGA
+
+
+class LayerTiming:
+    """Timing information (in seconds) of a single layer of a print job."""
+
+    def __init__(self, index, exposure_frames):
+        self.index = index
+        self.exposure_frames = exposure_frames
+        self.decode = 0.0  # loading the pattern into a pixel array (worker thread)
+        self.encode = 0.0  # encoding the pixel array into SPI packets (worker thread)
+        self.spi = 0.0  # sending the layer to the FPGA buffer
+        self.wait = 0.0  # waiting for the previous exposure to finish after the upload was done
+        self.idle_gap = None  # dead time between the end of the previous exposure and this one
+        self.i2c_transactions = 0  # I2C round trips for uploading, swapping and starting the exposure
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        gap = "-" if self.idle_gap is None else f"{self.idle_gap*1000:.1f}ms"
+        return (f"layer {self.index}: decode {self.decode*1000:.1f}ms, encode {self.encode*1000:.1f}ms, "
+                f"spi {self.spi*1000:.1f}ms, idle gap {gap}, {self.i2c_transactions} I2C transactions")
+
+
+class _PreparedLayer:
+    def __init__(self, index, exposure_frames, dark_frames, payload, timing):
+        self.index = index
+        self.exposure_frames = exposure_frames
+        self.dark_frames = dark_frames
+        self.payload = payload  # EncodedFrame, or pixel array if we are not pre-encoding
+        self.timing = timing
+
+
+class _Done:
+    def __init__(self, error=None):
+        self.error = error
+
+
+class PrintEngine:
+    """
+    Runs a sequence of layers on the projector, keeping the dead time between exposures small.
+
+    Every layer is a (pattern, exposure_frames) tuple, where the pattern is either an image
+    filename or a 2D uint8 array of pixel data (same layout as send_pixeldata_to_buffer). Layers of
+    a LayerStack can be passed directly; they are sent from their memory-mapped file and exposed
+    with their own number of dark frames (instead of `dark_frames` of the engine). While
+    layer N is exposing, layer N+1 is decoded and encoded into SPI packets on a worker thread and
+    uploaded into the inactive buffer. As soon as the exposure of layer N has finished, the
+    buffers are swapped and layer N+1 starts exposing.
+
+    If `pre_encode` is False, the worker thread only decodes the layers and they are sent with
+    send_pixeldata_to_buffer() instead, which makes use of the dirty tracking of the controller
+    (if enabled).
+
+    If given, `progress` is called with the LayerTiming of every layer as soon as it started
+    exposing. A running job can be stopped from another thread with cancel().
+    """
+
+    CANCEL_CHECK_INTERVAL = 0.1  # seconds between checks for a cancel() while waiting for an exposure
+
+    def __init__(self, dmd, xoffset=0, yoffset=0, dark_frames=5, prefetch=2, pre_encode=True, exposure_timeout=None,
+                 progress=None):
+        assert prefetch >= 1, "prefetch must be at least 1 layer"
+
+        self.dmd = dmd
+        self.xoffset = xoffset
+        self.yoffset = yoffset
+        self.dark_frames = dark_frames
+        self.prefetch = prefetch
+        self.pre_encode = pre_encode
+        self.exposure_timeout = exposure_timeout  # extra time (in seconds) on top of the nominal exposure time
+        self.progress = progress
+        self.timings = []
+        self._cancelled = threading.Event()  # the running job stops (cancelled, or failed)
+        self._cancel_requested = False  # a cancel() that the next run() has to honour
+        self._cancel_lock = threading.Lock()
+
+    def cancel(self):
+        """
+        Stop the running job: no further layers are uploaded, and the running exposure is stopped.
+        A cancel() while no job is running stops the next run() before its first layer.
+        """
+        with self._cancel_lock:
+            self._cancel_requested = True
+            self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        """True if the last job was stopped before all layers were exposed."""
+        return self._cancelled.is_set()
+
+    def _prepare_layers(self, layers, prepared):
+        """Worker thread: decode and encode the layers, and hand them over through a bounded queue."""
+        try:
+            for (index, layer) in enumerate(layers):
+                if self._cancelled.is_set():
+                    break
+                if isinstance(layer, StackLayer):
+                    # already rasterised and cropped, nothing to decode or encode
+                    prepared.put(_PreparedLayer(index, layer.exposure_frames, layer.dark_frames, layer,
+                                                LayerTiming(index, layer.exposure_frames)))
+                    continue
+
+                (pattern, exposure_frames) = layer
+                assert isinstance(exposure_frames, int) and 0 < exposure_frames < 65535, \
+                    "exposure_frames of a layer must be a positive 16-bit integer"
+                timing = LayerTiming(index, exposure_frames)
+
+                start = time.perf_counter()
+                if isinstance(pattern, np.ndarray):
+                    pixel_data = pattern
+                else:
+                    pixel_data = image_to_arr(pattern)
+                timing.decode = time.perf_counter() - start
+
+                payload = pixel_data
+                if self.pre_encode:
+                    start = time.perf_counter()
+                    payload = self.dmd.encoder.encode_frame(self.xoffset, self.yoffset, pixel_data)
+                    timing.encode = time.perf_counter() - start
+
+                prepared.put(_PreparedLayer(index, exposure_frames, self.dark_frames, payload, timing))
+            prepared.put(_Done())
+        except Exception as error:  # hand the error over to the thread running the print job
+            prepared.put(_Done(error))
+
+    def _upload(self, layer):
+        start = time.perf_counter()
+        if isinstance(layer.payload, StackLayer):
+            self.dmd.send_stack_layer(layer.payload)
+        elif self.pre_encode:
+            self.dmd.send_encoded_frame(layer.payload)
+        else:
+            self.dmd.send_pixeldata_to_buffer(layer.payload, self.xoffset, self.yoffset)
+        layer.timing.spi = time.perf_counter() - start
+
+    def _wait_exposure_done(self, expose_start, expected_end):
+        """
+        Wait for the running exposure to finish and return the time it ended, or None if the job
+        was cancelled while waiting.
+
+        The end time is taken from the falling edge of PRINT_ACTIVE, so it is also correct when the
+        exposure already finished while we were busy uploading the next layer. If no edge was seen,
+        the nominal end time (based on the number of frames) is used.
+        """
+        deadline = None
+        if self.exposure_timeout is not None:
+            deadline = max(expected_end, time.perf_counter()) + self.exposure_timeout
+
+        # wait in slices, so a cancel() does not have to wait for a long exposure to finish
+        while True:
+            timeout = self.CANCEL_CHECK_INTERVAL
+            if deadline is not None:
+                timeout = min(timeout, max(deadline - time.perf_counter(), 0))
+            try:
+                self.dmd.wait_exposure_done(timeout)
+                break
+            except TimeoutError:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    raise
+                if self._cancelled.is_set():
+                    return None
+
+        change = self.dmd.events.last_change(self.dmd.PRINT_ACTIVE)
+        if change is not None and change[0] >= expose_start and not change[1]:
+            return change[0]
+        return min(time.perf_counter(), expected_end)
+
+    @staticmethod
+    def _drain(prepared):
+        """Let the worker thread finish after a cancel(), it stops before the next layer."""
+        while not isinstance(prepared.get(), _Done):
+            pass
+
+    def run(self, layers):
+        """
+        Print all layers and return a list with a LayerTiming for every layer.
+
+        Blocks until the exposure of the final layer has finished (or the job was cancelled).
+        """
+        with self._cancel_lock:
+            # a previous job that was cancelled or failed does not stop this one, an early cancel() does
+            if not self._cancel_requested:
+                self._cancelled.clear()
+            self._cancel_requested = False
+        self.timings = []
+        prepared = queue.Queue(maxsize=self.prefetch)
+        worker = threading.Thread(target=self._prepare_layers, args=(layers, prepared), daemon=True)
+        worker.start()
+
+        expose_start = None
+        expected_end = None  # nominal end time of the running exposure
+        job_start = time.perf_counter()
+        worker_done = False
+        exposing = False  # an exposure may have been started, and must be stopped on a cancel or error
+        failed = False
+
+        try:
+            while True:
+                layer = prepared.get()
+                if isinstance(layer, _Done):
+                    worker_done = True
+                    if layer.error is not None:
+                        raise layer.error
+                    break
+                if self._cancelled.is_set():
+                    break
+
+                transactions = self.dmd.registers.transactions
+
+                # upload into the inactive buffer, while the previous layer may still be exposing
+                self._upload(layer)
+
+                exposure_end = None
+                if expected_end is not None:
+                    start = time.perf_counter()
+                    exposure_end = self._wait_exposure_done(expose_start, expected_end)
+                    layer.timing.wait = time.perf_counter() - start
+                if self._cancelled.is_set():
+                    break
+
+                self.dmd.swap_buffer()
+                expose_start = time.perf_counter()
+                exposing = True
+                self.dmd.expose_pattern(layer.exposure_frames, dark_frames=layer.dark_frames)
+                expected_end = expose_start + (layer.dark_frames + layer.exposure_frames) / FRAME_RATE
+                layer.timing.i2c_transactions = self.dmd.registers.transactions - transactions
+
+                if exposure_end is not None:
+                    layer.timing.idle_gap = max(expose_start - exposure_end, 0.0)
+
+                self.timings.append(layer.timing)
+                logger.info("%s", layer.timing)
+                if self.progress is not None:
+                    self.progress(layer.timing)
+
+            if expected_end is not None and not self._cancelled.is_set():
+                self._wait_exposure_done(expose_start, expected_end)
+        except BaseException:
+            failed = True
+            self._cancelled.set()  # the worker stops before its next layer
+            raise
+        finally:
+            # the worker may be blocked on the full queue, and the UV LED must not stay on
+            if not worker_done:
+                self._drain(prepared)
+            if self._cancelled.is_set():
+                if failed:
+                    logger.error("Print job failed after %d layers, stopping the exposure", len(self.timings))
+                else:
+                    logger.info("Print job was cancelled after %d layers", len(self.timings))
+                if exposing:
+                    self.dmd.stop_exposure()
+            worker.join()
+            with self._cancel_lock:
+                self._cancel_requested = False  # a cancel() of this job is done with
+
+        logger.info("Print job of %d layers took %.2f seconds.", len(self.timings), time.perf_counter()-job_start)
+        gaps = [timing.idle_gap for timing in self.timings if timing.idle_gap is not None]
+        if gaps:
+            logger.info("Idle gap between exposures: mean %.1fms, max %.1fms", np.mean(gaps)*1000, np.max(gaps)*1000)
+
+        return self.timings
@@ -0,0 +1,138 @@
+"""
+Register map of the DLPC1438 I2C commands used by this package.
+
+Every shadowed command has a write and a read opcode (e.g. 0xCA writes the FPGA control settings,
+0xCB reads them back). The RegisterMap keeps a host-side copy of the last value written to (or
+read from) each of them, so:
+
+- writes that would not change anything are skipped,
+- reading a register returns the shadow value instead of doing an I2C round trip,
+- reading back a register after writing it to verify the value is optional.
+
+All I2C traffic of the controller goes through the RegisterMap, so its transaction counter
+shows how many round trips an operation costs.
+"""
+
+
+class Register:
+    """A DLPC1438 command with a write and a read opcode and a fixed data length (in bytes)."""
+
+    def __init__(self, name, write, read, length):
+        self.name = name
+        self.write = write
+        self.read = read
+        self.length = length
+
+    def __repr__(self):
+        return f"Register({self.name}, write=0x{self.write:02X}, read=0x{self.read:02X}, length={self.length})"
+
+
+OPERATING_MODE = Register("OPERATING_MODE", 0x05, 0x06, 1)
+LED_CURRENT = Register("LED_CURRENT", 0x54, 0x55, 6)
+EXTERNAL_PRINT_CONFIG = Register("EXTERNAL_PRINT_CONFIG", 0xA8, 0xA9, 2)
+PARALLEL_VIDEO = Register("PARALLEL_VIDEO", 0xC3, 0xC4, 1)
+BUFFER_INDEX = Register("BUFFER_INDEX", 0xC5, 0xC6, 1)
+ACTUATOR_ORIENTATION = Register("ACTUATOR_ORIENTATION", 0xC8, 0xC9, 5)
+FPGA_CONTROL = Register("FPGA_CONTROL", 0xCA, 0xCB, 1)
+
+# bits of the FPGA control register (0xCA)
+FPGA_CRC_ERROR_INJECTION = 0b0001
+FPGA_CRC_ENABLE = 0b0010
+FPGA_RESET = 0b0100
+FPGA_RESET_UNLOCK = 0b1000
+
+# FPGA status (read only, 2 bytes); bit 0 of the first byte flags a CRC error. It is assumed to
+# stay set until the status is read.
+FPGA_STATUS = 0x6F
+FPGA_STATUS_CRC_ERROR = 0b0001
+
+REGISTERS = [OPERATING_MODE, LED_CURRENT, EXTERNAL_PRINT_CONFIG, PARALLEL_VIDEO, BUFFER_INDEX,
+             ACTUATOR_ORIENTATION, FPGA_CONTROL]
+
+# registers holding the external print configuration, which may be reset by the DLPC1438 when
+# it leaves external print mode
+CONFIG_REGISTERS = [LED_CURRENT, EXTERNAL_PRINT_CONFIG, PARALLEL_VIDEO, ACTUATOR_ORIENTATION, FPGA_CONTROL]
+
+
+class RegisterMap:
+    """
+    Shadowed access to the DLPC1438 registers over an I2C bus (smbus(2) API).
+
+    If `verify` is True, every write is read back and compared; this can also be set per write.
+    Commands that are not plain registers (e.g. starting an exposure with 0xC1) are sent with
+    raw_write(), which is counted but never skipped.
+    """
+
+    def __init__(self, i2c, addr, verify=False):
+        self.i2c = i2c
+        self.addr = addr
+        self.verify = verify
+
+        self.shadow = {}  # Register -> last known value (list of bytes)
+
+        self.transactions = 0
+        self.reads = 0
+        self.writes = 0
+        self.elided_writes = 0
+
+    def probe(self):
+        """Check if the DLPC1438 responds on the bus (raises IOError if it does not)."""
+        self.transactions += 1
+        return self.i2c.read_byte(self.addr)
+
+    def raw_read(self, command, length):
+        self.transactions += 1
+        self.reads += 1
+        return self.i2c.read_i2c_block_data(self.addr, command, length)
+
+    def raw_write(self, command, data):
+        self.transactions += 1
+        self.writes += 1
+        return self.i2c.write_i2c_block_data(self.addr, command, data)
+
+    def read(self, register, refresh=False):
+        """Value of a register, from the shadow copy if known (unless refresh is True)."""
+        if refresh or register not in self.shadow:
+            self.shadow[register] = list(self.raw_read(register.read, register.length))
+        return self.shadow[register]
+
+    def write(self, register, data, verify=None, force=False):
+        """
+        Write a register, unless the shadow copy shows it already holds this value (or force is
+        True). Returns True if the write was sent.
+
+        With verification (verify=True, or the map-wide setting if verify is None) the register is
+        read back afterwards, and an exception is raised if it holds a different value.
+        """
+        data = [int(value) for value in data]
+        assert len(data) == register.length, f"{register.name} takes {register.length} bytes, got {len(data)}"
+
+        if not force and self.shadow.get(register) == data:
+            self.elided_writes += 1
+            return False
+
+        self.shadow.pop(register, None)  # unknown if the write fails
+        self.raw_write(register.write, data)
+        self.shadow[register] = data
+
+        if self.verify if verify is None else verify:
+            value = self.read(register, refresh=True)
+            if value != data:
+                raise Exception(f"Verification of {register.name} failed: wrote {data}, read back {value}")
+        return True
+
+    def invalidate(self, registers=None):
+        """Forget the shadow value of the given registers (all registers if None)."""
+        if registers is None:
+            self.shadow.clear()
+        else:
+            for register in registers:
+                self.shadow.pop(register, None)
+
+    def stats(self):
+        return {
+            "transactions": self.transactions,
+            "reads": self.reads,
+            "writes": self.writes,
+            "elided_writes": self.elided_writes,
+        }
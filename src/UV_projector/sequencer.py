@@ -0,0 +1,283 @@
+"""
+Frame-synchronised pattern sequencing, for showing patterns at (close to) the frame rate of the
+parallel video signal, e.g. for moving small regions:
+
+    sequencer = Sequencer(DMD, mode="continuous")
+    sequencer.calibrate()
+    sequencer.run([((pattern, xoffset, yoffset), 1) for pattern in patterns])
+    print(sequencer.summary())
+
+Every step of a sequence is a (pattern, frames) tuple. The pattern is an EncodedFrame, a 2D
+uint8 array (placed at 0, 0), a (pixel_data, xoffset, yoffset) tuple, or None to only swap the
+buffers (alternating between what the two buffers already hold). Patterns are encoded before the
+sequence starts, so only the SPI transfer is left while it runs.
+
+There are two ways to time the buffer swaps:
+
+- "exposure": every pattern is a separate exposure of `frames` frames, counted by the DLPC1438.
+  The buffers are swapped and the next exposure started on the falling edge of PRINT_ACTIVE.
+  The frame counts are exact, but every exposure only starts at the frame after the command,
+  so each swap costs at least a frame.
+- "continuous": a single exposure runs for the whole sequence and the buffers are swapped in
+  the middle of the frame before a pattern is due, on the frame clock measured by calibrate().
+  No frames are lost to swapping, but a swap that is late shows the previous pattern for a
+  frame longer.
+
+Continuous mode assumes the FPGA latches a swap at the next frame boundary, and keeps showing
+the old buffer until then. The EmulatedProjector models this (see shown_frames(), which the tests
+check the sequencer against), but it has not been verified on the hardware.
+
+Late swaps and the frames they cost are reported per step (see StepTiming) and in summary(). They
+are derived from host timestamps, only the emulator knows what was actually shown per frame.
+"""
+import logging
+import math
+import time
+import numpy as np
+
+from UV_projector.print_job import FRAME_RATE
+from UV_projector.spi_packet import EncodedFrame
+
+logger = logging.getLogger(__name__)
+
+MODES = ("exposure", "continuous")
+SWAP_ERROR_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.004, 0.008, 0.016, 0.033)
+
+
+class StepTiming:
+    """Timing information (in seconds) of a single step of a sequence."""
+
+    def __init__(self, index, frames):
+        self.index = index
+        self.frames = frames
+        self.upload = 0.0  # sending the pattern to the inactive buffer
+        self.margin = None  # time left between the end of the upload and the swap being due (negative: late)
+        self.swap_error = None  # time between the swap being due and it being sent
+        self.late = False  # the swap took effect after the frame it was due
+        self.dropped_frames = 0  # frames lost because of a late swap
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        margin = "-" if self.margin is None else f"{self.margin*1000:.2f}ms"
+        error = "-" if self.swap_error is None else f"{self.swap_error*1000:.2f}ms"
+        return (f"step {self.index}: upload {self.upload*1000:.2f}ms, margin {margin}, swap error {error}"
+                f"{f', late ({self.dropped_frames} frames dropped)' if self.late else ''}")
+
+
+class Sequencer:
+    """
+    Shows a sequence of patterns on the projector, with the buffer swaps aligned to the frame
+    clock (see the module docstring for the modes). The controller must be in EXTERNALPRINT mode.
+    """
+
+    CALIBRATION_FRAMES = (1, 61)  # lengths of the exposures timed by calibrate()
+    EXPOSURE_OVERHEAD = 1  # frames between exposures when nothing is late (until measured): the one the command is sent in
+    EXPOSURE_TIMEOUT = 0.2  # extra time (in seconds) to wait for an exposure to end, on top of its nominal length
+
+    def __init__(self, dmd, mode="exposure", dark_frames=0, frame_rate=FRAME_RATE, pre_encode=True):
+        assert mode in MODES, f"mode must be one of {MODES}"
+        self.dmd = dmd
+        self.mode = mode
+        self.dark_frames = dark_frames
+        self.pre_encode = pre_encode
+
+        self.frame_period = 1 / frame_rate  # nominal until measured
+        self.frame_reference = None  # time of a frame boundary, measured by calibrate()
+        self.exposure_overhead = None  # frames between exposures (exposure mode), measured by run()
+        self.timings = []
+        self._elapsed = None
+
+    def calibrate(self):
+        """
+        Measure the frame period and the phase of the frame clock from the falling edges of
+        PRINT_ACTIVE at the end of two exposures of different lengths. The inactive buffer is
+        cleared and exposed for about a second.
+        """
+        self.dmd.set_background(0)
+        self.dmd.swap_buffer()
+
+        ends = []
+        for frames in self.CALIBRATION_FRAMES[:1] + self.CALIBRATION_FRAMES:  # the first one only marks a frame boundary
+            start = time.perf_counter()
+            self.dmd.expose_pattern(frames, dark_frames=0)
+            ends.append(self._wait_exposure_done(start, start + (frames + 2) * self.frame_period))
+        # both exposures take the same overhead, so it cancels out in the difference
+        (short, long) = (ends[1] - ends[0], ends[2] - ends[1])
+        self.frame_period = (long - short) / (self.CALIBRATION_FRAMES[1] - self.CALIBRATION_FRAMES[0])
+        self.frame_reference = ends[-1]
+        self.exposure_overhead = round(short / self.frame_period) - self.CALIBRATION_FRAMES[0]
+        logger.info("Measured frame period %.3fms (%.3f Hz), %d frame(s) between exposures",
+                    self.frame_period * 1000, 1 / self.frame_period, self.exposure_overhead)
+        return self.frame_period
+
+    def _prepare(self, step):
+        (pattern, frames) = step
+        assert isinstance(frames, int) and 0 < frames < 65535, "frames of a step must be a positive 16-bit integer"
+        if pattern is None or isinstance(pattern, EncodedFrame):
+            return (pattern, frames)
+        if isinstance(pattern, np.ndarray):
+            pattern = (pattern, 0, 0)
+        if self.pre_encode:
+            (pixel_data, xoffset, yoffset) = pattern
+            pattern = self.dmd.encoder.encode_frame(xoffset, yoffset, pixel_data)
+        return (pattern, frames)
+
+    def _upload(self, pattern, timing):
+        start = time.perf_counter()
+        if isinstance(pattern, EncodedFrame):
+            self.dmd.send_encoded_frame(pattern)
+        elif pattern is not None:
+            self.dmd.send_pixeldata_to_buffer(*pattern)
+        timing.upload = time.perf_counter() - start
+
+    def _wait_exposure_done(self, expose_start, expected_end):
+        """Wait for the running exposure to end, and return the time of the falling edge of PRINT_ACTIVE."""
+        self.dmd.wait_exposure_done(max(expected_end - time.perf_counter(), 0) + self.EXPOSURE_TIMEOUT)
+        change = self.dmd.events.last_change(self.dmd.PRINT_ACTIVE)
+        if change is not None and change[0] >= expose_start and not change[1]:
+            return change[0]
+        return min(time.perf_counter(), expected_end)
+
+    @staticmethod
+    def _sleep_until(deadline):
+        delay = deadline - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def run(self, steps):
+        """
+        Show all steps and return a list with a StepTiming for every step. Blocks until the final
+        pattern has been shown.
+        """
+        steps = [self._prepare(step) for step in steps]
+        self.timings = [StepTiming(index, frames) for (index, (_, frames)) in enumerate(steps)]
+        if not steps:
+            return self.timings
+
+        if self.mode == "exposure":
+            self._run_exposures(steps)
+        else:
+            self._run_continuous(steps)
+
+        for timing in self.timings:
+            if timing.swap_error is not None:
+                self.dmd.metrics.observe("sequencer_swap_error_seconds", timing.swap_error, SWAP_ERROR_BUCKETS)
+            if timing.late:
+                logger.info("%s", timing)
+        self.dmd.metrics.inc("sequencer_dropped_frames_total", sum(timing.dropped_frames for timing in self.timings))
+        logger.info("Sequence: %s", self.summary())
+        return self.timings
+
+    def _run_exposures(self, steps):
+        ends = []  # falling edge of PRINT_ACTIVE at the end of every exposure
+        first_start = None
+        expose_start = None
+        expected_end = None
+        for ((pattern, frames), timing) in zip(steps, self.timings):
+            self._upload(pattern, timing)
+            ready = time.perf_counter()
+
+            if expose_start is not None:
+                ends.append(self._wait_exposure_done(expose_start, expected_end))
+                timing.margin = ends[-1] - ready
+
+            expose_start = time.perf_counter()
+            if ends:
+                timing.swap_error = expose_start - ends[-1]
+            self.dmd.swap_buffer()
+            self.dmd.expose_pattern(frames, dark_frames=self.dark_frames)
+            if first_start is None:
+                first_start = expose_start
+            expected_end = expose_start + (self.dark_frames + frames + 1) * self.frame_period
+        ends.append(self._wait_exposure_done(expose_start, expected_end))
+        self._elapsed = ends[-1] - first_start
+
+        # the number of frames between two falling edges is the length of the exposure, plus the
+        # frames it took to start it. The usual number of frames an exposure that was uploaded in
+        # time took to start is the overhead of the protocol, anything on top of that was lost to
+        # a late swap (an edge that was timestamped late can make a single interval look short).
+        if len(ends) > 1:
+            frames = [step_frames + self.dark_frames for (_, step_frames) in steps[1:]]
+            intervals = np.diff(ends)
+            for _ in range(2):  # refine the frame period from the measured intervals
+                counted = np.round(intervals / self.frame_period)
+                self.frame_period = (ends[-1] - ends[0]) / counted.sum()
+            overheads = np.round(intervals / self.frame_period).astype(int) - frames
+            # only exposures whose upload was done in time show the overhead of the protocol
+            on_time = [overhead for (overhead, timing) in zip(overheads, self.timings[1:]) if timing.margin >= 0]
+            if on_time:
+                (values, counts) = np.unique(on_time, return_counts=True)
+                self.exposure_overhead = int(values[np.argmax(counts)])
+            elif self.exposure_overhead is None:
+                self.exposure_overhead = self.EXPOSURE_OVERHEAD
+            for (timing, overhead) in zip(self.timings[1:], overheads):
+                timing.dropped_frames = max(int(overhead) - self.exposure_overhead, 0)
+                timing.late = timing.dropped_frames > 0 or timing.margin < 0
+
+    def _run_continuous(self, steps):
+        if self.frame_reference is None:
+            self.calibrate()
+        period = self.frame_period
+
+        def next_boundary(moment):
+            return self.frame_reference + math.ceil((moment - self.frame_reference) / period) * period
+
+        ((pattern, frames), timing) = (steps[0], self.timings[0])
+        self._upload(pattern, timing)
+        self.dmd.swap_buffer()
+        self.dmd.expose_pattern(-1, dark_frames=self.dark_frames)
+        # the first pattern shows from the frame after the command (and the dark frames)
+        boundary = next_boundary(time.perf_counter()) + self.dark_frames * period
+        first_boundary = boundary
+
+        try:
+            for ((pattern, next_frames), timing) in zip(steps[1:], self.timings[1:]):
+                # the buffer that was swapped out is displayed until the swap takes effect at the boundary
+                self._sleep_until(boundary)
+                self._upload(pattern, timing)
+                boundary += frames * period
+                frames = next_frames
+
+                # swap in the middle of the frame before the pattern is due, as far from both
+                # frame boundaries as possible
+                due = boundary - period / 2
+                timing.margin = due - time.perf_counter()
+                self._sleep_until(due)
+                swap_time = time.perf_counter()
+                self.dmd.swap_buffer()
+                swapped = time.perf_counter()
+
+                timing.swap_error = swap_time - due
+                if swapped > boundary:
+                    # the previous pattern stays up until the swap takes effect, the rest of the
+                    # sequence is shifted so every pattern still gets its frames
+                    timing.late = True
+                    timing.dropped_frames = math.ceil((swapped - boundary) / period)
+                    boundary += timing.dropped_frames * period
+            boundary += frames * period
+            self._sleep_until(boundary)
+        finally:
+            self.dmd.stop_exposure()
+        self._elapsed = boundary - first_boundary
+
+    def summary(self):
+        """Achieved rates, swap jitter and late steps of the last run, as a dict."""
+        errors = [timing.swap_error for timing in self.timings if timing.swap_error is not None]
+        frames = sum(timing.frames for timing in self.timings)
+        elapsed = self._elapsed or 0.0
+        return {
+            "mode": self.mode,
+            "steps": len(self.timings),
+            "frames": frames,
+            "seconds": elapsed,
+            "frame_rate": float(1 / self.frame_period),  # of the video signal (measured, or nominal)
+            "pattern_rate": len(self.timings) / elapsed if elapsed else None,
+            "pattern_frame_rate": frames / elapsed if elapsed else None,  # pattern frames shown per second
+            "exposure_overhead_frames": self.exposure_overhead,
+            "swap_jitter": float(np.std(errors)) if errors else None,
+            "max_swap_error": max(errors, default=None),
+            "late_steps": sum(timing.late for timing in self.timings),
+            "dropped_frames": sum(timing.dropped_frames for timing in self.timings),
+        }
@@ -0,0 +1,148 @@
+import numpy as np
+
+# Native resolution of the DMD and the size of the smallest block that can be addressed over SPI
+FRAME_WIDTH = 2560
+FRAME_HEIGHT = 1440
+BLOCK_WIDTH = 128
+BLOCK_HEIGHT = 2
+NUM_COL_BLOCKS = FRAME_WIDTH // BLOCK_WIDTH
+NUM_ROW_BLOCKS = FRAME_HEIGHT // BLOCK_HEIGHT
+
+
+def block_mask(pixel_mask):
+    """
+    Reduce a (width, height) boolean mask that is aligned to the 128x2 block grid to a
+    (width/128, height/2) mask that is True for every block containing at least one True pixel.
+    """
+    width, height = pixel_mask.shape
+    return pixel_mask.reshape(width // BLOCK_WIDTH, BLOCK_WIDTH, height // BLOCK_HEIGHT, BLOCK_HEIGHT).any(axis=(1, 3))
+
+
+def mask_to_rects(mask):
+    """
+    Convert a (col_blocks, row_blocks) boolean mask into a list of non-overlapping rectangles
+    (col_start, col_end, row_start, row_end) in block units (end exclusive) that cover exactly
+    the True blocks.
+
+    Every block row is split into runs of consecutive True blocks, and runs with the same
+    columns in consecutive block rows are merged into a single rectangle.
+    """
+    # find the start and end of the runs of True blocks along each block row
+    padded = np.zeros((mask.shape[1], mask.shape[0] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask.T
+    edges = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    _, run_ends = np.nonzero(edges == -1)  # same (row major) ordering as the run starts
+
+    rects = []
+    open_rects = {}  # (col_start, col_end) -> [row_start, row_end] of the rectangle being grown
+    for (row, col_start, col_end) in zip(run_rows.tolist(), run_starts.tolist(), run_ends.tolist()):
+        rect = open_rects.get((col_start, col_end))
+        if rect is not None and rect[1] == row:
+            rect[1] = row + 1
+        else:
+            if rect is not None:
+                rects.append((col_start, col_end, rect[0], rect[1]))
+            open_rects[(col_start, col_end)] = [row, row + 1]
+
+    for ((col_start, col_end), (row_start, row_end)) in open_rects.items():
+        rects.append((col_start, col_end, row_start, row_end))
+
+    return sorted(rects, key=lambda rect: (rect[2], rect[0]))
+
+
+def subtract_rect(rect, other):
+    """
+    Return the parts of rect (col_start, col_end, row_start, row_end) that are not covered by
+    other (or all of rect if other is None), as a list of up to 4 non-overlapping rectangles.
+    """
+    col_start, col_end, row_start, row_end = rect
+    if other is None:
+        return [rect]
+
+    # clip the other rectangle to this one
+    other_col_start, other_col_end = max(other[0], col_start), min(other[1], col_end)
+    other_row_start, other_row_end = max(other[2], row_start), min(other[3], row_end)
+    if other_col_start >= other_col_end or other_row_start >= other_row_end:
+        return [rect]
+
+    rects = [
+        (col_start, col_end, row_start, other_row_start),  # above
+        (col_start, col_end, other_row_end, row_end),  # below
+        (col_start, other_col_start, other_row_start, other_row_end),  # left
+        (other_col_end, col_end, other_row_start, other_row_end),  # right
+    ]
+    return [r for r in rects if r[0] < r[1] and r[2] < r[3]]
+
+
+def union_rect(rect, other):
+    """
+    Return the smallest rectangle (col_start, col_end, row_start, row_end) covering both rect and
+    other, where either one may be None (no rectangle).
+    """
+    if rect is None or other is None:
+        return other if rect is None else rect
+    return (min(rect[0], other[0]), max(rect[1], other[1]), min(rect[2], other[2]), max(rect[3], other[3]))
+
+
+class FramebufferShadow:
+    """
+    Host-side copy of the content of one of the two FPGA framebuffers.
+
+    Every 128x2 block has a validity flag. Blocks are only valid when we know for sure what the
+    FPGA holds there, e.g. after we sent data to it. Invalid blocks are always considered changed.
+    """
+
+    def __init__(self):
+        # stored in the same (width, height) layout as the pixel data sent to the controller
+        self.pixels = np.zeros((FRAME_WIDTH, FRAME_HEIGHT), dtype=np.uint8)
+        self.valid = np.zeros((NUM_COL_BLOCKS, NUM_ROW_BLOCKS), dtype=bool)
+
+    def invalidate(self):
+        """Forget about the content of the framebuffer."""
+        self.valid[:] = False
+
+    def invalidate_region(self, col_start, col_end, row_start, row_end):
+        """Forget the content of a rectangle, in block units (end exclusive)."""
+        self.valid[col_start:col_end, row_start:row_end] = False
+
+    def fill_region(self, plan, intensity):
+        """Record that the region described by a TransferPlan was set to a constant intensity."""
+        x = plan.col_start * BLOCK_WIDTH
+        y = plan.row_start * BLOCK_HEIGHT
+        region = self.pixels[x:x + plan.width, y:y + plan.height]
+        region[:] = 0
+        region[plan.pad_width_start:plan.pad_width_start + plan.img_width,
+               plan.pad_height_start:plan.pad_height_start + plan.img_height] = intensity
+        self.valid[plan.col_start:plan.col_end + 1, plan.row_start:plan.row_start + plan.height // BLOCK_HEIGHT] = True
+
+    def dirty_rects(self, plan, target):
+        """
+        Rectangles (in block units, absolute in the frame) that need to be sent for the region
+        described by a TransferPlan to hold the (padded, block aligned) `target` pixel data.
+        """
+        x = plan.col_start * BLOCK_WIDTH
+        y = plan.row_start * BLOCK_HEIGHT
+        current = self.pixels[x:x + plan.width, y:y + plan.height]
+
+        changed = block_mask(current != target)
+        changed |= ~self.valid[plan.col_start:plan.col_end + 1, plan.row_start:plan.row_start + plan.height // BLOCK_HEIGHT]
+
+        return [(col_start + plan.col_start, col_end + plan.col_start,
+                 row_start + plan.row_start, row_end + plan.row_start)
+                for (col_start, col_end, row_start, row_end) in mask_to_rects(changed)]
+
+    def update(self, plan, target):
+        """Record that the region described by a TransferPlan now holds `target`."""
+        x = plan.col_start * BLOCK_WIDTH
+        y = plan.row_start * BLOCK_HEIGHT
+        self.pixels[x:x + plan.width, y:y + plan.height] = target
+        self.valid[plan.col_start:plan.col_end + 1, plan.row_start:plan.row_start + plan.height // BLOCK_HEIGHT] = True
+
+
+def pad_to_blocks(plan, pixel_data):
+    """Return pixel_data 0-padded to the block aligned region described by its TransferPlan."""
+    target = np.zeros((plan.width, plan.height), dtype=np.uint8)
+    target[plan.pad_width_start:plan.pad_width_start + plan.img_width,
+           plan.pad_height_start:plan.pad_height_start + plan.img_height] = pixel_data
+    return target
@@ -0,0 +1,148 @@
+"""
+Batched submission of SPI transfers with multi-transfer SPI_IOC_MESSAGE ioctls.
+
+spidev's writebytes2() costs one system call per transfer. The SPI_IOC_MESSAGE(N) ioctl submits
+N transfers at once, each with its own chip select period, which is what the FPGA framing needs:
+every transfer (preamble + pixel rows) must be a separate chip select assertion. The kernel
+limits the total size of all transfers in one message to the spidev buffer size (the bufsiz
+module parameter), so to batch full-size transfers, bufsiz must be a multiple of the transfer
+size, e.g. with `spidev.bufsiz=4194304` in cmdline.txt and 65536 byte transfers a full frame is
+sent in a single system call.
+"""
+import ctypes
+import numpy as np
+
+SPIDEV_BUFSIZ_PATH = "/sys/module/spidev/parameters/bufsiz"
+
+SPI_IOC_MAGIC = ord("k")
+_IOC_WRITE = 1
+_IOC_SIZEBITS = 14
+
+
+class SPITransfer(ctypes.Structure):
+    """struct spi_ioc_transfer of linux/spi/spidev.h"""
+
+    _fields_ = [
+        ("tx_buf", ctypes.c_uint64),
+        ("rx_buf", ctypes.c_uint64),
+        ("len", ctypes.c_uint32),
+        ("speed_hz", ctypes.c_uint32),
+        ("delay_usecs", ctypes.c_uint16),
+        ("bits_per_word", ctypes.c_uint8),
+        ("cs_change", ctypes.c_uint8),
+        ("tx_nbits", ctypes.c_uint8),
+        ("rx_nbits", ctypes.c_uint8),
+        ("word_delay_usecs", ctypes.c_uint8),
+        ("pad", ctypes.c_uint8),
+    ]
+
+
+# the size of the transfer array is encoded in the 14 bit size field of the ioctl number
+MAX_TRANSFERS_PER_MESSAGE = ((1 << _IOC_SIZEBITS) - 1) // ctypes.sizeof(SPITransfer)
+
+
+def SPI_IOC_MESSAGE(num_transfers):
+    """The ioctl request number for a message of num_transfers transfers (_IOW('k', 0, ...))."""
+    size = num_transfers * ctypes.sizeof(SPITransfer)
+    assert size < (1 << _IOC_SIZEBITS), "Too many transfers for a single SPI_IOC_MESSAGE"
+    return (_IOC_WRITE << 30) | (size << 16) | (SPI_IOC_MAGIC << 8) | 0
+
+
+def read_spidev_bufsiz(path=SPIDEV_BUFSIZ_PATH):
+    """The spidev buffer size (max bytes per message) of the running kernel, or None if unknown."""
+    try:
+        with open(path) as bufsiz_file:
+            return int(bufsiz_file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def decode_message(request, transfers):
+    """
+    Decode the transfers of an SPI_IOC_MESSAGE ioctl into a list of (data, cs_change) tuples.
+    Useful to build fake SPI devices that receive batched messages.
+    """
+    num_transfers = ((request >> 16) & ((1 << _IOC_SIZEBITS) - 1)) // ctypes.sizeof(SPITransfer)
+    assert request == SPI_IOC_MESSAGE(num_transfers), f"Not an SPI_IOC_MESSAGE request: {hex(request)}"
+    transfers = (SPITransfer * num_transfers).from_buffer_copy(transfers)
+    return [(ctypes.string_at(transfer.tx_buf, transfer.len), bool(transfer.cs_change)) for transfer in transfers]
+
+
+class SPIMessageWriter:
+    """
+    Collects SPI transfers and submits them in as few SPI_IOC_MESSAGE ioctls as possible.
+
+    Transfers are submitted once the next one would not fit in the message (bufsiz bytes or
+    max_transfers transfers), and by flush(). Packets are only referenced, not copied, so they
+    must stay valid until they are submitted: with a SPIPacketEncoder this means a packet pool of
+    at least transfers_per_message() + 1 buffers.
+
+    The ioctl function can be replaced (e.g. by a fake sink for testing), it is called as
+    ioctl(fd, request, transfers) like fcntl.ioctl.
+    """
+
+    def __init__(self, fd, bufsiz, max_transfers=MAX_TRANSFERS_PER_MESSAGE, speed_hz=0, ioctl=None):
+        if ioctl is None:
+            import fcntl
+            ioctl = fcntl.ioctl
+
+        self.fd = fd
+        self.bufsiz = bufsiz
+        self.max_transfers = min(max_transfers, MAX_TRANSFERS_PER_MESSAGE)
+        self.speed_hz = speed_hz  # 0 uses the speed configured on the device
+        self.ioctl = ioctl
+
+        self.messages = 0  # number of ioctls submitted
+        self.transfers = 0
+
+        self._pending = []
+        self._pending_bytes = 0
+
+    def transfers_per_message(self, transfer_size):
+        """Number of transfers of (at most) transfer_size bytes that fit in a single message."""
+        return max(1, min(self.bufsiz // transfer_size, self.max_transfers))
+
+    def add(self, packet):
+        """
+        Queue a single transfer, submitting the queued transfers first if it would not fit in the
+        same message. Returns True if a message was submitted.
+        """
+        length = len(packet)
+        assert length <= self.bufsiz, f"SPI transfer of {length} bytes exceeds spidev bufsiz of {self.bufsiz}"
+
+        submitted = False
+        if self._pending and (self._pending_bytes + length > self.bufsiz or len(self._pending) >= self.max_transfers):
+            self.flush()
+            submitted = True
+
+        self._pending.append(packet)
+        self._pending_bytes += length
+        return submitted
+
+    def flush(self):
+        """Submit all queued transfers as a single message."""
+        if not self._pending:
+            return
+
+        transfers = (SPITransfer * len(self._pending))()
+        for (transfer, packet) in zip(transfers, self._pending):
+            transfer.tx_buf = np.frombuffer(packet, dtype=np.uint8).ctypes.data
+            transfer.len = len(packet)
+            transfer.speed_hz = self.speed_hz
+            # release chip select between the transfers, as the FPGA expects every transfer to start
+            # with its own preamble. After the last transfer it is released anyway.
+            transfer.cs_change = 1
+        transfers[len(self._pending) - 1].cs_change = 0
+
+        self.ioctl(self.fd, SPI_IOC_MESSAGE(len(self._pending)), transfers)
+
+        self.messages += 1
+        self.transfers += len(self._pending)
+        self._pending = []  # the packets may be reused from here on
+        self._pending_bytes = 0
+
+    def write_packets(self, packets):
+        """Send a sequence of transfers (e.g. all packets of a frame) and flush."""
+        for packet in packets:
+            self.add(packet)
+        self.flush()
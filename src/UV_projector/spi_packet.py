@@ -0,0 +1,250 @@
+import math
+import struct
+import numpy as np
+
+from UV_projector.crc import RunningCRC
+
+# Every SPI transfer to the FPGA starts with a command byte (0x04), a 4 byte row/col data block
+# and a dummy byte. The first transfer of an image also carries the total length (4 bytes).
+# The final transfer ends with 4 CRC bytes.
+PREAMBLE_SIZE = 10
+CONTINUATION_PREAMBLE_SIZE = 6
+CRC_SIZE = 4
+
+
+def rowcol_data_block(col_start, col_end, row_start):
+    """
+    Format the 4 byte data block containing column start/end and row start information for
+    SPI transmission format of DLPC1438. Returned as an integer, to be sent little endian.
+    """
+    # the final 4 bits need to be 1 for reasons not explained, but let's just follow
+    # the programmer's guide of DLPC1438
+    return col_start + (col_end << 5) + (row_start << 10) + (0b1111 << 28)
+
+
+class TransferPlan:
+    """
+    Geometry of an image transfer to the FPGA buffer: the padding needed to align the image to the
+    128x2 pixel SPI blocks, and the way the padded image is split over multiple SPI transfers so
+    that every transfer fits in the spidev buffer.
+    """
+
+    def __init__(self, offset_width, offset_height, img_width, img_height, buffersize):
+        assert img_width <= 2560, "Max image width is 2560 pixels"
+        assert img_height <= 1440, "Max image height is 1440 pixels"
+
+        self.img_width = img_width
+        self.img_height = img_height
+
+        # The SPI data format requires "start/end col" and "start_row"
+        self.col_start = offset_width // 128  # per 128
+        self.row_start = offset_height // 2  # per 2
+
+        # if the offset is not a perfect multiple of 128 or 2, we will 0 pad the "start/front" pixel data
+        self.pad_width_start = offset_width % 128
+        self.pad_height_start = offset_height % 2
+
+        # we also need to pad the "end/back" of the data because we can only specify end_col in steps
+        # of 128.
+        self.pad_width_end = (128 - (img_width + self.pad_width_start) % 128) % 128
+        self.pad_height_end = (img_height + self.pad_height_start) % 2
+
+        self.width = self.pad_width_start + img_width + self.pad_width_end
+        self.height = self.pad_height_start + img_height + self.pad_height_end
+
+        assert self.width % 128 == 0, "Padded data does not fit neatly in SPI transmission"
+        assert self.height % 2 == 0, "Padded data does not fit neatly in SPI transmission"
+        # we also need to check if the padded image is still within bounds as someone could input
+        # a 2560x1440 image and shift it by e.g. 500,500 pixels, which obviously would not work
+        assert self.col_start * 128 + self.width <= 2560, "Image width after shifting exceeds the max width of 2560 pixels"
+        assert self.row_start * 2 + self.height <= 1440, "Image height after shifting exceeds the max height of 1440 pixels"
+
+        self.col_end = self.col_start + self.width // 128 - 1  # note: the width is start_col up to *and including* end_col
+        self.size = self.width * self.height
+
+        # now we need to figure out how many rows of data we can transfer in a single SPI transfer
+        # based on the image width and our SPI buffer size. We need 10 bytes (or less) for other parts
+        # of SPI command besides pixel data.
+        self.num_rows = math.floor(((buffersize - PREAMBLE_SIZE) / self.width) / 2) * 2  # should be even number
+        assert self.num_rows > 0, "SPI buffer is too small to hold a single row pair of the image"
+        assert self.num_rows * self.width < (buffersize - PREAMBLE_SIZE)
+
+        self.num_transfers = math.ceil(self.height / self.num_rows)
+
+    def chunks(self):
+        """
+        Yield (transfer_idx, first_row, num_rows) for each SPI transfer, with rows counted in the
+        padded image. Note that the last chunk is probably smaller than the other ones.
+        """
+        for transfer_idx in range(self.num_transfers):
+            first_row = transfer_idx * self.num_rows
+            yield transfer_idx, first_row, min(self.num_rows, self.height - first_row)
+
+    def packet_size(self, transfer_idx, num_rows):
+        """Number of bytes of the SPI transfer with the given index and number of pixel rows."""
+        size = PREAMBLE_SIZE if transfer_idx == 0 else CONTINUATION_PREAMBLE_SIZE
+        size += num_rows * self.width
+        if transfer_idx == self.num_transfers - 1:
+            size += CRC_SIZE
+        return size
+
+    def total_size(self):
+        """Total number of bytes sent over SPI for this image."""
+        return sum(self.packet_size(idx, rows) for (idx, _, rows) in self.chunks())
+
+    def __repr__(self):
+        return (f"TransferPlan(cols {self.col_start}-{self.col_end}, row_start {self.row_start}, "
+                f"padded {self.width}x{self.height}, {self.num_transfers} transfers of {self.num_rows} rows)")
+
+
+def write_packet(buffer, plan, transfer_idx, first_row, num_rows, pixel_data, crc=None, transform=None):
+    """
+    Write a single SPI transfer (preamble, padded pixel rows and CRC bytes) into the start of
+    `buffer`, straight from the (width, height) shaped `pixel_data`. Returns the packet length.
+
+    The pixel rows are written in the order the FPGA expects (row by row, i.e. the column-major
+    order of the transposed pixel data), so no intermediate padded or flattened copies are made.
+
+    If a RunningCRC is given (the same one for all transfers of the image), it is updated with the
+    pixel bytes of this transfer and sent in the CRC bytes. Otherwise the CRC bytes are 0.
+
+    A `transform` (e.g. an IntensityCorrection) is applied in place to the image pixels of the
+    transfer, as transform(rows, x, y) with the frame position of the top left pixel of rows.
+    The padding is not transformed.
+    """
+    row_start = plan.row_start + first_row // 2  # row_start is in steps of 2 (see SPI format)
+    rowcol = rowcol_data_block(plan.col_start, plan.col_end, row_start)
+
+    if transfer_idx == 0:
+        header = PREAMBLE_SIZE
+        struct.pack_into("<BIBI", buffer, 0, 0x04, rowcol, 0x00, plan.size)
+    else:
+        # note that following transfers do not contain the "length" of the transfer in preamble
+        header = CONTINUATION_PREAMBLE_SIZE
+        struct.pack_into("<BIB", buffer, 0, 0x04, rowcol, 0x00)
+
+    end = header + num_rows * plan.width
+    body = buffer[header:end].reshape(num_rows, plan.width)
+
+    # map the padded rows of this chunk back onto rows of the source image
+    src_start = max(first_row - plan.pad_height_start, 0)
+    src_end = min(first_row + num_rows - plan.pad_height_start, plan.img_height)
+    dst_start = src_start + plan.pad_height_start - first_row
+    dst_end = src_end + plan.pad_height_start - first_row
+    col_start = plan.pad_width_start
+    col_end = col_start + plan.img_width
+
+    # 0-pad only the regions that are not covered by the image
+    body[:dst_start] = 0
+    body[dst_end:] = 0
+    if col_start > 0:
+        body[dst_start:dst_end, :col_start] = 0
+    if col_end < plan.width:
+        body[dst_start:dst_end, col_end:] = 0
+    if src_end > src_start:
+        body[dst_start:dst_end, col_start:col_end] = pixel_data[:, src_start:src_end].T
+        if transform is not None:
+            transform(body[dst_start:dst_end, col_start:col_end], plan.col_start * 128 + col_start,
+                      plan.row_start * 2 + first_row + dst_start)
+
+    if crc is not None:
+        crc.update(buffer[header:end])
+
+    # Add 4 CRC bytes if this is the final transmission
+    if transfer_idx == plan.num_transfers - 1:
+        # Note that CRC bytes are still needed even if you do not use CRC calculation.
+        # Note also that the TI programmer's guide is wrong on this matter (it says it should be 2 bytes)
+        if crc is not None:
+            buffer[end:end + CRC_SIZE] = np.frombuffer(crc.to_bytes(), dtype=np.uint8)
+        else:
+            buffer[end:end + CRC_SIZE] = 0
+        end += CRC_SIZE
+
+    return end
+
+
+class EncodedFrame:
+    """
+    The complete SPI packet stream of one image, stored in a single contiguous buffer.
+
+    Useful when an image has to be encoded ahead of time (e.g. on another thread) or sent more
+    than once. The packets are handed out as memoryview slices of the buffer.
+    """
+
+    def __init__(self, plan, buffer, segments):
+        self.plan = plan
+        self.buffer = buffer
+        self.segments = segments  # list of (start, end) byte positions of each SPI transfer
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes
+
+    def packets(self):
+        view = memoryview(self.buffer)
+        for (start, end) in self.segments:
+            yield view[start:end]
+
+
+class SPIPacketEncoder:
+    """
+    Encodes image data into SPI transfers for the FPGA, using a pool of preallocated packet
+    buffers so that sending an image does not allocate any frame sized memory.
+
+    With `crc` enabled, the CRC16 of every image is computed while it is encoded (see crc.py).
+    A `transform` is applied to the pixels of every transfer as it is encoded (see write_packet).
+    """
+
+    def __init__(self, buffersize=65536, pool_size=2, crc=False, transform=None):
+        self.buffersize = buffersize
+        self.crc = crc
+        self.transform = transform
+        self.pool = [np.zeros(buffersize, dtype=np.uint8) for _ in range(pool_size)]
+        self._views = [memoryview(buffer) for buffer in self.pool]
+        self._pool_index = 0
+
+    def plan(self, offset_width, offset_height, pixel_data):
+        """Compute the TransferPlan for sending pixel_data at the given pixel offset."""
+        return TransferPlan(offset_width, offset_height, pixel_data.shape[0], pixel_data.shape[1], self.buffersize)
+
+    def packets(self, offset_width, offset_height, pixel_data, plan=None, transform=None):
+        """
+        Yield the SPI transfers for pixel_data as memoryview slices of the packet buffer pool.
+
+        A yielded packet stays valid until `pool_size` further packets have been generated, so it
+        should be sent before asking for the next ones. If given, `transform` is used instead of the
+        transform of the encoder.
+        """
+        if plan is None:
+            plan = self.plan(offset_width, offset_height, pixel_data)
+        if transform is None:
+            transform = self.transform
+        crc = RunningCRC() if self.crc else None
+
+        for (transfer_idx, first_row, num_rows) in plan.chunks():
+            buffer = self.pool[self._pool_index]
+            view = self._views[self._pool_index]
+            self._pool_index = (self._pool_index + 1) % len(self.pool)
+
+            length = write_packet(buffer, plan, transfer_idx, first_row, num_rows, pixel_data, crc, transform)
+            yield view[:length]
+
+    def encode_frame(self, offset_width, offset_height, pixel_data):
+        """Encode pixel_data into an EncodedFrame that owns its own (exactly sized) buffer."""
+        return encode_frame(offset_width, offset_height, pixel_data, self.buffersize, self.crc, self.transform)
+
+
+def encode_frame(offset_width, offset_height, pixel_data, buffersize=65536, crc=False, transform=None):
+    """Encode pixel_data into an EncodedFrame that owns its own (exactly sized) buffer."""
+    plan = TransferPlan(offset_width, offset_height, pixel_data.shape[0], pixel_data.shape[1], buffersize)
+    buffer = np.empty(plan.total_size(), dtype=np.uint8)
+    crc = RunningCRC() if crc else None
+
+    segments = []
+    position = 0
+    for (transfer_idx, first_row, num_rows) in plan.chunks():
+        length = write_packet(buffer[position:], plan, transfer_idx, first_row, num_rows, pixel_data, crc, transform)
+        segments.append((position, position + length))
+        position += length
+
+    return EncodedFrame(plan, buffer, segments)
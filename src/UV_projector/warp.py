@@ -0,0 +1,210 @@
+"""
+Geometric calibration (scale, rotation, keystone) of the projected patterns with precomputed
+warp maps.
+
+A homography maps the nominal frame coordinates of a pattern (as it would be sent without any
+calibration) to the projector pixels it should end up on. For every projector pixel, the source
+position is computed once and stored as integer index maps (plus 8 bit bilinear weights if
+enabled), so warping a layer is a single vectorised gather without any floating point math:
+
+    warp = WarpMap.cached(homography_from_points(nominal_corners, measured_corners), "calibration/")
+    DMD.set_background(0)
+    warped = warp.apply(pixel_data, xoffset, yoffset)
+    if warped is not None:
+        DMD.send_pixeldata_to_buffer(*warped)
+
+The maps are stored in tiles of TILE_WIDTH x TILE_HEIGHT projector pixels, together with the
+bounding box of the source positions of each tile. Only the tiles that sample the nonzero part
+of the pattern are computed, so warping a small pattern costs proportionally less; the rest of
+the frame is assumed to be background (0).
+"""
+import hashlib
+import os
+import numpy as np
+
+from UV_projector.shadow import FRAME_WIDTH, FRAME_HEIGHT, BLOCK_WIDTH
+
+TILE_WIDTH = BLOCK_WIDTH  # tiles are aligned to the 128x2 SPI blocks
+TILE_HEIGHT = 16
+WEIGHT_BITS = 8  # precision of the bilinear weights
+
+
+def homography_from_points(source_points, target_points):
+    """
+    Homography (3x3 matrix) mapping 4 (or more) source points (x, y) onto the target points, e.g.
+    the corners of a test pattern and the positions where they were measured on the projector.
+    """
+    source_points = np.asarray(source_points, dtype=np.float64)
+    target_points = np.asarray(target_points, dtype=np.float64)
+    assert source_points.shape == target_points.shape and len(source_points) >= 4, "need at least 4 point pairs"
+
+    rows = []
+    for ((x, y), (u, v)) in zip(source_points, target_points):
+        rows.append([x, y, 1, 0, 0, 0, -u * x, -u * y, -u])
+        rows.append([0, 0, 0, x, y, 1, -v * x, -v * y, -v])
+    # the homography is the (right) null space of the system
+    _, _, vh = np.linalg.svd(np.array(rows))
+    homography = vh[-1].reshape(3, 3)
+    return homography / homography[2, 2]
+
+
+def affine(scale=1.0, rotation=0.0, xoffset=0.0, yoffset=0.0, center=(FRAME_WIDTH / 2, FRAME_HEIGHT / 2)):
+    """Homography that scales and rotates (in degrees) around center, then translates."""
+    (cx, cy) = center
+    angle = np.radians(rotation)
+    (c, s) = (scale * np.cos(angle), scale * np.sin(angle))
+    return np.array([[c, -s, cx - c * cx + s * cy + xoffset],
+                     [s, c, cy - s * cx - c * cy + yoffset],
+                     [0, 0, 1]])
+
+
+class WarpMap:
+    """
+    Precomputed inverse mapping from every projector pixel to its (nominal) source position for a
+    homography, in tiles. With `bilinear`, sources are interpolated between the 4 nearest pixels,
+    otherwise the nearest pixel is used.
+    """
+
+    def __init__(self, homography, bilinear=False, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+        assert width % TILE_WIDTH == 0 and height % TILE_HEIGHT == 0, "the frame must be a whole number of tiles"
+        self.homography = np.asarray(homography, dtype=np.float64)
+        self.bilinear = bilinear
+        self.width = width
+        self.height = height
+        self.tiles_x = width // TILE_WIDTH
+        self.tiles_y = height // TILE_HEIGHT
+        self._compute()
+
+    def _compute(self):
+        # source position of the center of every projector pixel, in (width, height) layout
+        inverse = np.linalg.inv(self.homography)
+        (u, v) = np.meshgrid(np.arange(self.width) + 0.5, np.arange(self.height) + 0.5, indexing="ij")
+        w = inverse[2, 0] * u + inverse[2, 1] * v + inverse[2, 2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = (inverse[0, 0] * u + inverse[0, 1] * v + inverse[0, 2]) / w
+            y = (inverse[1, 0] * u + inverse[1, 1] * v + inverse[1, 2]) / w
+        # pixels beyond the horizon of the homography have no source
+        x[w <= 0] = -np.inf
+        y[w <= 0] = -np.inf
+
+        if self.bilinear:
+            # interpolate between the pixel centers around the sample position
+            (x, y) = (x - 0.5, y - 0.5)
+        (x0, y0) = (np.floor(x), np.floor(y))
+
+        # anything out of the frame reads the background, so the positions fit in int16
+        # (a pattern never lies outside the frame, and -2 + 1 is still outside of it)
+        self.src_x = self._tiled(np.clip(np.nan_to_num(x0, nan=-2), -2, self.width + 1).astype(np.int16))
+        self.src_y = self._tiled(np.clip(np.nan_to_num(y0, nan=-2), -2, self.height + 1).astype(np.int16))
+        if self.bilinear:
+            scale = 1 << WEIGHT_BITS
+            self.weight_x = self._tiled(np.nan_to_num(np.round((x - x0) * scale)).clip(0, scale).astype(np.uint16))
+            self.weight_y = self._tiled(np.nan_to_num(np.round((y - y0) * scale)).clip(0, scale).astype(np.uint16))
+        else:
+            self.weight_x = self.weight_y = None
+        self._tile_bounds()
+
+    def _tiled(self, array):
+        """Reorder a (width, height) array into (tiles_x, tiles_y, TILE_WIDTH, TILE_HEIGHT) tiles."""
+        tiles = array.reshape(self.tiles_x, TILE_WIDTH, self.tiles_y, TILE_HEIGHT).transpose(0, 2, 1, 3)
+        return np.ascontiguousarray(tiles)
+
+    def _tile_bounds(self):
+        # inclusive bounding box of the source positions read by each tile
+        reach = 1 if self.bilinear else 0
+        self.tile_bounds = np.stack([self.src_x.min(axis=(2, 3)), self.src_x.max(axis=(2, 3)) + reach,
+                                     self.src_y.min(axis=(2, 3)), self.src_y.max(axis=(2, 3)) + reach], axis=-1)
+
+    def tiles_for(self, col_start, col_end, row_start, row_end):
+        """Boolean (tiles_x, tiles_y) mask of the tiles reading from source pixels [col_start, col_end) x [row_start, row_end)."""
+        bounds = self.tile_bounds
+        return ((bounds[..., 0] < col_end) & (bounds[..., 1] >= col_start) &
+                (bounds[..., 2] < row_end) & (bounds[..., 3] >= row_start))
+
+    def apply(self, pixel_data, xoffset=0, yoffset=0):
+        """
+        Warp a (width, height) pattern placed at (xoffset, yoffset) of the nominal frame. Returns
+        (pixel_data, xoffset, yoffset) of the tile aligned projector region holding the warped
+        pattern, or None if nothing of it lands on the projector.
+        """
+        pixel_data = np.asarray(pixel_data, dtype=np.uint8)
+        (width, height) = pixel_data.shape
+
+        # only tiles that read the nonzero part of the pattern are computed
+        cols = np.flatnonzero(pixel_data.any(axis=1))
+        rows = np.flatnonzero(pixel_data.any(axis=0))
+        if len(cols) == 0:
+            return None
+        selected = self.tiles_for(xoffset + cols[0], xoffset + cols[-1] + 1, yoffset + rows[0], yoffset + rows[-1] + 1)
+        (tile_x, tile_y) = np.nonzero(selected)
+        if len(tile_x) == 0:
+            return None
+
+        # a 1 pixel border of background around the pattern, where all positions outside it end up
+        padded = np.zeros((width + 2, height + 2), dtype=np.uint8)
+        padded[1:-1, 1:-1] = pixel_data
+        x = self.src_x[tile_x, tile_y] - (xoffset - 1)
+        y = self.src_y[tile_x, tile_y] - (yoffset - 1)
+
+        if self.bilinear:
+            (x1, y1) = (np.clip(x + 1, 0, width + 1), np.clip(y + 1, 0, height + 1))
+            (x, y) = (np.clip(x, 0, width + 1), np.clip(y, 0, height + 1))
+            (wx, wy) = (self.weight_x[tile_x, tile_y], self.weight_y[tile_x, tile_y])
+            scale = 1 << WEIGHT_BITS
+            top = padded[x, y] * (scale - wx).astype(np.uint32) + padded[x1, y] * wx
+            bottom = padded[x, y1] * (scale - wx).astype(np.uint32) + padded[x1, y1] * wx
+            values = top * (scale - wy) + bottom * wy
+            values += 1 << (2 * WEIGHT_BITS - 1)  # round to nearest
+            values >>= 2 * WEIGHT_BITS
+            values = values.astype(np.uint8)
+        else:
+            values = padded[np.clip(x, 0, width + 1), np.clip(y, 0, height + 1)]
+
+        # scatter the computed tiles into the bounding box of the selected tiles
+        (first_x, first_y) = (tile_x.min(), tile_y.min())
+        tiles = np.zeros((tile_x.max() - first_x + 1, tile_y.max() - first_y + 1, TILE_WIDTH, TILE_HEIGHT), dtype=np.uint8)
+        tiles[tile_x - first_x, tile_y - first_y] = values
+        (tiles_x, tiles_y) = tiles.shape[:2]
+        warped = tiles.transpose(0, 2, 1, 3).reshape(tiles_x * TILE_WIDTH, tiles_y * TILE_HEIGHT)
+        return (warped, int(first_x) * TILE_WIDTH, int(first_y) * TILE_HEIGHT)
+
+    # -- caching on disk --
+
+    @staticmethod
+    def cache_path(directory, homography, bilinear=False, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+        data = np.asarray(homography, dtype=np.float64).tobytes() + bytes([bilinear]) + np.array([width, height]).tobytes()
+        return os.path.join(directory, f"warp-{hashlib.blake2b(data, digest_size=8).hexdigest()}.npz")
+
+    def save(self, path):
+        arrays = {"homography": self.homography, "bilinear": np.array(self.bilinear),
+                  "size": np.array([self.width, self.height]), "src_x": self.src_x, "src_y": self.src_y}
+        if self.bilinear:
+            arrays["weight_x"] = self.weight_x
+            arrays["weight_y"] = self.weight_y
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            warp = cls.__new__(cls)
+            warp.homography = data["homography"]
+            warp.bilinear = bool(data["bilinear"])
+            (warp.width, warp.height) = (int(size) for size in data["size"])
+            (warp.tiles_x, warp.tiles_y) = (warp.width // TILE_WIDTH, warp.height // TILE_HEIGHT)
+            warp.src_x = data["src_x"]
+            warp.src_y = data["src_y"]
+            warp.weight_x = data["weight_x"] if warp.bilinear else None
+            warp.weight_y = data["weight_y"] if warp.bilinear else None
+        warp._tile_bounds()
+        return warp
+
+    @classmethod
+    def cached(cls, homography, directory, bilinear=False, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+        """Load the maps for a homography from the cache directory, or compute and store them there."""
+        path = cls.cache_path(directory, homography, bilinear, width, height)
+        if os.path.exists(path):
+            return cls.load(path)
+        warp = cls(homography, bilinear, width, height)
+        os.makedirs(directory, exist_ok=True)
+        warp.save(path)
+        return warp
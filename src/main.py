@@ -1,4 +1,5 @@
 import RPi.GPIO as GPIO
+import logging
 import time
 import numpy as np
 import smbus  # I2C
@@ -6,6 +7,7 @@ import spidev  # SPI
 from UV_projector.controller import DLPC1438, Mode
 
 
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
 GPIO.setmode(GPIO.BCM)
 
 try:
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# the package is not installed, it is imported from the src directory (like the examples)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from UV_projector.controller import DLPC1438  # noqa: E402
+from UV_projector.emulator import EmulatedProjector, TimingModel  # noqa: E402
+
+
+@pytest.fixture
+def make_dmd():
+    """Factory for a DLPC1438 driving a fast EmulatedProjector, returns (projector, dmd)."""
+    dmds = []
+
+    def make(timing=None, pins=None, **kwargs):
+        if timing is None:
+            timing = TimingModel(boot_time=0.01, mode_switch_time=0.01, time_scale=0.1)
+        projector = EmulatedProjector(timing=timing, pins=pins)
+        kwargs.setdefault("spi_bufsiz", 65536)
+        dmd = DLPC1438(projector.i2c, projector.spi, gpio=projector.gpio, pins=pins, **kwargs)
+        dmds.append(dmd)
+        return (projector, dmd)
+    yield make
+
+    for dmd in dmds:
+        dmd.close()
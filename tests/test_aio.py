@@ -0,0 +1,77 @@
+import asyncio
+import concurrent.futures
+
+import pytest
+
+from UV_projector.aio import AsyncDLPC1438
+from UV_projector.controller import Mode
+
+
+def test_switch_mode_does_not_occupy_the_worker(make_dmd):
+    (projector, dmd) = make_dmd()
+
+    async def main():
+        async with AsyncDLPC1438(dmd) as aio:
+            switch = asyncio.create_task(aio.switch_mode(Mode.EXTERNALPRINT))
+            await asyncio.sleep(0.01)
+            await aio.fill_region(0, 0, 0, 128, 2)  # runs while the DLPC1438 is switching
+            assert not switch.done()
+            await switch
+
+    asyncio.run(main())
+    assert projector.gpio.input(dmd.SYS_RDY) == projector.gpio.HIGH
+
+
+def test_expose(make_dmd):
+    (projector, dmd) = make_dmd()
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+
+    async def main():
+        async with AsyncDLPC1438(dmd) as aio:
+            await aio.expose(3, dark_frames=0)
+
+    asyncio.run(main())
+    assert [(dark, exposed) for (_, _, dark, exposed) in projector.exposures] == [(0, 3)]
+    assert projector.gpio.input(dmd.PRINT_ACTIVE) == projector.gpio.LOW
+
+
+def test_cancel_stops_the_exposure(make_dmd):
+    (projector, dmd) = make_dmd()
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+
+    async def main():
+        async with AsyncDLPC1438(dmd) as aio:
+            expose = asyncio.create_task(aio.expose(10000, dark_frames=0))
+            await aio.wait_for_pin(dmd.PRINT_ACTIVE, dmd.gpio.HIGH, timeout=1)
+            expose.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await expose
+
+    asyncio.run(main())
+    assert len(projector.exposures) == 1
+    assert projector.gpio.input(dmd.PRINT_ACTIVE) == projector.gpio.LOW
+
+
+def test_exposure_timeout(make_dmd):
+    (projector, dmd) = make_dmd()
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+
+    async def main():
+        async with AsyncDLPC1438(dmd) as aio:
+            with pytest.raises(TimeoutError):
+                await aio.expose(10000, dark_frames=0, timeout=0.05)
+            await aio.stop_exposure()
+
+    asyncio.run(main())
+    assert projector.gpio.input(dmd.PRINT_ACTIVE) == projector.gpio.LOW
+
+
+def test_close_leaves_a_given_executor_running(make_dmd):
+    (projector, dmd) = make_dmd()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        async def main():
+            async with AsyncDLPC1438(dmd, executor) as aio:
+                await aio.switch_mode(Mode.EXTERNALPRINT)
+
+        asyncio.run(main())
+        assert executor.submit(lambda: 1).result() == 1
@@ -0,0 +1,35 @@
+import numpy as np
+
+from UV_projector.bench import NullSPI, _CopyCounter, _profile, counting_writes, legacy_split_packets
+from UV_projector.spi_packet import SPIPacketEncoder, encode_frame
+
+
+def test_copies_and_allocations_are_counted():
+    pixel_data = np.random.default_rng(0).integers(0, 256, (300, 100), dtype=np.uint8)
+    encoder = SPIPacketEncoder(4096)
+    plan = encoder.plan(77, 33, pixel_data)
+    spi = NullSPI()
+
+    counter = _CopyCounter(encoder.pool)
+    with counting_writes(counter):
+        for packet in encoder.packets(77, 33, pixel_data):
+            spi.writebytes2(packet)
+    assert (counter.allocations, counter.bytes_copied) == (0, plan.total_size())
+
+    # an EncodedFrame is written into a buffer of its own
+    counter = _CopyCounter(encoder.pool)
+    with counting_writes(counter):
+        frame = encode_frame(77, 33, pixel_data, 4096)
+    assert (counter.allocations, counter.bytes_copied) == (1, frame.nbytes)
+
+    counter = _CopyCounter()
+    packets = list(legacy_split_packets(77, 33, pixel_data, 4096, counter))
+    assert counter.allocations > len(packets)
+    assert counter.bytes_copied > plan.total_size()
+
+
+def test_profile_counts_blocks_kept_after_a_run():
+    kept = []
+    result = _profile(lambda: kept.append([bytearray(16) for _ in range(100)]), repeats=1)
+    assert 200 <= result["allocated_blocks"] < 216  # object and buffer of every bytearray
+    assert _profile(lambda: [bytearray(16) for _ in range(100)], repeats=1)["allocated_blocks"] < 16
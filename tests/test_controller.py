@@ -0,0 +1,47 @@
+import warnings
+
+import pytest
+
+from UV_projector.controller import DLPC1438
+from UV_projector.emulator import EmulatedProjector, TimingModel
+
+FAST = dict(boot_time=0.01, mode_switch_time=0.01, time_scale=0.1)
+
+
+class SlowPowerDown(EmulatedProjector):
+    """A DLPC1438 that keeps answering on I2C for a while after PROJ_ON went low."""
+
+    def __init__(self, answer_time, **kwargs):
+        super().__init__(**kwargs)
+        self.answer_time = answer_time  # None: it never powers down (e.g. powered by the board)
+
+    def _on_output(self, pin, level):
+        if pin == self.PROJ_ON and not level and self.i2c_ready:
+            self.gpio.set_input(self.HOST_IRQ, self.gpio.LOW)
+            if self.answer_time is not None:
+                self._schedule(self.answer_time, lambda: EmulatedProjector._on_output(self, pin, level))
+            return
+        super()._on_output(pin, level)
+
+
+def test_cold_start_waits_for_power_down():
+    projector = SlowPowerDown(0.05, timing=TimingModel(**FAST), powered=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # no "already powered on"
+        dmd = DLPC1438(projector.i2c, projector.spi, gpio=projector.gpio, spi_bufsiz=65536)
+
+    assert projector.gpio.input(dmd.PROJ_ON) == projector.gpio.HIGH
+    assert projector.i2c_ready
+    assert "boot" in dmd.startup_timings
+    dmd.close()
+
+
+def test_cold_start_of_a_dlpc_that_stays_on():
+    projector = SlowPowerDown(None, timing=TimingModel(**FAST), powered=True)
+    with pytest.warns(UserWarning, match="already powered on"):
+        dmd = DLPC1438(projector.i2c, projector.spi, gpio=projector.gpio, spi_bufsiz=65536)
+
+    # PROJ_ON is not left low while the DLPC1438 is assumed to be running
+    assert projector.gpio.input(dmd.PROJ_ON) == projector.gpio.HIGH
+    assert "boot" not in dmd.startup_timings
+    dmd.close()
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from UV_projector.correction import IntensityCorrection
+
+
+def test_gain_above_one_saturates():
+    correction = IntensityCorrection(gain=np.full((2560, 1440), 1.5))
+    pixels = np.array([[0, 100, 170, 255]], dtype=np.uint8).T
+    assert correction.apply(pixels, 0, 0)[:, 0].tolist() == [0, 150, 255, 255]
+
+    correction = IntensityCorrection(gain=np.full((2560, 1440), 255.0))
+    assert correction.apply(pixels, 0, 0)[:, 0].tolist() == [0, 255, 255, 255]
+
+
+@pytest.mark.parametrize("dirty_tracking", [False, True])
+def test_padding_is_not_corrected(make_dmd, dirty_tracking):
+    # a LUT that maps 0 to a nonzero value, so corrected padding would show up
+    correction = IntensityCorrection(lut=np.maximum(np.arange(256), 50))
+    (projector, dmd) = make_dmd(dirty_tracking=dirty_tracking, correction=correction)
+    pixels = np.random.default_rng(0).integers(0, 256, (100, 3), dtype=np.uint8)
+
+    dmd.send_pixeldata_to_buffer(pixels, 5, 1)
+
+    expected = np.zeros((256, 6), dtype=np.uint8)
+    expected[5:105, 1:4] = correction.apply(pixels, 5, 1)
+    assert np.array_equal(projector.inactive_image()[:256, :6], expected)
+
+
+def test_send_regions_padding_is_not_corrected(make_dmd):
+    correction = IntensityCorrection(lut=np.maximum(np.arange(256), 50))
+    (projector, dmd) = make_dmd(dirty_tracking=True, correction=correction)
+    marks = [(np.full((10, 3), 200, dtype=np.uint8), 20, 1), (np.full((10, 3), 20, dtype=np.uint8), 300, 5)]
+
+    dmd.send_regions(marks)
+
+    expected = np.zeros((384, 8), dtype=np.uint8)
+    expected[20:30, 1:4] = 200
+    expected[300:310, 5:8] = 50
+    assert np.array_equal(projector.inactive_image()[:384, :8], expected)
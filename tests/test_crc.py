@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from UV_projector.controller import Mode
+from UV_projector.crc import CRC_INIT, RunningCRC, crc16, crc_bytes
+
+
+def test_crc_variant():
+    # CRC-16/CCITT-FALSE check value, sent little endian followed by 2 zero bytes
+    assert crc16(b"123456789") == 0x29B1
+    assert crc_bytes(0x29B1) == b"\xb1\x29\x00\x00"
+
+    crc = RunningCRC()
+    for part in (b"1234", b"56789"):
+        crc.update(part)
+    assert crc.value == crc16(b"123456789") and crc16(b"") == CRC_INIT
+
+
+def test_corrupt_packet_is_detected(make_dmd):
+    (projector, dmd) = make_dmd(crc=True, dirty_tracking=True)
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    dmd.configure_external_print(LED_PWM=100)
+    pixel_data = np.random.default_rng(0).integers(0, 256, (256, 300), dtype=np.uint8)
+
+    # a bit error on the wire in one of the transfers
+    write = projector.spi.writebytes2
+    sent = []
+
+    def flip_bit(data):
+        data = bytearray(data)
+        if len(sent) == 1:
+            data[20] ^= 0x10
+        sent.append(len(data))
+        write(data)
+    projector.spi.writebytes2 = flip_bit
+
+    with pytest.raises(Exception, match="CRC error"):
+        dmd.send_pixeldata_to_buffer(pixel_data, 0, 0)
+    assert len(sent) > 1
+    assert projector.spi.crc_errors == 1
+    assert dmd.metrics.as_dict()["crc_errors_total"] == 1
+
+    # the content of the buffer is unknown now, so sending the image again sends all of it
+    projector.spi.writebytes2 = write
+    dmd.send_pixeldata_to_buffer(pixel_data, 0, 0)
+    assert projector.spi.crc_errors == 1
+    assert np.array_equal(projector.inactive_image()[:256, :300], pixel_data)
@@ -0,0 +1,90 @@
+import os
+import socket
+import tempfile
+import time
+
+import numpy as np
+import pytest
+
+from UV_projector.daemon import DaemonClient, ProjectorDaemon, read_message, send_message
+
+
+@pytest.fixture
+def daemon(make_dmd):
+    (projector, dmd) = make_dmd(dirty_tracking=True)
+    # a short path, Unix socket paths are limited to about 100 characters
+    socket_path = os.path.join(tempfile.mkdtemp(), "daemon.sock")
+    daemon = ProjectorDaemon(dmd, socket_path)
+    daemon.start()
+    yield (projector, daemon)
+    daemon.stop()
+
+
+def test_ping_and_status(daemon):
+    (_, server) = daemon
+    with DaemonClient(server.socket_path) as client:
+        assert client.ping()
+        status = client.status()
+    assert status["event"] == "status"
+    assert status["running"] is None and status["queued"] == []
+    assert "metrics" in status
+
+
+def test_pixels_job(daemon):
+    (projector, server) = daemon
+    layers = np.stack([np.full((256, 16), value, dtype=np.uint8) for value in (100, 200)])
+
+    with DaemonClient(server.socket_path) as client:
+        events = list(client.submit({"exposure_frames": 2, "dark_frames": 0}, pixel_data=layers))
+
+    assert [event["event"] for event in events] == ["queued", "started", "layer", "layer", "done"]
+    assert [event["index"] for event in events if event["event"] == "layer"] == [0, 1]
+    assert events[-1]["layers"] == 2
+    assert len(projector.exposures) == 2
+    assert np.array_equal(projector.displayed_image()[:256, :16], layers[-1])
+
+
+def test_invalid_requests(daemon):
+    (_, server) = daemon
+    with DaemonClient(server.socket_path) as client:
+        assert not client.cancel(12345)
+        assert client._request({"command": "reboot"}) == {"event": "error", "message": "Unknown command 'reboot'"}
+        reply = client._request({"command": "submit", "job": {"source": "floppy"}})
+        assert reply["event"] == "error" and reply["message"].startswith("Invalid request")
+
+    # a line that is not JSON ends the connection with an error
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(server.socket_path)
+    with sock, sock.makefile("rb") as stream:
+        sock.sendall(b"not json\n")
+        (reply, _) = read_message(stream)
+        assert reply["event"] == "error"
+        assert read_message(stream) == (None, None)
+
+
+def test_messages_with_payload():
+    (left, right) = socket.socketpair()
+    with left, right, right.makefile("rb") as stream:
+        send_message(left, {"command": "ping"}, payload=b"\x01\x02\x03")
+        (message, payload) = read_message(stream)
+    assert message == {"command": "ping", "payload_bytes": 3}
+    assert payload == b"\x01\x02\x03"
+
+
+def test_events_are_dropped_without_wait(daemon):
+    (projector, server) = daemon
+    jobs = []
+    submit = server.submit
+    server.submit = lambda job: jobs.append(job) or submit(job)
+    layers = np.full((2, 256, 16), 255, dtype=np.uint8)
+
+    with DaemonClient(server.socket_path) as client:
+        events = list(client.submit({"exposure_frames": 2, "dark_frames": 0}, pixel_data=layers, wait=False))
+        assert [event["event"] for event in events] == ["queued"]
+        deadline = time.monotonic() + 10
+        while jobs[0].state in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    assert jobs[0].state == "done"
+    assert jobs[0].events is None  # nothing queued for a client that is not reading
+    assert len(projector.exposures) == 2
@@ -0,0 +1,101 @@
+import struct
+
+import numpy as np
+
+from UV_projector.controller import Mode
+from UV_projector.shadow import BLOCK_HEIGHT, BLOCK_WIDTH
+
+
+def record_transfers(projector):
+    """Keep the (col_start, col_end, row_start) block and the size of every SPI transfer."""
+    transfers = []
+    write = projector.spi.writebytes2
+
+    def record(data):
+        rowcol = struct.unpack_from("<I", bytes(data[1:5]))[0]
+        transfers.append((rowcol & 0x1F, (rowcol >> 5) & 0x1F, (rowcol >> 10) & 0x3FF, len(data)))
+        write(data)
+    projector.spi.writebytes2 = record
+    return transfers
+
+
+def assert_shadow_matches(projector, dmd):
+    shadow = dmd.shadows[int(dmd.SPI_BUFFER_INDEX)]
+    valid = np.repeat(np.repeat(shadow.valid, BLOCK_WIDTH, axis=0), BLOCK_HEIGHT, axis=1)
+    assert valid.any()
+    assert np.array_equal(shadow.pixels[valid], projector.inactive_image()[valid])
+
+
+def test_unchanged_blocks_are_not_resent(make_dmd):
+    (projector, dmd) = make_dmd(dirty_tracking=True)
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    image = np.random.default_rng(0).integers(0, 256, (640, 100), dtype=np.uint8)
+    dmd.send_pixeldata_to_buffer(image, 128, 20)
+    transfers = record_transfers(projector)
+
+    dmd.send_pixeldata_to_buffer(image, 128, 20)
+    assert transfers == []
+    assert dmd.last_update_stats["bytes_sent"] == 0
+
+    # a single changed pixel (at 328, 45) sends its 128x2 block only: column 2, block row 22
+    changed = image.copy()
+    changed[200, 25] ^= 0xFF
+    dmd.send_pixeldata_to_buffer(changed, 128, 20)
+    assert transfers == [(2, 2, 22, 10 + BLOCK_WIDTH * BLOCK_HEIGHT + 4)]
+    assert dmd.last_update_stats["rects"] == 1
+    assert np.array_equal(projector.inactive_image()[128:768, 20:120], changed)
+
+
+def test_shadows_of_both_buffers(make_dmd):
+    (projector, dmd) = make_dmd(dirty_tracking=True)
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    rng = np.random.default_rng(1)
+    images = [rng.integers(0, 256, (256, 64), dtype=np.uint8) for _ in range(2)]
+    transfers = record_transfers(projector)
+
+    dmd.send_pixeldata_to_buffer(images[0], 0, 0)
+    assert_shadow_matches(projector, dmd)
+    dmd.swap_buffer()
+    dmd.send_pixeldata_to_buffer(images[1], 0, 0)
+    assert_shadow_matches(projector, dmd)
+    dmd.swap_buffer()
+
+    # every buffer still holds its own image
+    del transfers[:]
+    dmd.send_pixeldata_to_buffer(images[0], 0, 0)
+    dmd.swap_buffer()
+    dmd.send_pixeldata_to_buffer(images[1], 0, 0)
+    assert transfers == []
+
+    # and a buffer that gets the image of the other one is fully sent
+    dmd.send_pixeldata_to_buffer(images[0], 0, 0)
+    assert sum(size for (_, _, _, size) in transfers) > images[0].size
+    assert_shadow_matches(projector, dmd)
+    dmd.swap_buffer()
+    assert_shadow_matches(projector, dmd)
+
+
+def test_dirty_uploads_match_full_uploads(make_dmd):
+    (projector, dmd) = make_dmd(dirty_tracking=True)
+    (reference_projector, reference) = make_dmd()
+    rng = np.random.default_rng(2)
+    base = rng.integers(0, 256, (700, 300), dtype=np.uint8)
+    for controller in (dmd, reference):
+        controller.switch_mode(Mode.EXTERNALPRINT)
+        controller.set_background(0, both_buffers=True)
+
+    for step in range(12):
+        # small edits of a base image, at odd offsets so the padding of the blocks is exercised
+        image = base.copy()
+        for _ in range(rng.integers(0, 5)):
+            (x, y) = (rng.integers(0, 690), rng.integers(0, 290))
+            image[x:x + 10, y:y + 10] = rng.integers(0, 256)
+        (xoffset, yoffset) = (int(rng.choice([0, 3, 130])), int(rng.choice([0, 1, 7])))
+        for controller in (dmd, reference):
+            controller.send_pixeldata_to_buffer(image, xoffset, yoffset)
+            if step % 3 == 0:
+                controller.swap_buffer()
+
+        for buffer in range(2):
+            assert np.array_equal(projector.framebuffers[buffer], reference_projector.framebuffers[buffer])
+    assert dmd.metrics.as_dict()["spi_bytes_saved_total"] > 0
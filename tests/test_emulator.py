@@ -0,0 +1,156 @@
+import struct
+import time
+
+import numpy as np
+import pytest
+
+from UV_projector.crc import crc16, crc_bytes
+from UV_projector.emulator import EmulatedProjector, TimingModel
+from UV_projector.spi_ioctl import SPI_IOC_MESSAGE, SPIMessageWriter, SPITransfer
+from UV_projector.spi_packet import encode_frame, rowcol_data_block
+
+CRC_ENABLED = 0b10  # FPGA control register bit
+
+
+def make_projector(**kwargs):
+    return EmulatedProjector(powered=True, **kwargs)
+
+
+def random_pixels(width, height, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (width, height), dtype=np.uint8)
+
+
+def test_single_transfer_framing():
+    projector = make_projector()
+    pixel_data = random_pixels(128, 2)
+    packet = bytes(next(encode_frame(256, 6, pixel_data).packets()))
+
+    assert packet[0] == 0x04
+    assert struct.unpack_from("<I", packet, 1)[0] == rowcol_data_block(2, 2, 3)
+    assert packet[5] == 0x00  # dummy byte
+    assert struct.unpack_from("<I", packet, 6)[0] == 256  # length
+    assert len(packet) == 10 + 256 + 4
+
+    projector.spi.writebytes2(packet)
+    assert projector.spi.images_received == 1
+    assert np.array_equal(projector.inactive_image()[256:384, 6:8], pixel_data)
+
+
+def test_image_over_several_transfers():
+    projector = make_projector()
+    pixel_data = random_pixels(300, 41)
+    frame = encode_frame(77, 33, pixel_data, buffersize=1024)
+    assert len(frame.segments) > 2
+
+    for packet in frame.packets():
+        projector.spi.writebytes2(packet)
+
+    assert projector.spi.images_received == 1
+    assert projector.spi.transfers == len(frame.segments)
+    assert np.array_equal(projector.inactive_image()[77:377, 33:74], pixel_data)
+    assert not projector.inactive_image()[:77].any() and not projector.inactive_image()[377:].any()
+
+
+def corrupt(offset, value):
+    def apply(packets):
+        packets[0][offset] = value
+    return apply
+
+
+def drop_crc_bytes(packets):
+    packets[-1] = packets[-1][:-4]
+
+
+def skip_transfer(packets):
+    del packets[1]
+
+
+@pytest.mark.parametrize("corruption, message", [
+    (corrupt(0, 0x05), "command 0x04"),
+    (corrupt(4, 0x0F), "final 4 bits"),  # top byte of the row/col block
+    (corrupt(5, 0x01), "dummy byte"),
+    (corrupt(6, 0x01), "whole number of row pairs"),  # length
+    (drop_crc_bytes, "CRC bytes"),
+    (skip_transfer, "continue at row"),
+])
+def test_malformed_transfers_are_rejected(corruption, message):
+    projector = make_projector()
+    packets = [bytearray(packet) for packet in encode_frame(0, 0, random_pixels(128, 40), buffersize=1024).packets()]
+    corruption(packets)
+
+    with pytest.raises(AssertionError, match=message):
+        for packet in packets:
+            projector.spi.writebytes2(packet)
+
+
+def test_crc_is_checked_when_enabled():
+    projector = make_projector()
+    projector.i2c.registers[0xCB] = [CRC_ENABLED]
+    pixel_data = random_pixels(256, 20)
+
+    frame = encode_frame(0, 0, pixel_data, buffersize=1024, crc=True)
+    packets = [bytearray(packet) for packet in frame.packets()]
+    assert packets[-1][-4:] == crc_bytes(crc16(np.ascontiguousarray(pixel_data.T)))
+    for packet in packets:
+        projector.spi.writebytes2(packet)
+    assert projector.spi.crc_errors == 0
+    assert projector.i2c.registers[0x6F][0] & 0x01 == 0
+
+    packets[1][20] ^= 0xFF  # a flipped pixel byte
+    for packet in packets:
+        projector.spi.writebytes2(packet)
+    assert projector.spi.crc_errors == 1
+    assert projector.i2c.read_i2c_block_data(0x1B, 0x6F, 2)[0] & 0x01
+    assert projector.i2c.read_i2c_block_data(0x1B, 0x6F, 2)[0] & 0x01 == 0  # cleared by the read
+
+    # without CRC checking, the CRC bytes are not looked at
+    projector.i2c.registers[0xCB] = [0x00]
+    for packet in packets:
+        projector.spi.writebytes2(packet)
+    assert projector.spi.crc_errors == 1
+
+
+def test_ioctl_batches():
+    projector = make_projector()
+    pixel_data = random_pixels(256, 40)
+    frame = encode_frame(0, 0, pixel_data, buffersize=1024)
+
+    writer = SPIMessageWriter(projector.spi.fileno(), projector.spi.bufsiz, ioctl=projector.spi.ioctl)
+    writer.write_packets(frame.packets())
+
+    assert (projector.spi.messages, projector.spi.transfers) == (1, len(frame.segments))
+    assert projector.spi.images_received == 1
+    assert np.array_equal(projector.inactive_image()[:256, :40], pixel_data)
+
+
+def test_ioctl_batch_must_release_chip_select():
+    projector = make_projector()
+    packets = [np.frombuffer(packet, dtype=np.uint8)
+               for packet in encode_frame(0, 0, random_pixels(128, 40), buffersize=1024).packets()]
+    transfers = (SPITransfer * len(packets))()
+    for (transfer, packet) in zip(transfers, packets):
+        transfer.tx_buf = packet.ctypes.data
+        transfer.len = packet.size  # cs_change left at 0
+
+    with pytest.raises(AssertionError, match="chip select"):
+        projector.spi.ioctl(projector.spi.fileno(), SPI_IOC_MESSAGE(len(packets)), transfers)
+
+
+def test_buffer_swaps_are_latched_at_the_next_frame():
+    projector = make_projector(timing=TimingModel(frame_rate=10))
+    pixel_data = random_pixels(128, 2)
+    assert projector.active_buffer == 0
+    for packet in encode_frame(0, 0, pixel_data).packets():
+        projector.spi.writebytes2(packet)
+    assert np.array_equal(projector.framebuffers[1][:128, :2], pixel_data)
+
+    # swap right after a frame started, so the frame clock does not tick during the checks
+    time.sleep(projector._next_frame_boundary() - time.perf_counter() + 0.005)
+    projector.i2c.write_i2c_block_data(0x1B, 0xC5, [0x01])
+    assert projector.active_buffer == 1
+    assert projector.i2c.read_i2c_block_data(0x1B, 0xC6, 1) == [1]
+    assert projector.inactive_image() is projector.framebuffers[0]  # SPI data goes to the other buffer right away
+    assert projector.displayed_image() is projector.framebuffers[0]  # the DMD still shows the old buffer
+
+    time.sleep(projector._next_frame_boundary() - time.perf_counter() + 0.005)
+    assert projector.displayed_image() is projector.framebuffers[1]
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from UV_projector.controller import Mode
+
+
+@pytest.mark.parametrize("region", [(0, 0, 2560, 1440), (130, 7, 300, 51), (2432, 1438, 128, 2)])
+def test_fill_matches_sending_the_pixels(make_dmd, region):
+    (projector, dmd) = make_dmd()
+    (reference_projector, reference) = make_dmd()
+    (x, y, width, height) = region
+    for (controller, emulator) in ((dmd, projector), (reference, reference_projector)):
+        controller.switch_mode(Mode.EXTERNALPRINT)
+        emulator.inactive_image()[:] = 77  # some earlier content, around the region as well
+
+    dmd.fill_region(200, x, y, width, height)
+    reference.send_pixeldata_to_buffer(np.full((width, height), 200, dtype=np.uint8), x, y)
+
+    assert np.array_equal(projector.inactive_image(), reference_projector.inactive_image())
+    assert (projector.inactive_image()[x:x + width, y:y + height] == 200).all()
+
+
+def test_fill_cache(make_dmd):
+    (projector, dmd) = make_dmd()
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    encode_frame = dmd.encoder.encode_frame
+    encoded = []
+    dmd.encoder.encode_frame = lambda *args: encoded.append(args) or encode_frame(*args)
+
+    dmd.fill_region(255, 256, 10, 512, 100)
+    dmd.swap_buffer()
+    dmd.fill_region(255, 256, 10, 512, 100)  # from the cache
+    assert len(encoded) == 1
+    for buffer in projector.framebuffers:
+        assert (buffer[256:768, 10:110] == 255).all()
+
+    dmd.fill_region(0, 256, 10, 512, 100)  # a different value is a different entry
+    assert len(encoded) == 2
+    dmd.fill_region(255, 256, 10, 512, 100, cache=False)
+    assert len(encoded) == 2 and len(dmd._fill_cache) == 2
+    assert projector.spi.images_received == 4
@@ -0,0 +1,72 @@
+import numpy as np
+from PIL import Image
+
+from UV_projector.controller import Mode
+from UV_projector.frame_cache import EncodedFrameCache
+
+
+class FakeFrame:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+
+def test_files_are_forgotten_with_their_frames(tmp_path):
+    cache = EncodedFrameCache(max_bytes=300)
+    files = []
+    for index in range(10):
+        filename = tmp_path / f"layer{index}.png"
+        filename.write_bytes(bytes([index]))
+        digest = (bytes([index]), (1, 1))
+        cache.put(cache.key(digest, 0, 0, 65536), FakeFrame(100))
+        cache.remember_file(filename, digest)
+        files.append((filename, digest))
+
+    # only the files of the 3 frames that fit are remembered
+    assert cache.stats()["files"] == 3
+    assert [cache.file_digest(filename) for (filename, _) in files[:7]] == [None] * 7
+    assert [cache.file_digest(filename) for (filename, _) in files[7:]] == [digest for (_, digest) in files[7:]]
+
+
+def test_file_of_an_uncached_frame_is_not_remembered(tmp_path):
+    cache = EncodedFrameCache(max_bytes=100)
+    filename = tmp_path / "huge.png"
+    filename.write_bytes(b"x")
+    digest = (b"x", (1, 1))
+    cache.put(cache.key(digest, 0, 0, 65536), FakeFrame(1000))  # does not fit
+    cache.remember_file(filename, digest)
+    assert cache.file_digest(filename) is None
+
+
+def test_a_file_stays_while_its_content_is_cached_at_another_offset(tmp_path):
+    cache = EncodedFrameCache(max_bytes=200)
+    filename = tmp_path / "layer.png"
+    filename.write_bytes(b"x")
+    digest = (b"x", (1, 1))
+    cache.put(cache.key(digest, 0, 0, 65536), FakeFrame(100))
+    cache.put(cache.key(digest, 128, 0, 65536), FakeFrame(100))
+    cache.remember_file(filename, digest)
+
+    cache.put(cache.key((b"y", (1, 1)), 0, 0, 65536), FakeFrame(100))  # evicts the frame at (0, 0)
+    assert cache.file_digest(filename) == digest
+    cache.put(cache.key((b"z", (1, 1)), 0, 0, 65536), FakeFrame(100))  # and the one at (128, 0)
+    assert cache.file_digest(filename) is None
+
+
+def test_cache_metrics(make_dmd, tmp_path):
+    frame_bytes = 256 * 2 + 14  # a single 256x2 image
+    (projector, dmd) = make_dmd(frame_cache_bytes=3 * frame_bytes)
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    filenames = []
+    for index in range(5):
+        filename = str(tmp_path / f"layer{index}.png")
+        Image.fromarray(np.full((2, 256), index, dtype=np.uint8)).save(filename)
+        filenames.append(filename)
+
+    for filename in filenames + filenames[-2:]:
+        dmd.send_image_to_buffer(filename, 0, 0)
+
+    metrics = dmd.metrics.as_dict()
+    assert (metrics["frame_cache_hits"], metrics["frame_cache_misses"]) == (2, 5)
+    assert metrics["frame_cache_evictions"] == 2
+    assert metrics["frame_cache_frames"] == metrics["frame_cache_files"] == 3
+    assert "uv_projector_frame_cache_misses 5" in dmd.metrics.prometheus()
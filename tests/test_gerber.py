@@ -0,0 +1,97 @@
+import numpy as np
+
+from UV_projector.gerber import GerberReader, rasterize_gerber
+from UV_projector.shadow import FRAME_HEIGHT, FRAME_WIDTH
+
+# a flash of every aperture type, tracks with linear and circular (G02/G03) interpolation, a region
+# with an arc, and a clear flash on top of the region
+BOARD = """G04 small test board*
+%FSLAX26Y26*%
+%MOMM*%
+%ADD10C,0.5*%
+%ADD11R,1.0X0.6*%
+%ADD12O,1.2X0.6*%
+%ADD13O,0.4X1.0*%
+%LPD*%
+D11*
+X1000000Y1000000D03*
+D12*
+X3000000Y1000000D03*
+D13*
+X4500000Y1000000D03*
+D10*
+X1000000Y3000000D02*
+G01*
+X5000000Y3000000D01*
+G75*
+G03*
+X7000000Y5000000I0J2000000D01*
+G02*
+X9000000Y7000000I2000000J0D01*
+G36*
+G01*
+X2000000Y5000000D02*
+X4000000Y5000000D01*
+G03*
+X4000000Y7000000I0J1000000D01*
+G01*
+X2000000Y7000000D01*
+X2000000Y5000000D01*
+G37*
+%LPC*%
+D10*
+X3000000Y6000000D03*
+%LPD*%
+D11*
+X6000000Y7500000D03*
+M02*
+"""
+
+
+def brute_force(polygons, polarities, width, height):
+    """Even-odd point in polygon test of every pixel center, applying the polygons in order."""
+    (px, py) = np.meshgrid(np.arange(width) + 0.5, np.arange(height) + 0.5, indexing="ij")
+    image = np.zeros((width, height), dtype=bool)
+    for (polygon, dark) in zip(polygons, polarities):
+        inside = np.zeros((width, height), dtype=bool)
+        for ((x0, y0), (x1, y1)) in zip(polygon, np.roll(polygon, -1, axis=0)):
+            if y0 == y1:
+                continue
+            crosses = (py >= min(y0, y1)) & (py < max(y0, y1))
+            x = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+            inside ^= crosses & (px < x)
+        if dark:
+            image |= inside
+        else:
+            image &= ~inside
+    return image
+
+
+def test_raster_matches_point_in_polygon(tmp_path):
+    path = tmp_path / "board.gbr"
+    path.write_text(BOARD)
+    (pixel_size, xoffset, yoffset) = (0.05, 5, 3)
+    tiles = rasterize_gerber(path, pixel_size, xoffset, yoffset)
+
+    frame = np.zeros((FRAME_WIDTH, FRAME_HEIGHT), dtype=np.uint8)
+    for (pixel_data, x, y) in tiles:
+        assert x % 128 == 0 and y % 2 == 0
+        frame[x:x + pixel_data.shape[0], y:y + pixel_data.shape[1]] = pixel_data
+
+    # the same polygons, placed like rasterize_gerber() does
+    reader = GerberReader().parse(BOARD)
+    points = np.vstack(reader.polygons)
+    (x_min, y_max) = (points[:, 0].min(), points[:, 1].max())
+    polygons = [np.column_stack(((polygon[:, 0] - x_min) / pixel_size + xoffset, (y_max - polygon[:, 1]) / pixel_size + yoffset))
+                for polygon in reader.polygons]
+    assert reader.polarities.count(False) == 1
+
+    (width, height) = (256, 256)  # covers the board of about 9.5 x 7.4 mm
+    assert not frame[width:].any() and not frame[:, height:].any()
+    expected = brute_force(polygons, reader.polarities, width, height)
+    assert np.count_nonzero(frame[:width, :height] != expected * 255) == 0
+
+    # the clear flash made a hole in the region
+    def pixel(x_mm, y_mm):
+        return frame[int((x_mm - x_min) / pixel_size + xoffset), int((y_max - y_mm) / pixel_size + yoffset)]
+    assert (pixel(2.5, 6.0), pixel(3.0, 6.0), pixel(4.5, 6.0)) == (255, 0, 255)
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from UV_projector.gpio_events import PinEvents, SimulatedGPIO
+
+PIN = 13
+
+
+def make_events():
+    gpio = SimulatedGPIO()
+    gpio.setup(PIN, gpio.IN)
+    return (gpio, PinEvents(gpio, [PIN]))
+
+
+def test_wait_returns_right_away_at_the_level():
+    (gpio, events) = make_events()
+    gpio.set_input(PIN, gpio.HIGH)
+    assert events.wait_for(PIN, gpio.HIGH, timeout=0) < 0.01
+
+
+def test_wait_wakes_up_on_the_edge():
+    (gpio, events) = make_events()
+    seen = []
+    events.add_listener(PIN, lambda pin, level, timestamp: seen.append((pin, level)))
+    threading.Timer(0.05, gpio.set_input, (PIN, gpio.HIGH)).start()
+
+    waited = events.wait_for(PIN, gpio.HIGH, timeout=1)
+
+    assert 0.04 < waited < 0.5
+    assert seen == [(PIN, gpio.HIGH)]
+    (timestamp, level) = events.last_change(PIN)
+    assert level == gpio.HIGH and timestamp <= time.perf_counter()
+    assert events.latencies[PIN]["wake_latency"] < 0.1
+
+
+def test_wait_times_out():
+    (gpio, events) = make_events()
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        events.wait_for(PIN, gpio.HIGH, timeout=0.05)
+    assert time.perf_counter() - start >= 0.05
+    assert events.last_change(PIN) is None
+
+
+def test_close_stops_the_edge_callbacks():
+    (gpio, events) = make_events()
+    events.close()
+    gpio.set_input(PIN, gpio.HIGH)
+    assert events.last_change(PIN) is None
+
+
+def test_close_stops_listening_for_edges(make_dmd):
+    (projector, dmd) = make_dmd()
+    pins = [dmd.HOST_IRQ, dmd.SYS_RDY, dmd.SPI_RDY, dmd.PRINT_ACTIVE]
+    assert all(pin in projector.gpio._callbacks for pin in pins)
+    dmd.close()
+    assert not any(pin in projector.gpio._callbacks for pin in pins)
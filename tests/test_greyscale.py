@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from UV_projector.greyscale import MAX_EXPOSURE_FRAMES, GreyscaleSequence, dose_to_frames
+
+
+@pytest.mark.parametrize("mode", ["bitplane", "threshold"])
+@pytest.mark.parametrize("max_frames", [240, 70000])
+def test_planes_reconstruct_the_dose(mode, max_frames):
+    (x, y) = np.meshgrid(np.linspace(0, 1, 256), np.linspace(0, 1, 40), indexing="ij")
+    dose = 3.5 * (np.sin(6 * x) ** 2 * y + np.random.default_rng(0).random(x.shape) * 0.1)
+    frames = dose_to_frames(dose, max_frames)
+
+    sequence = GreyscaleSequence(frames, mode=mode)
+    total = np.zeros(dose.shape, dtype=np.int64)
+    for (pixel_data, exposure_frames) in sequence.layers():
+        assert 0 < exposure_frames <= MAX_EXPOSURE_FRAMES
+        assert set(np.unique(pixel_data)) <= {0, 255}  # binary planes
+        total += (pixel_data > 0) * exposure_frames
+
+    assert np.array_equal(total, frames)
+    assert sequence.total_frames == sum(exposure_frames for (_, exposure_frames) in sequence.layers())
+    # quantised to half a frame of the maximum dose
+    assert np.abs(total * dose.max() / max_frames - dose).max() <= dose.max() / max_frames / 2 + 1e-9
@@ -0,0 +1,80 @@
+import re
+
+import numpy as np
+import pytest
+
+from UV_projector.controller import Mode
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{le="([^"]+)"\})? (\S+)$')
+
+
+def parse_exposition(text):
+    """{metric name: type} and a list of (name, le, value) samples of the Prometheus text format."""
+    types = {}
+    samples = []
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            (_, _, name, kind) = line.split(" ")
+            assert name not in types, f"{name} is declared twice"
+            types[name] = kind
+        else:
+            match = SAMPLE.match(line)
+            assert match, f"not a valid sample line: {line!r}"
+            samples.append((match.group(1), match.group(3), float(match.group(4))))
+    return (types, samples)
+
+
+@pytest.mark.parametrize("batching", [False, True])
+def test_counters_of_an_upload(make_dmd, batching):
+    kwargs = {"spi_batching": True, "spi_bufsiz": 1 << 20} if batching else {}
+    (projector, dmd) = make_dmd(**kwargs)
+    if batching:
+        projector.spi.bufsiz = 1 << 20
+        dmd.spi_writer.ioctl = projector.spi.ioctl
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    dmd.metrics.reset()
+    (transfers, messages, received) = (projector.spi.transfers, projector.spi.messages, projector.spi.bytes_received)
+
+    pixel_data = np.random.default_rng(0).integers(0, 256, (2560, 1440), dtype=np.uint8)
+    dmd.send_pixeldata_to_buffer(pixel_data, 0, 0)
+    plan = dmd.encoder.plan(0, 0, pixel_data)
+
+    metrics = dmd.metrics.as_dict()
+    assert metrics["frames_sent_total"] == 1
+    assert metrics["spi_transfers_total"] == plan.num_transfers == projector.spi.transfers - transfers
+    assert metrics["spi_syscalls_total"] == projector.spi.messages - messages
+    if batching:
+        assert metrics["spi_syscalls_total"] == -(-plan.num_transfers // dmd.spi_writer.transfers_per_message(dmd.SPI_BUFFERSIZE))
+    else:
+        assert metrics["spi_syscalls_total"] == plan.num_transfers
+    assert metrics["spi_bytes_total"] == plan.total_size() == projector.spi.bytes_received - received
+    assert metrics["spi_frame_seconds"]["count"] == 1
+
+
+def test_prometheus_exposition(make_dmd):
+    (projector, dmd) = make_dmd()
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    dmd.metrics.reset()
+    dmd.send_pixeldata_to_buffer(np.full((256, 64), 255, dtype=np.uint8), 0, 0)
+
+    (types, samples) = parse_exposition(dmd.metrics.prometheus())
+    values = {name: value for (name, le, value) in samples if le is None}
+    assert types["uv_projector_frames_sent_total"] == "counter"
+    assert values["uv_projector_frames_sent_total"] == 1
+    assert values["uv_projector_spi_bytes_total"] == projector.spi.bytes_received
+    assert types["uv_projector_spi_throughput_mbps_last"] == "gauge"
+    assert "uv_projector_i2c_transactions" in values  # from the register map collector
+
+    # every histogram has increasing cumulative buckets, ending with +Inf at its count
+    for (name, kind) in types.items():
+        if kind != "histogram":
+            continue
+        buckets = [(le, value) for (sample, le, value) in samples if sample == name + "_bucket"]
+        assert buckets[-1][0] == "+Inf"
+        bounds = [float(le) for (le, _) in buckets[:-1]]
+        assert bounds == sorted(bounds)
+        counts = [value for (_, value) in buckets]
+        assert counts == sorted(counts)
+        assert counts[-1] == values[name + "_count"]
+        assert name + "_sum" in values
+    assert values["uv_projector_spi_frame_seconds_count"] == 1
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from UV_projector.controller import DLPC1438, Mode
+from UV_projector.correction import IntensityCorrection
+from UV_projector.emulator import EmulatedProjector, TimingModel
+from UV_projector.multihead import MultiHead
+
+SECOND_HEAD_PINS = {"PROJ_ON": 12, "SYS_RDY": 16, "HOST_IRQ": 20, "SPI_RDY": 21, "PRINT_ACTIVE": 26}
+
+
+@pytest.fixture
+def heads():
+    """Two heads on the pins of a single (simulated) raspberry pi."""
+    timing = TimingModel(boot_time=0.01, mode_switch_time=0.01, time_scale=0.1)
+    projectors = [EmulatedProjector(timing=timing), EmulatedProjector(timing=timing, pins=SECOND_HEAD_PINS)]
+    gpio = projectors[0].gpio
+    projectors[1].gpio = gpio
+    gpio.add_output_listener(projectors[1]._on_output)
+
+    dmds = [DLPC1438(projectors[0].i2c, projectors[0].spi, gpio=gpio, spi_bufsiz=65536),
+            DLPC1438(projectors[1].i2c, projectors[1].spi, gpio=gpio, spi_bufsiz=65536, pins=SECOND_HEAD_PINS)]
+    for dmd in dmds:
+        dmd.switch_mode(Mode.EXTERNALPRINT)
+    yield (projectors, dmds)
+
+    for dmd in dmds:
+        dmd.close()
+
+
+def test_pins_of_every_head(heads):
+    (projectors, dmds) = heads
+    assert (dmds[0].PROJ_ON, dmds[0].PRINT_ACTIVE) == (5, 13)
+    assert (dmds[1].PROJ_ON, dmds[1].PRINT_ACTIVE) == (12, 26)
+    assert DLPC1438.PROJ_ON == 5  # the defaults of the class are left alone
+
+    # an exposure on the second head only shows up on its own PRINT_ACTIVE pin
+    dmds[1].expose_pattern(-1, dark_frames=0)
+    gpio = projectors[0].gpio
+    assert (gpio.input(dmds[0].PRINT_ACTIVE), gpio.input(dmds[1].PRINT_ACTIVE)) == (gpio.LOW, gpio.HIGH)
+    dmds[1].stop_exposure()
+    assert projectors[0].exposures == [] and len(projectors[1].exposures) == 1
+
+
+def test_unknown_pin():
+    projector = EmulatedProjector(powered=True)
+    with pytest.raises(AssertionError, match="Unknown pin"):
+        DLPC1438(projector.i2c, projector.spi, gpio=projector.gpio, spi_bufsiz=65536, pins={"LED": 4})
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_run_on_all_heads(heads, processes):
+    (projectors, dmds) = heads
+    rng = np.random.default_rng(0)
+    layers = [([rng.integers(0, 256, (256, 16), dtype=np.uint8) for _ in dmds], 2) for _ in range(3)]
+
+    with MultiHead(dmds, processes=processes) as multihead:
+        timings = multihead.run(layers, dark_frames=0)
+
+    assert len(timings) == len(layers)
+    for (head, projector) in enumerate(projectors):
+        assert len(projector.exposures) == len(layers)
+        assert np.array_equal(projector.displayed_image()[:256, :16], layers[-1][0][head])
+
+
+def test_transforms_are_sent_to_the_workers_once(heads):
+    (projectors, dmds) = heads
+    correction = IntensityCorrection(lut=255 - np.arange(256))
+    dmds[0].set_correction(correction)
+    pattern = np.random.default_rng(0).integers(0, 256, (256, 16), dtype=np.uint8)
+
+    with MultiHead(dmds, processes=1) as multihead:
+        submitted = []
+        submit = multihead._encode_pool.submit
+
+        def record(function, *args):
+            submitted.append(args)
+            return submit(function, *args)
+        multihead._encode_pool.submit = record
+
+        multihead.run([([pattern, pattern], 2)] * 2, dark_frames=0)
+        assert not any(arg is correction for args in submitted for arg in args)
+        assert np.array_equal(projectors[0].displayed_image()[:256, :16], 255 - pattern)
+        assert np.array_equal(projectors[1].displayed_image()[:256, :16], pattern)
+
+        # a transform that changed after the workers started is sent along with the layer
+        dmds[0].set_correction(None)
+        multihead.run([([pattern, pattern], 2)], dark_frames=0)
+        assert np.array_equal(projectors[0].displayed_image()[:256, :16], pattern)
+
+
+@pytest.mark.parametrize(("failing_step", "failing_call"), [("send_encoded_frame", 2), ("expose_pattern", 1)])
+def test_failing_head_stops_all_exposures(heads, failing_step, failing_call):
+    (projectors, dmds) = heads
+    pattern = np.zeros((256, 16), dtype=np.uint8)
+    original = getattr(dmds[1], failing_step)
+    calls = []
+
+    def fail(*args):
+        calls.append(args)
+        if len(calls) == failing_call:
+            raise OSError("head 1 is gone")
+        return original(*args)
+    setattr(dmds[1], failing_step, fail)
+
+    gpio = projectors[0].gpio
+    with MultiHead(dmds, processes=0) as multihead:
+        with pytest.raises(OSError, match="head 1 is gone"):
+            multihead.run([([pattern, pattern], 10000)] * 3, dark_frames=0)
+
+    assert [gpio.input(dmd.PRINT_ACTIVE) for dmd in dmds] == [gpio.LOW, gpio.LOW]
+    # the first head was exposing the first layer when the second one failed
+    assert len(projectors[0].exposures) == 1
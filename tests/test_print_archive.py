@@ -0,0 +1,78 @@
+import io
+import zipfile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from UV_projector.print_archive import PrintArchive
+
+CONFIG = """jobDir = job
+expTime = 2
+expTimeFirst = 10
+numFade = 2
+layerHeight = 0.05
+"""
+
+
+def png(pixel_data):
+    """PNG of a (width, height) array."""
+    output = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(pixel_data.T)).save(output, format="PNG")
+    return output.getvalue()
+
+
+def layer_image(index, width=20, height=30):
+    pixel_data = np.full((width, height), index, dtype=np.uint8)
+    pixel_data[0, 0] = 255  # a corner, to check the orientation
+    return pixel_data
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / "job.sl1"
+    with zipfile.ZipFile(path, "w") as output:
+        output.writestr("config.ini", CONFIG)
+        for index in range(12):  # job0.png ... job11.png, not zero-padded
+            output.writestr(f"job{index}.png", png(layer_image(index)))
+        output.writestr("thumbnail/thumbnail400x400.png", png(np.zeros((4, 4), dtype=np.uint8)))
+    return path
+
+
+def test_layers_in_order(archive):
+    with PrintArchive(archive, prefetch=2) as job:
+        assert len(job) == 12
+        layers = list(job.layers())
+
+    assert [int(pixel_data[1, 1]) for (pixel_data, _) in layers] == list(range(12))
+    assert all(np.array_equal(pixel_data, layer_image(index)) for (index, (pixel_data, _)) in enumerate(layers))
+    # expTimeFirst fading to expTime over numFade layers, at 60 frames per second
+    assert [frames for (_, frames) in layers] == [600, 360] + [120] * 10
+
+
+def test_start_and_stop(archive):
+    with PrintArchive(archive) as job:
+        layers = list(job.layers(start=3, stop=7))
+    assert [int(pixel_data[1, 1]) for (pixel_data, _) in layers] == [3, 4, 5, 6]
+
+
+def test_rotate(archive):
+    with PrintArchive(archive, rotate=True) as job:
+        (pixel_data, _) = next(job.layers())
+    assert pixel_data.shape == (30, 20)
+    assert np.array_equal(pixel_data, np.rot90(layer_image(0)))
+
+
+def test_prefetch_errors_reach_the_caller(tmp_path):
+    path = tmp_path / "broken.sl1"
+    with zipfile.ZipFile(path, "w") as output:
+        output.writestr("config.ini", CONFIG)
+        for index in range(5):
+            output.writestr(f"job{index}.png", png(layer_image(index)) if index != 3 else b"not a png")
+
+    received = []
+    with PrintArchive(path, prefetch=3) as job:
+        with pytest.raises(OSError):  # PIL.UnidentifiedImageError
+            for (pixel_data, _) in job.layers():
+                received.append(int(pixel_data[1, 1]))
+    assert received == [0, 1, 2]
@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+import pytest
+
+from UV_projector.controller import Mode
+from UV_projector.layer_stack import LayerStack, write_layer_stack
+from UV_projector.print_job import PrintEngine
+
+
+def make_layers(count=5, exposure_frames=2):
+    return [(np.full((256, 16), 255, dtype=np.uint8), exposure_frames) for _ in range(count)]
+
+
+def test_cancel_before_run(make_dmd):
+    (projector, dmd) = make_dmd()
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+
+    engine = PrintEngine(dmd)
+    engine.cancel()  # e.g. the daemon cancelling a job between dequeuing and running it
+    timings = engine.run(make_layers())
+
+    assert timings == []
+    assert projector.exposures == []
+    assert engine.cancelled
+
+    # the cancel() was for that job only
+    assert len(engine.run(make_layers(count=2))) == 2
+    assert not engine.cancelled
+
+
+def test_upload_error_stops_exposure(make_dmd, monkeypatch):
+    (projector, dmd) = make_dmd()
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+
+    engine = PrintEngine(dmd, prefetch=1)
+    workers = []
+    prepare_layers = engine._prepare_layers
+
+    def record_worker(*args):
+        workers.append(threading.current_thread())
+        prepare_layers(*args)
+    monkeypatch.setattr(engine, "_prepare_layers", record_worker)
+
+    send_encoded_frame = dmd.send_encoded_frame
+    uploads = []
+
+    def failing_upload(frame):
+        uploads.append(frame)
+        if len(uploads) == 2:
+            raise IOError("SPI transfer failed")
+        send_encoded_frame(frame)
+    monkeypatch.setattr(dmd, "send_encoded_frame", failing_upload)
+
+    # the first layer is still exposing when the upload of the second one fails
+    with pytest.raises(IOError):
+        engine.run(make_layers(count=5, exposure_frames=600))
+
+    assert len(projector.exposures) == 1
+    assert projector.gpio.input(dmd.PRINT_ACTIVE) == projector.gpio.LOW
+    assert not workers[0].is_alive()
+
+    # the engine can run the next job after a failed one
+    assert len(engine.run(make_layers(count=2))) == 2
+    assert len(projector.exposures) == 3
+
+
+def test_stack_layers_use_their_own_dark_frames(make_dmd, tmp_path):
+    (projector, dmd) = make_dmd()
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    pixel_data = np.zeros((2560, 1440), dtype=np.uint8)
+    pixel_data[300:400, 10:20] = 255
+    write_layer_stack(tmp_path / "job.stack", [(pixel_data, 2)] * 2, dark_frames=1)
+
+    engine = PrintEngine(dmd, dark_frames=5)
+    engine.run(LayerStack(tmp_path / "job.stack"))
+
+    assert [(dark, exposed) for (_, _, dark, exposed) in projector.exposures] == [(1, 2), (1, 2)]
+
+
+def test_cancel_of_a_running_job_does_not_cancel_the_next(make_dmd):
+    (projector, dmd) = make_dmd()
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    engine = PrintEngine(dmd, dark_frames=0, progress=lambda timing: engine.cancel())
+
+    assert len(engine.run(make_layers(count=3, exposure_frames=600))) == 1
+    assert engine.cancelled
+    engine.progress = None
+    assert len(engine.run(make_layers(count=2))) == 2
+    assert not engine.cancelled
@@ -0,0 +1,62 @@
+import json
+
+import numpy as np
+
+from UV_projector.controller import Mode
+from UV_projector.layer_stack import LayerStack, write_layer_stack
+
+
+def test_send_regions_stats_are_json_serialisable(make_dmd):
+    (projector, dmd) = make_dmd()
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    tile = np.full((200, 10), 255, dtype=np.uint8)
+    # offsets as numpy integers, like the tiles of rasterize_gerber()
+    placements = [(tile, np.int64(5), np.int64(3)), (tile, np.int64(700), np.int64(300))]
+
+    stats = dmd.send_regions(placements)
+
+    assert all(type(value) is int for value in stats.values())
+    assert json.loads(json.dumps(stats)) == stats
+    assert np.array_equal(projector.inactive_image()[5:205, 3:13], tile)
+
+
+def test_stack_layers_clear_what_send_regions_left(make_dmd, tmp_path):
+    (projector, dmd) = make_dmd()
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    dmd.set_background(0, both_buffers=True)
+
+    frames = [np.zeros((2560, 1440), dtype=np.uint8) for _ in range(3)]
+    frames[0][100:300, 50:90] = 200
+    frames[1][1000:1100, 600:700] = 100
+    write_layer_stack(tmp_path / "job.stack", [(frame, 1) for frame in frames])
+    stack = LayerStack(tmp_path / "job.stack")
+    tile = np.full((150, 20), 255, dtype=np.uint8)
+
+    def expect(*placements):
+        expected = np.zeros((2560, 1440), dtype=np.uint8)
+        for (pixel_data, x, y) in placements:
+            expected[x:x + pixel_data.shape[0], y:y + pixel_data.shape[1]] = pixel_data
+        assert np.array_equal(projector.inactive_image(), expected)
+
+    dmd.send_stack_layer(stack[0])
+    dmd.send_regions([(tile, 2000, 1200)])
+    expect((frames[0], 0, 0), (tile, 2000, 1200))
+
+    # the other buffer only had a background
+    dmd.swap_buffer()
+    dmd.send_stack_layer(stack[1])
+    expect((frames[1], 0, 0))
+    dmd.send_regions([(tile, 400, 900)])
+
+    dmd.swap_buffer()
+    dmd.send_stack_layer(stack[1])
+    expect((frames[1], 0, 0))
+    dmd.send_regions([(tile, 1500, 10)])
+    expect((frames[1], 0, 0), (tile, 1500, 10))
+
+    dmd.swap_buffer()
+    dmd.send_stack_layer(stack[2])  # empty
+    expect()
+    dmd.swap_buffer()
+    dmd.send_stack_layer(stack[0])
+    expect((frames[0], 0, 0))
@@ -0,0 +1,68 @@
+import pytest
+
+from UV_projector import registers
+from UV_projector.controller import Mode
+from UV_projector.registers import RegisterMap
+
+
+class FakeI2C:
+    """I2C bus with a single device that stores what is written (optionally dropping writes)."""
+
+    def __init__(self, drop_writes=False):
+        self.values = {}
+        self.drop_writes = drop_writes
+        self.writes = []
+
+    def read_byte(self, addr):
+        return 0xFF
+
+    def read_i2c_block_data(self, addr, command, length):
+        return self.values.get(command, [0] * length)
+
+    def write_i2c_block_data(self, addr, command, data):
+        self.writes.append((command, data))
+        if not self.drop_writes:
+            self.values[command + 1] = list(data)  # the read opcode follows the write opcode
+
+
+def test_unchanged_writes_are_elided():
+    i2c = FakeI2C()
+    register_map = RegisterMap(i2c, 0x1B)
+
+    assert register_map.write(registers.FPGA_CONTROL, [0b10])
+    assert not register_map.write(registers.FPGA_CONTROL, [0b10])
+    assert register_map.write(registers.FPGA_CONTROL, [0b10], force=True)
+    assert register_map.read(registers.FPGA_CONTROL) == [0b10]
+
+    assert len(i2c.writes) == 2
+    assert register_map.stats() == {"transactions": 2, "reads": 0, "writes": 2, "elided_writes": 1}
+
+
+def test_invalidate_forgets_the_shadow():
+    i2c = FakeI2C()
+    register_map = RegisterMap(i2c, 0x1B)
+    register_map.write(registers.LED_CURRENT, [1, 2, 3, 4, 5, 6])
+    register_map.invalidate([registers.LED_CURRENT])
+    assert register_map.write(registers.LED_CURRENT, [1, 2, 3, 4, 5, 6])
+
+
+def test_verification_catches_a_lost_write():
+    register_map = RegisterMap(FakeI2C(drop_writes=True), 0x1B, verify=True)
+    with pytest.raises(Exception, match="Verification of FPGA_CONTROL failed"):
+        register_map.write(registers.FPGA_CONTROL, [0b10])
+    # the shadow holds what was read back, so the write is not elided next time
+    assert register_map.write(registers.FPGA_CONTROL, [0b10], verify=False)
+
+
+def test_configuring_twice_sends_nothing(make_dmd):
+    (projector, dmd) = make_dmd(verify_registers=True)
+    dmd.configure_external_print(LED_PWM=1000)
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    writes = len(projector.i2c.log)
+
+    dmd.configure_external_print(LED_PWM=1000)
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    assert len(projector.i2c.log) == writes
+
+    dmd.configure_external_print(LED_PWM=500)
+    assert [command for (command, _) in projector.i2c.log[writes:]] == [registers.LED_CURRENT.write]
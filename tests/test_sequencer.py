@@ -0,0 +1,56 @@
+import itertools
+import time
+
+import numpy as np
+
+from UV_projector.controller import Mode
+from UV_projector.emulator import TimingModel
+from UV_projector.sequencer import Sequencer
+
+FRAMES = [1, 2, 1, 3, 1, 1, 2, 1]
+
+
+def make_patterns():
+    rng = np.random.default_rng(0)
+    return [((rng.integers(0, 256, (256, 16), dtype=np.uint8), 128 * step, 2 * step), frames)
+            for (step, frames) in enumerate(FRAMES)]
+
+
+def test_continuous_mode_shows_every_pattern_for_its_frames(make_dmd):
+    # real time frame clock, the swaps are timed on it
+    (projector, dmd) = make_dmd(timing=TimingModel(boot_time=0.01, mode_switch_time=0.01))
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+
+    sequencer = Sequencer(dmd, mode="continuous")
+    sequencer.calibrate()
+    timings = sequencer.run(make_patterns())
+
+    # every pattern is its own (buffer, image) in the frames shown: runs of the same one are
+    # the frames a pattern was shown for, a write into the shown buffer would split a run
+    shown = [(key, len(list(run))) for (key, run) in itertools.groupby(projector.shown_frames())]
+    assert len(shown) == len(FRAMES)
+    assert [buffer for ((buffer, _), _) in shown] == [(shown[0][0][0] + step) % 2 for step in range(len(FRAMES))]
+
+    # a late swap shows the previous pattern for longer, as reported by the sequencer
+    expected = [frames + timing.dropped_frames for (frames, timing) in zip(FRAMES, timings[1:])]
+    assert [length for (_, length) in shown[:-1]] == expected
+    # the exposure is stopped from the host, which may only happen in the frame after the final one
+    assert shown[-1][1] in (FRAMES[-1], FRAMES[-1] + 1)
+
+
+def test_swap_takes_effect_at_the_next_frame(make_dmd):
+    (projector, dmd) = make_dmd(timing=TimingModel(boot_time=0.01, mode_switch_time=0.01))
+    dmd.switch_mode(Mode.EXTERNALPRINT)
+    shown = projector.active_buffer
+
+    dmd.expose_pattern(-1, dark_frames=0)
+    first = projector.shown_frames()  # nothing shown yet, the exposure starts at the next frame
+    (start, _) = projector._exposure_frames[-1]
+    # swap in the middle of the first exposed frame
+    time.sleep(max(start + projector.frame_period / 2 - time.perf_counter(), 0))
+    dmd.swap_buffer()
+    time.sleep(max(start + 2.5 * projector.frame_period - time.perf_counter(), 0))
+    dmd.stop_exposure()
+
+    assert first == []
+    assert [buffer for (buffer, _) in projector.shown_frames()] == [shown, 1 - shown, 1 - shown]
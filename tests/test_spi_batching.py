@@ -0,0 +1,66 @@
+import numpy as np
+
+from UV_projector.controller import DLPC1438
+from UV_projector.emulator import EmulatedProjector, TimingModel
+from UV_projector.spi_ioctl import decode_message
+
+
+class RecordingIoctl:
+    """Fake ioctl that keeps the bytes of every transfer, as they are on the wire when submitted."""
+
+    def __init__(self, spi):
+        self.spi = spi
+        self.transfers = []
+        self.messages = []
+
+    def __call__(self, fd, request, transfers):
+        message = decode_message(request, transfers)
+        self.messages.append(len(message))
+        self.transfers += [data for (data, _) in message]
+        self.spi.ioctl(fd, request, transfers)
+
+
+SPI_BUFSIZ = 4 * 1024 * 1024
+
+
+def make_controller(**kwargs):
+    projector = EmulatedProjector(timing=TimingModel(boot_time=0.01, mode_switch_time=0.01), bufsiz=SPI_BUFSIZ)
+    dmd = DLPC1438(projector.i2c, projector.spi, gpio=projector.gpio, spi_bufsiz=SPI_BUFSIZ, **kwargs)
+    return (projector, dmd)
+
+
+def scattered_updates(base, count=1000):
+    """Change `count` separate 128x2 blocks (with an unchanged block between them) of base."""
+    updated = base.copy()
+    rng = np.random.default_rng(1)
+    blocks = [(col, row) for col in range(0, 20, 2) for row in range(0, 720, 2)]
+    for index in rng.choice(len(blocks), count, replace=False):
+        (col, row) = blocks[index]
+        updated[col * 128:(col + 1) * 128, row * 2:(row + 1) * 2] ^= 0xFF
+    return updated
+
+
+def test_batched_dirty_update_queues_more_transfers_than_the_pool():
+    base = np.random.default_rng(0).integers(0, 256, (2560, 1440), dtype=np.uint8)
+    updated = scattered_updates(base)
+
+    (projector, dmd) = make_controller(dirty_tracking=True, spi_batching=True)
+    ioctl = RecordingIoctl(projector.spi)
+    dmd.spi_writer.ioctl = ioctl
+    dmd.send_pixeldata_to_buffer(base, 0, 0)
+    dmd.send_pixeldata_to_buffer(updated, 0, 0)
+
+    # the same updates sent one writebytes2 call per transfer
+    (reference_projector, reference) = make_controller(dirty_tracking=True, spi_transfer_size=dmd.SPI_BUFFERSIZE)
+    sent = []
+    write = reference_projector.spi.writebytes2
+    reference_projector.spi.writebytes2 = lambda data: (sent.append(bytes(data)), write(data))
+    reference.send_pixeldata_to_buffer(base, 0, 0)
+    reference.send_pixeldata_to_buffer(updated, 0, 0)
+
+    assert len(ioctl.transfers) > len(dmd.encoder.pool)
+    assert ioctl.transfers == sent
+    assert np.array_equal(projector.inactive_image(), updated)
+
+    dmd.close()
+    reference.close()
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from UV_projector.warp import WarpMap, affine
+
+(WIDTH, HEIGHT) = (512, 64)  # a small frame, so the maps are quick to compute
+
+
+def place(pixel_data, xoffset, yoffset):
+    frame = np.zeros((WIDTH, HEIGHT), dtype=np.uint8)
+    frame[xoffset:xoffset + pixel_data.shape[0], yoffset:yoffset + pixel_data.shape[1]] = pixel_data
+    return frame
+
+
+@pytest.fixture
+def pattern():
+    return np.random.default_rng(0).integers(1, 256, (150, 30), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("bilinear", [False, True])
+def test_identity(pattern, bilinear):
+    warp = WarpMap(np.eye(3), bilinear=bilinear, width=WIDTH, height=HEIGHT)
+    (warped, x, y) = warp.apply(pattern, 130, 9)
+    assert (x % 128, y % 16) == (0, 0)
+    assert np.array_equal(place(warped, x, y), place(pattern, 130, 9))
+
+
+@pytest.mark.parametrize("bilinear", [False, True])
+def test_integer_translation(pattern, bilinear):
+    warp = WarpMap(affine(xoffset=37, yoffset=-5), bilinear=bilinear, width=WIDTH, height=HEIGHT)
+    (warped, x, y) = warp.apply(pattern, 100, 20)
+    assert np.array_equal(place(warped, x, y), place(pattern, 137, 15))
+
+
+def test_pattern_outside_the_frame(pattern):
+    warp = WarpMap(affine(xoffset=-400), width=WIDTH, height=HEIGHT)
+    assert warp.apply(pattern, 100, 20) is None
+    assert warp.apply(np.zeros((10, 10), dtype=np.uint8)) is None